@@ -0,0 +1,102 @@
+"""
+患者活动的增量统计
+上传活动时更新最近 1 小时 / 24 小时 / 7 天三个滑动窗口的分类计数和 24 小时分时直方图，
+时间推进时从窗口中移出过期事件；查询时不再扫描、不再解析历史记录
+"""
+import heapq
+import time
+import logging
+from datetime import datetime
+from threading import Lock
+
+from storage import parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+
+class _Window:
+    """一个滑动窗口：最小堆按时间保存窗口内的事件，堆顶最先过期"""
+    def __init__(self, span, hourly=False):
+        self.span = span
+        self.heap = []  # (ts, activity_type, hour)
+        self.counts = {}
+        self.hourly = [0] * 24 if hourly else None
+
+    def add(self, ts, atype, hour):
+        # 先更新计数再入堆，计数失败时堆中不会留下孤立的事件
+        self.counts[atype] = self.counts.get(atype, 0) + 1
+        if self.hourly is not None:
+            self.hourly[hour] += 1
+        heapq.heappush(self.heap, (ts, atype, hour))
+
+    def expire(self, now):
+        cutoff = now - self.span
+        heap = self.heap
+        while heap and heap[0][0] <= cutoff:
+            _, atype, hour = heapq.heappop(heap)
+            n = self.counts[atype] - 1
+            if n:
+                self.counts[atype] = n
+            else:
+                del self.counts[atype]
+            if self.hourly is not None:
+                self.hourly[hour] -= 1
+
+
+class ActivityAggregator:
+    """/get_activity_stats 的增量聚合器，每条活动只在上传时解析一次时间"""
+    def __init__(self):
+        self._lock = Lock()
+        self._hour = _Window(3600)
+        self._day = _Window(86400, hourly=True)
+        self._week = _Window(7 * 86400)
+        self._windows = (self._hour, self._day, self._week)
+
+    def add(self, activity, now=None):
+        """计入一条活动，返回是否计入；时间无法解析或活动类型不是字符串的记录被忽略"""
+        ts = parse_timestamp(activity.get('timestamp'))
+        atype = activity.get('activity_type', 'other')
+        if ts is None or not isinstance(atype, str):
+            return False
+        try:
+            hour = datetime.fromtimestamp(ts).hour
+        except (ValueError, OverflowError, OSError):
+            return False
+        now = time.time() if now is None else now
+        with self._lock:
+            for window in self._windows:
+                if ts > now - window.span:
+                    window.add(ts, atype, hour)
+        return True
+
+    def load(self, activities):
+        """从历史记录构建统计，跳过格式错误的记录"""
+        now = time.time()
+        skipped = 0
+        for activity in activities:
+            if not isinstance(activity, dict) or not self.add(activity, now):
+                skipped += 1
+        if skipped:
+            logger.warning(f"活动统计跳过 {skipped} 条格式错误的记录")
+
+    def snapshot(self):
+        """返回与原 /get_activity_stats 相同结构的统计结果（不含 timestamp）"""
+        now = time.time()
+        with self._lock:
+            for window in self._windows:
+                window.expire(now)
+            return {
+                'hour': {
+                    'count': len(self._hour.heap),
+                    'by_type': dict(self._hour.counts),
+                },
+                'day': {
+                    'count': len(self._day.heap),
+                    'by_type': dict(self._day.counts),
+                    'hourly': list(self._day.hourly),  # 24小时数据，供图表使用
+                },
+                'week': {
+                    'count': len(self._week.heap),
+                    'by_type': dict(self._week.counts),
+                },
+            }
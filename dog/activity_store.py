@@ -0,0 +1,255 @@
+"""
+患者活动的列式存储
+时间戳解析为 epoch 秒后按时间有序存放在 NumPy 数组中，活动类型和描述做字符串驻留（只存编号），
+时间范围用二分查找定位，/get_activity_range 的分桶直方图用 NumPy 向量化计算。
+分层保留的分钟 / 小时汇总也用同样的结构保存，每行带一个计数权重
+"""
+from datetime import datetime, timedelta
+from threading import Lock
+
+import numpy as np
+
+from storage import parse_timestamp
+
+# 预定义的分桶粒度；也可以直接传秒数
+BUCKETS = ('hour', 'day', 'week', 'month')
+MAX_BUCKETS = 5000
+
+
+class _Interner:
+    """
+    字符串 <-> 编号
+    原始数据和各层汇总共用一个实例（各自的锁不同），新增编号时单独加锁；values 只追加，读取不需要锁
+    """
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+        self._lock = Lock()
+
+    def code(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            with self._lock:
+                code = self.codes.get(value)
+                if code is None:
+                    code = len(self.values)
+                    self.values.append(value)
+                    self.codes[value] = code
+        return code
+
+
+def _floor_bucket(dt, bucket):
+    """把本地时间向下取整到分桶边界"""
+    if bucket == 'hour':
+        return dt.replace(minute=0, second=0, microsecond=0)
+    day = dt.replace(hour=0, minute=0, second=0, microsecond=0)
+    if bucket == 'day':
+        return day
+    if bucket == 'week':
+        return day - timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+
+def _next_bucket(dt, bucket):
+    if bucket == 'hour':
+        return dt + timedelta(hours=1)
+    if bucket == 'day':
+        return dt + timedelta(days=1)
+    if bucket == 'week':
+        return dt + timedelta(weeks=1)
+    if dt.month == 12:
+        return dt.replace(year=dt.year + 1, month=1)
+    return dt.replace(month=dt.month + 1)
+
+
+def bucket_edges(start, end, bucket):
+    """
+    返回覆盖 [start, end) 的分桶边界（epoch 秒数组，长度为桶数 + 1）
+    bucket 为 BUCKETS 之一时按本地日历对齐（跨夏令时、月份长度不同也正确），为数字时按固定秒数切分
+    """
+    if not isinstance(bucket, str):
+        n = int(np.ceil((end - start) / bucket)) or 1
+        if n > MAX_BUCKETS:
+            raise ValueError('分桶数量过多')
+        return start + np.arange(n + 1, dtype=np.float64) * bucket
+    dt = _floor_bucket(datetime.fromtimestamp(start), bucket)
+    edges = [dt.timestamp()]
+    while edges[-1] < end:
+        if len(edges) > MAX_BUCKETS:
+            raise ValueError('分桶数量过多')
+        dt = _next_bucket(dt, bucket)
+        edges.append(dt.timestamp())
+    if len(edges) == 1:
+        edges.append(_next_bucket(dt, bucket).timestamp())
+    return np.array(edges, dtype=np.float64)
+
+
+class ActivityStore:
+    """
+    按时间排序的列式活动记录
+    - ts: float64 epoch 秒（有序）
+    - types / descs: int32 驻留编号（type_names 可以在多个 ActivityStore 之间共享）
+    - weights: int32 计数，原始记录为 1，汇总行为该桶该类型的数量
+    追加时按容量倍增预留空间；乱序到达的记录插入到正确位置
+    已写入的位置不会被原地修改，查询可以在锁外使用切片
+    """
+    _COLUMNS = ('_ts', '_types', '_descs', '_weights')
+
+    def __init__(self, capacity=1024, type_names=None):
+        self._lock = Lock()
+        self._n = 0
+        self._ts = np.empty(capacity, dtype=np.float64)
+        self._types = np.empty(capacity, dtype=np.int32)
+        self._descs = np.empty(capacity, dtype=np.int32)
+        self._weights = np.empty(capacity, dtype=np.int32)
+        self.type_names = type_names if type_names is not None else _Interner()
+        self.descriptions = _Interner()
+
+    def __len__(self):
+        return self._n
+
+    def _grow(self, need):
+        capacity = len(self._ts)
+        if need <= capacity:
+            return
+        while capacity < need:
+            capacity *= 2
+        for name in self._COLUMNS:
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[:self._n] = old[:self._n]
+            setattr(self, name, new)
+
+    def add(self, activity):
+        self.extend([activity])
+
+    def extend(self, activities):
+        rows = []
+        for activity in activities:
+            if not isinstance(activity, dict):
+                continue
+            ts = parse_timestamp(activity.get('timestamp'))
+            atype = activity.get('activity_type', 'other')
+            if ts is None or not isinstance(atype, str):
+                # 类型用作驻留表的键，格式错误的记录不进入索引
+                continue
+            desc = activity.get('description', '')
+            rows.append((ts, atype, desc if isinstance(desc, str) else str(desc), 1))
+        self._append(rows)
+
+    def add_counts(self, ts, by_type):
+        """追加一条汇总：{活动类型: 数量}"""
+        self._append([(ts, atype, '', n) for atype, n in by_type.items() if n])
+
+    def _append(self, rows):
+        if not rows:
+            return
+        rows.sort(key=lambda r: r[0])
+        with self._lock:
+            columns = (
+                np.array([r[0] for r in rows], dtype=np.float64),
+                np.array([self.type_names.code(r[1]) for r in rows], dtype=np.int32),
+                np.array([self.descriptions.code(r[2]) for r in rows], dtype=np.int32),
+                np.array([r[3] for r in rows], dtype=np.int32),
+            )
+            n = self._n
+            if n == 0 or columns[0][0] >= self._ts[n - 1]:
+                # 常见情况：按时间顺序追加
+                self._grow(n + len(rows))
+                for name, values in zip(self._COLUMNS, columns):
+                    getattr(self, name)[n:n + len(rows)] = values
+            else:
+                # 乱序：合并成新数组，不修改已有数组
+                pos = np.searchsorted(self._ts[:n], columns[0], side='right')
+                for name, values in zip(self._COLUMNS, columns):
+                    setattr(self, name, np.insert(getattr(self, name)[:n], pos, values))
+            self._n = n + len(rows)
+
+    def prune(self, cutoff):
+        """丢弃早于 cutoff 的记录"""
+        with self._lock:
+            n = self._n
+            drop = int(np.searchsorted(self._ts[:n], cutoff, side='left'))
+            if drop:
+                for name in self._COLUMNS:
+                    setattr(self, name, getattr(self, name)[drop:n].copy())
+                self._n = n - drop
+            return drop
+
+    def _slice(self, start, end):
+        with self._lock:
+            n = self._n
+            ts = self._ts[:n]
+            lo = int(np.searchsorted(ts, start, side='left'))
+            hi = int(np.searchsorted(ts, end, side='left'))
+            return ts[lo:hi], self._types[lo:hi], self._weights[lo:hi]
+
+    def histogram(self, start, end, bucket='day', types=None, older=None):
+        """
+        统计 [start, end) 内的活动
+        返回 {'total', 'by_type', 'buckets': [{'start', 'count', 'by_type'}]}
+        types 为活动类型集合，None 表示全部
+        older 为 (汇总层 ActivityStore, 分界时间)：早于分界的部分从汇总层读取，两者须共享 type_names
+        """
+        if older is None:
+            ts, codes, weights = self._slice(start, end)
+        else:
+            store, boundary = older
+            parts = [store._slice(start, min(boundary, end)), self._slice(max(boundary, start), end)]
+            ts, codes, weights = (np.concatenate(col) for col in zip(*parts))
+        names = list(self.type_names.values)
+        if types is not None:
+            wanted = [names.index(t) for t in types if t in names]
+            mask = np.isin(codes, wanted)
+            ts, codes, weights = ts[mask], codes[mask], weights[mask]
+        edges = bucket_edges(start, end, bucket)
+        n_buckets = len(edges) - 1
+        n_types = len(names)
+        # 每条记录所在的桶（edges[i] <= ts < edges[i + 1]）
+        index = np.searchsorted(edges, ts, side='right') - 1
+        grid = np.bincount(index * n_types + codes, weights=weights, minlength=n_buckets * n_types)
+        grid = grid.astype(np.int64).reshape(n_buckets, n_types)
+        counts = grid.sum(axis=1)
+        totals = grid.sum(axis=0)
+        present = [i for i in range(n_types) if totals[i]]
+        buckets = []
+        for b in range(n_buckets):
+            row = grid[b]
+            buckets.append({
+                'start': datetime.fromtimestamp(edges[b]).isoformat(),
+                'count': int(counts[b]),
+                'by_type': {names[i]: int(row[i]) for i in present if row[i]},
+            })
+        return {
+            'total': int(weights.sum()),
+            'by_type': {names[i]: int(totals[i]) for i in present},
+            'buckets': buckets,
+        }
+
+
+def parse_range_time(value, default):
+    """查询参数中的时间：ISO8601 或 epoch 秒，未传时返回 default"""
+    if value in (None, ''):
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    ts = parse_timestamp(value)
+    if ts is None:
+        raise ValueError(f'无效的时间: {value}')
+    return ts
+
+
+def parse_bucket(value):
+    if value in (None, ''):
+        return 'day'
+    if value in BUCKETS:
+        return value
+    try:
+        seconds = float(value)
+    except ValueError:
+        raise ValueError(f'无效的 bucket: {value}')
+    if seconds <= 0:
+        raise ValueError(f'无效的 bucket: {value}')
+    return seconds
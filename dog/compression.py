@@ -0,0 +1,41 @@
+"""
+HTTP 响应压缩
+按 Accept-Encoding 协商 gzip / brotli（本地安装了 brotli 模块时才启用），
+并提供 SSE 用的流式 gzip（每条事件后 Z_SYNC_FLUSH，客户端可以立即解出完整事件）
+"""
+import gzip
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def negotiate(accept_encodings):
+    """根据请求的 Accept-Encoding 选择编码，返回 'br' / 'gzip' / None"""
+    if brotli is not None and accept_encodings['br']:
+        return 'br'
+    if accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress(body, encoding, cached=False):
+    """压缩 bytes；cached=True 表示结果会被缓存复用，可以用更高的压缩级别"""
+    if encoding == 'br':
+        return brotli.compress(body, quality=9 if cached else 5)
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=9 if cached else 6, mtime=0)
+    return body
+
+
+class GzipStream:
+    """流式 gzip，每次 feed 的数据都会立即刷出"""
+    def __init__(self, level=6):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def feed(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
@@ -0,0 +1,131 @@
+"""
+通知送达跟踪
+每条带 id 的通知按接收方记录送达状态，状态只前进不回退：
+- pending: 定向给该客户端，但发布时不在线（重连后通过 Last-Event-ID 补发）
+- enqueued: 发布时在线，已写入推送通道
+- superseded: 推送时被同一 collapse key 的更新通知覆盖（合并），不再单独发送
+- sent: 已写入该客户端的连接
+- acked: 客户端回执（/notifications/ack）
+定向 / 多播和关键类型的通知在发布时登记接收方；普通广播不枚举订阅者，接收方在写入其连接（sent）时加入，
+经重连补发收到的客户端也在 sent 时加入。
+关键通知（如 SOS、用药提醒）在 redeliver_interval 秒内未被回执时，重发给未回执的接收方，最多 max_attempts 次。
+所有更新都是字典操作；最多保留 max_entries 条通知的状态，超出时丢弃最早的
+"""
+import time
+from collections import OrderedDict
+from datetime import datetime
+from threading import Lock
+
+STATES = ('pending', 'enqueued', 'superseded', 'sent', 'acked')
+_RANK = {state: i for i, state in enumerate(STATES)}
+
+
+def _iso(ts):
+    return datetime.fromtimestamp(ts).isoformat() if ts is not None else None
+
+
+class DeliveryTracker:
+    def __init__(self, critical_types=('sos', 'medication'), redeliver_interval=30, max_attempts=5, max_entries=5000):
+        self.critical_types = set(critical_types)
+        self.redeliver_interval = redeliver_interval
+        self.max_attempts = max_attempts
+        self.max_entries = max_entries
+        self._lock = Lock()
+        self._entries = OrderedDict()  # 通知 id -> 跟踪记录
+        self._retry = {}  # 等待回执的关键通知：id -> 跟踪记录
+
+    def track(self, event, online, offline=(), now=None):
+        """记录一条新发布的通知：online 为已写入推送通道的接收方，offline 为定向但不在线的接收方"""
+        event_id = event.get('id')
+        if not isinstance(event_id, int):
+            return
+        now = now or time.time()
+        recipients = {cid: {'state': 'pending', 'pending_at': now} for cid in offline}
+        for cid in online:
+            recipients[cid] = {'state': 'enqueued', 'enqueued_at': now}
+        critical = event.get('type') in self.critical_types
+        entry = {
+            'event': event,
+            'created': now,
+            'recipients': recipients,
+            'attempts': 0,
+            'next_retry': now + self.redeliver_interval if critical else None,
+        }
+        with self._lock:
+            self._entries[event_id] = entry
+            if critical:
+                self._retry[event_id] = entry
+            while len(self._entries) > self.max_entries:
+                old_id, _ = self._entries.popitem(last=False)
+                self._retry.pop(old_id, None)
+
+    def mark(self, event_id, client_id, state, now=None):
+        """更新某个接收方的状态，返回是否有变化（未跟踪的通知、发送方本身或状态没有前进时为 False）"""
+        with self._lock:
+            entry = self._entries.get(event_id)
+            if entry is None or client_id == entry['event'].get('from'):
+                # 发送方自己收到的广播不计入接收方
+                return False
+            record = entry['recipients'].get(client_id)
+            if record is None:
+                record = entry['recipients'][client_id] = {'state': state}
+            elif _RANK[state] <= _RANK[record['state']]:
+                return False
+            record['state'] = state
+            record[f'{state}_at'] = now or time.time()
+            return True
+
+    def sender(self, event_id):
+        with self._lock:
+            entry = self._entries.get(event_id)
+            return entry['event'].get('from') if entry is not None else None
+
+    def status(self, event_id):
+        """通知的送达状态，未跟踪（或已过期）时返回 None"""
+        with self._lock:
+            entry = self._entries.get(event_id)
+            if entry is None:
+                return None
+            event = entry['event']
+            recipients = {}
+            counts = dict.fromkeys(STATES, 0)
+            for cid, record in entry['recipients'].items():
+                counts[record['state']] += 1
+                recipients[cid] = {'state': record['state']}
+                recipients[cid].update({
+                    f'{state}_at': _iso(record[f'{state}_at'])
+                    for state in STATES if f'{state}_at' in record
+                })
+            return {
+                'id': event['id'],
+                'type': event.get('type'),
+                'from': event.get('from'),
+                'created_at': _iso(entry['created']),
+                'critical': event.get('type') in self.critical_types,
+                'redelivery_attempts': entry['attempts'],
+                'acked': counts['acked'] > 0,
+                'counts': counts,
+                'recipients': recipients,
+            }
+
+    def due(self, now=None):
+        """返回到期需要重发的关键通知 [(通知, 未回执的接收方)]，并安排下一次重发"""
+        now = now or time.time()
+        result = []
+        with self._lock:
+            for event_id, entry in list(self._retry.items()):
+                if entry['next_retry'] > now:
+                    continue
+                pending = [cid for cid, r in entry['recipients'].items() if r['state'] != 'acked']
+                if entry['attempts'] >= self.max_attempts or (entry['recipients'] and not pending):
+                    entry['next_retry'] = None
+                    del self._retry[event_id]
+                    continue
+                if not pending:
+                    # 还没有任何接收方（发布时无人在线），等有客户端收到后再重发
+                    entry['next_retry'] = now + self.redeliver_interval
+                    continue
+                entry['attempts'] += 1
+                entry['next_retry'] = now + self.redeliver_interval
+                result.append((entry['event'], pending))
+        return result
@@ -1,40 +1,63 @@
 from flask import Flask, request, jsonify, send_from_directory, send_file, stream_with_context, Response, abort
 from flask_cors import CORS
 import threading
+import atexit
 import time
-import json
 import os
 from datetime import datetime, timedelta
 import logging
 from werkzeug.utils import secure_filename
 from threading import Lock
-from queue import Queue
 import cv2
 import re
+from collections import deque
+
+from activity_stats import ActivityAggregator
+from activity_store import ActivityStore, parse_bucket, parse_range_time
+from rollups import TIER_WIDTHS, ActivityRollupKind, GpsRollupKind, Rollup, haversine_m
+from trajectory import TrajectoryIndex
+from ingest import decode_body, validate_batch
+from geofence import GeofenceEngine, validate_fence
+from live_state import LiveStateRegistry
+from notify_bus import NotificationRing, TopicFilter, accepts, coalesce, coalesce_window, compile_target, sse_frame
+from delivery import DeliveryTracker
+from notify_log import NotificationLog
+from notify_hub import NotificationBus
+from storage import AppendLog, JsonDocumentStore, JsonFileBackend, LockManager, parse_timestamp
+from sqlite_store import SqliteAppendLog, SqliteBackend
+from compression import GzipStream, compress, negotiate
+from paging import SortedPageIndex, decode_cursor, encode_cursor, parse_fields, project
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class DogServer:
-    def __init__(self):
+    def __init__(self, root_dir=None):
+        """root_dir: 数据根目录（其下的 uploads、dog/assets、dog/users.json），默认为仓库根目录"""
         print("初始化dog服务器")
         self.app = Flask(__name__)
         
-        # 配置跨域请求
-        CORS(self.app)
+        # 配置跨域请求（暴露 ETag，便于 Web 端做条件请求）
+        CORS(self.app, expose_headers=['ETag'])
         
         # 使用绝对路径以避免 CWD (当前工作目录) 不同导致的问题
         # .../DogApp2/dog
         current_dir = os.path.dirname(os.path.abspath(__file__))
         # .../DogApp2
-        root_dir = os.path.dirname(current_dir)
+        if root_dir is None:
+            root_dir = os.path.dirname(current_dir)
+        else:
+            current_dir = os.path.join(root_dir, 'dog')
 
         # 服务器配置
         self.UPLOAD_FOLDER = os.path.join(root_dir, 'uploads')
         self.ASSETS_FOLDER = os.path.join(current_dir, 'assets')
         self.ALLOWED_IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp'}
         self.MAX_FILE_SIZE = 16 * 1024 * 1024  # 16MB
+        self.COMPRESS_MIN_SIZE = 1024  # 字节，超过该大小的 JSON 响应才压缩
+        self.WRITE_BEHIND_DELAY = 0.5  # 秒，窗口内对同一文件的多次保存合并为一次写盘，0 表示同步写
+        self.MAX_INGEST_RECORDS = 50000  # /ingest 单次请求的最大记录数
         
         # Flask应用配置
         self.app.config['UPLOAD_FOLDER'] = self.UPLOAD_FOLDER
@@ -45,8 +68,74 @@ class DogServer:
         os.makedirs(self.UPLOAD_FOLDER, exist_ok=True)
         os.makedirs(self.ASSETS_FOLDER, exist_ok=True)
         
-        # 线程锁用于文件操作
-        self.file_lock = Lock()
+        # 文件锁：按文件分配读写锁，不同集合互不阻塞
+        self.file_locks = LockManager()
+        # 存储后端：json（默认，每个集合一个 JSON 文件）或 sqlite（环境变量 DOG_STORAGE_BACKEND=sqlite）
+        self.STORAGE_BACKEND = os.environ.get('DOG_STORAGE_BACKEND', 'json').lower()
+        # 分层保留：原始记录只保留最近一段时间，更早的数据保存为分钟 / 小时汇总（天数）
+        self.GPS_RETENTION_DAYS = 7
+        self.GPS_ROLLUP_RETENTION_DAYS = {'minute': 30, 'hour': 730}
+        self.ACTIVITY_RETENTION_DAYS = 90
+        self.ACTIVITY_ROLLUP_RETENTION_DAYS = {'minute': 180, 'hour': 730}
+        self.NOTIFICATION_RETENTION_DAYS = 30
+        # 多进程部署：设置 DOG_NOTIFY_BUS 为 Unix 套接字路径后，各进程经通知总线共享通知 id、历史和推送
+        self.NOTIFY_BUS_PATH = os.environ.get('DOG_NOTIFY_BUS')
+        self.users_file_path = os.path.join(current_dir, 'users.json')
+        if self.STORAGE_BACKEND == 'sqlite':
+            self.storage_backend = SqliteBackend(os.path.join(self.UPLOAD_FOLDER, 'dog.db'), root_dir)
+            self.storage_backend.migrate(self._known_document_paths())
+        else:
+            self.storage_backend = JsonFileBackend()
+        self.gps_log = self._open_log('gps_history', 'server_received_time', self.GPS_RETENTION_DAYS)
+        self.activity_log = self._open_log('activity_records', 'timestamp', self.ACTIVITY_RETENTION_DAYS)
+        # 活动统计：启动时从历史记录构建一次，之后随上传增量更新
+        self.activity_stats = ActivityAggregator()
+        activities = self.activity_log.iter_records()
+        self.activity_stats.load(activities)
+        # 活动记录的列式索引，供 /get_activity_range 做时间范围查询；各汇总层共享活动类型编号
+        self.activity_store = ActivityStore()
+        self.activity_store.extend(activities)
+        self.activity_tier_stores = {
+            tier: ActivityStore(type_names=self.activity_store.type_names)
+            for tier in self.ACTIVITY_ROLLUP_RETENTION_DAYS
+        }
+        self.activity_rollup = Rollup(ActivityRollupKind(), {
+            tier: self._open_log(f'activity_rollup_{tier}', 'start', days)
+            for tier, days in self.ACTIVITY_ROLLUP_RETENTION_DAYS.items()
+        }, self.ACTIVITY_ROLLUP_RETENTION_DAYS)
+        self.activity_rollup.subscribe(
+            lambda tier, start, row: self.activity_tier_stores[tier].add_counts(start, row['by_type'])
+        )
+        self.activity_rollup.load(activities)
+        self.gps_rollup = Rollup(GpsRollupKind(), {
+            tier: self._open_log(f'gps_rollup_{tier}', 'start', days)
+            for tier, days in self.GPS_ROLLUP_RETENTION_DAYS.items()
+        }, self.GPS_ROLLUP_RETENTION_DAYS)
+        # 地理围栏：配置在 assets/geofences.json，每次位置更新时检查
+        self.geofences = GeofenceEngine()
+        gps_records = self.gps_log.iter_records()
+        self.gps_rollup.load(gps_records)
+        # 轨迹索引（网格空间索引 + 分段汇总），覆盖原始 GPS 的保留期
+        self.trajectory = TrajectoryIndex()
+        self.trajectory.add_many(gps_records)
+        # JSON 文档缓存：读请求命中缓存时不读盘、不解析
+        self.json_store = JsonDocumentStore(self.file_locks, write_delay=self.WRITE_BEHIND_DELAY, backend=self.storage_backend)
+        # 增量同步（/sync）覆盖的记忆库集合：集合名 -> assets 下的文件
+        self.SYNC_COLLECTIONS = {
+            'face_info': 'face_info.json',
+            'photo_info': 'photo_info.json',
+            'qr_code_info': 'qr_code_info.json',
+            'family_info': 'family_info.json',
+            'reminders': 'reminders.json',
+        }
+        for name, filename in self.SYNC_COLLECTIONS.items():
+            self.json_store.track_changes(os.path.join(self.ASSETS_FOLDER, filename), name)
+        # 只读接口的响应缓存：key -> (版本号, 序列化后的字节)
+        self.response_cache = {}
+        self.response_cache_lock = Lock()
+        # 分页索引缓存：集合名 -> (版本号, SortedPageIndex)
+        self.page_index_cache = {}
+        atexit.register(self.shutdown)
         
         # 服务器状态和识别结果
         self.current_status = "idle"
@@ -77,17 +166,55 @@ class DogServer:
             },
         ]
 
-        # 通知订阅（SSE）：保存每个订阅者的队列（支持按 client_id 定向推送）
-        self.notification_subscribers = {}  # client_id -> Queue
+        # 通知订阅（SSE）：所有通知写入同一个环形缓冲区（同时保存最近 200 条历史），订阅者各自维护读取游标；
+        # 需要记入历史的通知同时追加到 uploads/notifications 下的分段日志，id 在重启后继续递增
+        self.notification_subscribers = {}  # client_id -> 当前连接的标识（同一 client_id 重连后旧连接退出）
         self.notification_lock = Lock()
+        self.live_subscribers = set()  # 订阅时传 live=1 的 client_id，接收位置 / 陪伴状态的实时变化
+        self.subscriber_topics = {}  # client_id -> 订阅过滤条件（TopicFilter）
+        # 送达跟踪：每条通知按接收方记录 enqueued / sent / acked；SOS、用药提醒未回执时每 30 秒重发，最多 5 次
+        self.CRITICAL_NOTIFICATION_TYPES = ('sos', 'medication', 'medicine')
+        self.delivery = DeliveryTracker(self.CRITICAL_NOTIFICATION_TYPES, redeliver_interval=30, max_attempts=5)
+        # 通知总线不可用时发布失败的关键通知，由重发线程在总线恢复后重新发布（至少一次，最多保留 1000 条）
+        self.unpublished = deque(maxlen=1000)
+        open_notification_log = lambda: NotificationLog(
+            os.path.join(self.UPLOAD_FOLDER, 'notifications'),
+            retention_days=self.NOTIFICATION_RETENTION_DAYS,
+        )
+        # 先创建环形缓冲区：连接总线后集线器转发的通知会立即经 _publish_local 写入
+        self.notifications = NotificationRing(capacity=1024, history_size=200)
+        self.notify_bus = None
+        if self.NOTIFY_BUS_PATH:
+            # 日志由集线器所在的进程持有，本进程经总线分配 id、查询历史；
+            # 各进程的订阅者上线 / 下线和 sent / acked 状态经总线同步，送达跟踪与在线统计覆盖所有进程
+            self.notify_bus = NotificationBus(
+                self.NOTIFY_BUS_PATH, open_notification_log,
+                on_event=self._publish_local, on_mark=self.delivery.mark,
+                subscribers=self._local_subscribers,
+            )
+            self.notification_log = self.notify_bus
+        else:
+            self.notification_log = open_notification_log()
+        self.notifications.attach_log(self.notification_log)
+
+        # 实时状态：最新位置和陪伴状态常驻内存，读接口不再读盘；落盘限速为每项每 2 秒最多一次
+        self.COMPANION_STALE_SECONDS = 300  # 陪伴心跳超过该时间未更新则视为不陪伴
+        self.LIVE_STATE_FILES = {
+            'dog_location': 'dog_location.json',
+            'companion_status': 'companion_status.json',
+        }
+        self.live_state = LiveStateRegistry(
+            lambda name, value: self.save_json_data(value, self.LIVE_STATE_FILES[name]),
+            persist_interval=2.0,
+            on_change=self._push_live_state,
+        )
+        for name, filename in self.LIVE_STATE_FILES.items():
+            value = self.load_json_data(filename)
+            if value:
+                self.live_state.load(name, value)
+        self._arm_companion_timer(self.live_state.get('companion_status'))
 
-        # 通知历史与确认（用于双向通知链路）
-        self.notification_history = []
-        self.notification_history_lock = Lock()
-        self.notification_next_id = 1
-
-        # 简单账号存储（明文，保存在 dog/users.json）
-        self.users_file_path = os.path.join(current_dir, 'users.json')
+        # 简单账号存储（明文，保存在 dog/users.json，见上方 users_file_path）
 
         # 日程提醒推送相关
         self.schedule_notifier_stop = threading.Event()
@@ -96,12 +223,49 @@ class DogServer:
             target=self._schedule_notifier_loop, daemon=True
         )
 
+        # 分层保留的后台维护：关闭到期的汇总桶、清理过期数据、压缩日志
+        self.retention_stop = threading.Event()
+        self.retention_thread = threading.Thread(target=self._retention_loop, daemon=True)
+        # 关键通知的重发检测
+        self.redelivery_stop = threading.Event()
+        self.redelivery_thread = threading.Thread(target=self._redelivery_loop, daemon=True)
+
         # 设置路由
         self.setup_routes()
 
         # 启动日程提醒检测线程
         self.schedule_notifier_thread.start()
+        self.retention_thread.start()
+        self.redelivery_thread.start()
     
+    def _open_log(self, name, timestamp_key, retention_days):
+        """
+        打开一个时间序列日志：json 后端为 uploads 下只追加的 JSONL 文件（单条写入 O(1)），
+        sqlite 后端存到 events 表（带时间索引）；首次打开时迁移旧的 JSON 数组文件
+        """
+        jsonl_path = os.path.join(self.UPLOAD_FOLDER, f'{name}.jsonl')
+        legacy_path = os.path.join(self.UPLOAD_FOLDER, f'{name}.json')
+        if self.STORAGE_BACKEND == 'sqlite':
+            return SqliteAppendLog(
+                self.storage_backend, name, self.file_locks,
+                timestamp_key=timestamp_key, retention_days=retention_days,
+                legacy_paths=(jsonl_path, legacy_path),
+            )
+        return AppendLog(
+            jsonl_path, self.file_locks,
+            timestamp_key=timestamp_key, retention_days=retention_days,
+            legacy_path=legacy_path,
+        )
+
+    def _known_document_paths(self):
+        """现有的 JSON 文档（用于迁移到其他存储后端）"""
+        paths = [self.users_file_path]
+        for folder in (self.ASSETS_FOLDER, self.UPLOAD_FOLDER):
+            for filename in sorted(os.listdir(folder)):
+                if filename.endswith('.json') and filename not in ('gps_history.json', 'activity_records.json'):
+                    paths.append(os.path.join(folder, filename))
+        return paths
+
     def allowed_file(self, filename):
         """检查文件扩展名是否允许[2,3]"""
         return '.' in filename and \
@@ -110,72 +274,434 @@ class DogServer:
     def save_json_data(self, data, filename):
         """安全地保存JSON数据"""
         try:
-            with self.file_lock:
-                with open(os.path.join(self.app.config['UPLOAD_FOLDER'], filename), 'w', encoding='utf-8') as f:
-                    json.dump(data, f, ensure_ascii=False, indent=4)
+            self.json_store.save(os.path.join(self.app.config['UPLOAD_FOLDER'], filename), data, indent=4)
             return True
         except Exception as e:
             logger.error(f"保存JSON数据失败: {e}")
             return False
     
-    def load_json_data(self, filename):
-        """安全地加载JSON数据"""
+    def load_json_data(self, filename, readonly=False):
+        """安全地加载JSON数据（readonly=True 时返回共享的缓存对象，调用方不得修改）"""
         try:
-            with self.file_lock:
-                filepath = os.path.join(self.app.config['UPLOAD_FOLDER'], filename)
-                if os.path.exists(filepath):
-                    with open(filepath, 'r', encoding='utf-8') as f:
-                        return json.load(f)
-            return None
+            filepath = os.path.join(self.app.config['UPLOAD_FOLDER'], filename)
+            return self.json_store.load(filepath, copy=not readonly)
         except Exception as e:
             logger.error(f"加载JSON数据失败: {e}")
             return None
     
-    def load_assets_json(self, filename):
-        """加载assets目录下的JSON文件"""
+    def load_assets_json(self, filename, readonly=False):
+        """加载assets目录下的JSON文件（readonly=True 时返回共享的缓存对象，调用方不得修改）"""
         try:
-            with self.file_lock:
-                filepath = os.path.join(self.ASSETS_FOLDER, filename)
-                if os.path.exists(filepath):
-                    with open(filepath, 'r', encoding='utf-8') as f:
-                        return json.load(f)
-            return {}
+            filepath = os.path.join(self.ASSETS_FOLDER, filename)
+            data = self.json_store.load(filepath, copy=not readonly)
+            return data if data is not None else {}
         except Exception as e:
             logger.error(f"加载assets JSON数据失败: {e}")
             return {}
     
+    def load_assets_versioned(self, filename):
+        """加载assets目录下的JSON文件，返回 (只读的共享对象, 版本号)"""
+        try:
+            data, version = self.json_store.load_versioned(os.path.join(self.ASSETS_FOLDER, filename))
+            return (data if data is not None else {}), version
+        except Exception as e:
+            logger.error(f"加载assets JSON数据失败: {e}")
+            return {}, 0
+
+    def cached_json_response(self, key, version, build):
+        """
+        返回带 ETag 的 JSON 响应，并缓存当前版本序列化（及压缩）后的字节
+        - 客户端 If-None-Match 命中时返回 304，不再序列化
+        - build() 仅在缓存未命中时调用，返回要序列化的数据
+        - 超过 COMPRESS_MIN_SIZE 时按 Accept-Encoding 返回 gzip/br，压缩结果同样按版本缓存
+        """
+        encoding = negotiate(request.accept_encodings)
+        etag = f"{self.json_store.epoch}-{version}-{key}"
+        with self.response_cache_lock:
+            cached = self.response_cache.get(key)
+        if cached is None or not version or cached[0] != version:
+            body = (self.app.json.dumps(build()) + '\n').encode('utf-8')
+            cached = (version, {None: body})
+            if version:
+                with self.response_cache_lock:
+                    self.response_cache[key] = cached
+        variants = cached[1]
+        if encoding is not None and len(variants[None]) < self.COMPRESS_MIN_SIZE:
+            encoding = None
+        if encoding is not None:
+            etag = f"{etag}-{encoding}"
+
+        if version and request.if_none_match.contains(etag):
+            resp = Response(status=304)
+        else:
+            body = variants.get(encoding)
+            if body is None:
+                body = compress(variants[None], encoding, cached=True)
+                with self.response_cache_lock:
+                    variants[encoding] = body
+            resp = Response(body, status=200, mimetype='application/json')
+            if encoding is not None:
+                resp.headers['Content-Encoding'] = encoding
+        if version:
+            resp.set_etag(etag)
+        resp.headers['Cache-Control'] = 'no-cache'
+        resp.vary.add('Accept-Encoding')
+        return resp
+
+    def page_index(self, name, version, build):
+        """按集合版本缓存分页索引（SortedPageIndex），build() 返回 [(排序键, 记录)]"""
+        with self.response_cache_lock:
+            cached = self.page_index_cache.get(name)
+        if cached is not None and version and cached[0] == version:
+            return cached[1]
+        index = SortedPageIndex(build())
+        with self.response_cache_lock:
+            self.page_index_cache[name] = (version, index)
+        return index
+
+    def page_args(self, default_limit=None, max_limit=1000):
+        """
+        解析列表接口的 limit/cursor/fields 参数，返回 (limit, cursor 状态, 是否游标分页, fields)
+        只传 limit 时保持原有响应结构并截断；传 cursor（可为空串）时返回 {"items", "next_cursor"}
+        """
+        limit = request.args.get('limit')
+        limit = int(limit) if limit not in (None, '') else default_limit
+        if limit is not None:
+            limit = max(1, min(limit, max_limit))
+        paged = 'cursor' in request.args
+        cursor = decode_cursor(request.args.get('cursor'))
+        fields = parse_fields(request.args.get('fields'))
+        return limit, cursor, paged, fields
+
     def save_assets_json(self, data, filename):
         """保存JSON数据到assets目录"""
         try:
-            with self.file_lock:
-                filepath = os.path.join(self.ASSETS_FOLDER, filename)
-                with open(filepath, 'w', encoding='utf-8') as f:
-                    json.dump(data, f, ensure_ascii=False, indent=2)
+            self.json_store.save(os.path.join(self.ASSETS_FOLDER, filename), data, indent=2)
             return True
         except Exception as e:
             logger.error(f"保存assets JSON数据失败: {e}")
             return False
 
+    def append_record(self, log, record):
+        """追加一条时间序列记录"""
+        try:
+            log.append(record)
+            return True
+        except Exception as e:
+            logger.error(f"追加记录到 {os.path.basename(log.path)} 失败: {e}")
+            return False
+
+    # ========== 记忆库修改操作（单条接口与 /batch 共用） ==========
+    # 每个操作接收可修改的文档和请求数据，返回 (响应体, 状态码)；
+    # 状态码非 200 时保证没有修改文档
+    def _op_update_family_question(self, family_info, data):
+        if not data:
+            return {'message': '未接收到有效数据'}, 400
+
+        question_id = data.get('question_id')  # 可以是索引或None（新增）
+        question_text = data.get('question', '')
+        answer_text = data.get('answer', '')
+        command = data.get('command', '')
+        audio_file = data.get('audio_file', '')
+
+        if not question_text or not answer_text:
+            return {'message': '问题和答案不能为空'}, 400
+
+        if 'questions' not in family_info:
+            family_info['questions'] = []
+
+        # 创建新的问答对象
+        new_question = {
+            'question': question_text,
+            'answer': answer_text,
+            'update_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'audio_file': audio_file or '',
+            'command': command or ''
+        }
+
+        # 如果有question_id，更新现有问题；否则添加新问题
+        if question_id is not None and isinstance(question_id, int) and 0 <= question_id < len(family_info['questions']):
+            family_info['questions'][question_id] = new_question
+        else:
+            family_info['questions'].append(new_question)
+        return {'message': '问答数据更新成功', 'question_id': len(family_info['questions']) - 1}, 200
+
+    def _op_delete_family_question(self, family_info, data):
+        question_id = (data or {}).get('question_id')
+        if question_id is None:
+            return {'message': '缺少question_id字段'}, 400
+        if 'questions' not in family_info:
+            return {'message': '未找到问答数据'}, 404
+        if isinstance(question_id, int) and 0 <= question_id < len(family_info['questions']):
+            del family_info['questions'][question_id]
+            return {'message': '删除成功'}, 200
+        return {'message': '无效的question_id'}, 400
+
+    def _op_update_face_info(self, face_info, data):
+        if not data:
+            return {'message': '未接收到有效数据'}, 400
+
+        face_id = data.get('face_id')
+        name = data.get('name', '')
+        description = data.get('description', '')
+        audio_file = data.get('audio_file', '')
+        image_file = data.get('image_file', '')
+
+        if not face_id:
+            return {'message': '缺少face_id字段'}, 400
+        if not face_id.startswith('face_'):
+            face_id = f"face_{face_id}"
+
+        existing = face_info.get(face_id, {})
+
+        # 更新或添加（保留已有的图片/音频信息，如果未传入则不覆盖）
+        face_info[face_id] = {
+            'name': name or existing.get('name', ''),
+            'description': description,
+            'update_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'audio_file': audio_file if audio_file != '' else existing.get('audio_file', ''),
+            'image_file': image_file if image_file != '' else existing.get('image_file', ''),
+        }
+        return {'message': '人脸信息更新成功', 'face_id': face_id}, 200
+
+    def _op_delete_face_info(self, face_info, data):
+        face_id = (data or {}).get('face_id')
+        if not face_id:
+            return {'message': '缺少face_id字段'}, 400
+        if not face_id.startswith('face_'):
+            face_id = f"face_{face_id}"
+        if face_id not in face_info:
+            return {'message': '未找到该人脸信息'}, 404
+        del face_info[face_id]
+        return {'message': '删除成功'}, 200
+
+    def _op_update_qr_code_info(self, qr_info, data):
+        if not data:
+            return {'message': '未接收到有效数据'}, 400
+
+        med_id = data.get('med_id')
+        description = data.get('description', '')
+        audio_file = data.get('audio_file', '')
+
+        if not med_id:
+            return {'message': '缺少med_id字段'}, 400
+
+        qr_info[med_id] = {
+            'description': description,
+            'update_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'audio_file': audio_file
+        }
+        return {'message': '药品信息更新成功', 'med_id': med_id}, 200
+
+    def _op_delete_qr_code_info(self, qr_info, data):
+        med_id = (data or {}).get('med_id')
+        if not med_id:
+            return {'message': '缺少med_id字段'}, 400
+        if med_id not in qr_info:
+            return {'message': '未找到该药品信息'}, 404
+        del qr_info[med_id]
+        return {'message': '删除成功'}, 200
+
+    def _op_update_photo_info(self, photo_info, data):
+        if not data:
+            return {'message': '未接收到有效数据'}, 400
+
+        photo_id = data.get('photo_id')
+        description = data.get('description', '')
+        audio_file = data.get('audio_file', '')
+        title = data.get('title', '')
+        event_date = data.get('event_date', '')
+        image_file = data.get('image_file', '')
+        location = data.get('location', '')
+        tags = data.get('tags', [])
+        people = data.get('people', [])
+        emotion = data.get('emotion', '')
+
+        if isinstance(tags, str):
+            tags = [t.strip() for t in tags.split(',') if t.strip()]
+        if isinstance(people, str):
+            people = [p.strip() for p in people.split(',') if p.strip()]
+
+        if not photo_id:
+            return {'message': '缺少photo_id字段'}, 400
+
+        existing = photo_info.get(photo_id, {})
+
+        # 更新或添加
+        photo_info[photo_id] = {
+            'title': title or existing.get('title', ''),
+            'description': description or existing.get('description', ''),
+            'event_date': event_date or existing.get('event_date', ''),
+            'update_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'image_file': image_file or existing.get('image_file', ''),
+            'audio_file': audio_file or existing.get('audio_file', ''),
+            'location': location or existing.get('location', ''),
+            'tags': tags or existing.get('tags', []),
+            'people': people or existing.get('people', []),
+            'emotion': emotion or existing.get('emotion', '')
+        }
+        return {'message': '照片信息更新成功', 'photo_id': photo_id}, 200
+
+    def _op_delete_photo_info(self, photo_info, data):
+        photo_id = (data or {}).get('photo_id')
+        if not photo_id:
+            return {'message': '缺少photo_id字段'}, 400
+        if photo_id not in photo_info:
+            return {'message': '未找到该照片信息'}, 404
+        del photo_info[photo_id]
+        return {'message': '删除成功'}, 200
+
+    def _op_update_schedule(self, reminders, payload):
+        if not payload:
+            return {'message': '未接收到数据'}, 400
+
+        schedules = reminders.setdefault('reminders', [])
+        schedule_id = payload.get('schedule_id')
+        if schedule_id is None:
+            schedule_id = (max((item.get('id', 0) for item in schedules), default=0) + 1)
+            schedules.append({
+                'id': schedule_id,
+                'time': payload.get('time', ''),
+                'event': payload.get('event', ''),
+                'completed': bool(payload.get('completed', False)),
+            })
+        else:
+            for item in schedules:
+                if item.get('id') == schedule_id:
+                    item['time'] = payload.get('time', item['time'])
+                    item['event'] = payload.get('event', item['event'])
+                    item['completed'] = bool(payload.get('completed', item['completed']))
+                    break
+            else:
+                return {'message': '未找到对应日程'}, 404
+        return {'message': '日程保存成功', 'schedule_id': schedule_id}, 200
+
+    def _op_delete_schedule(self, reminders, data):
+        schedule_id = (data or {}).get('schedule_id')
+        if schedule_id is None:
+            return {'message': '缺少 schedule_id'}, 400
+        schedules = reminders.get('reminders', [])
+        reminders['reminders'] = [item for item in schedules if item.get('id') != schedule_id]
+        return {'message': '删除成功'}, 200
+
+    def _op_update_geofence(self, fences, data):
+        if not data:
+            return {'message': '未接收到有效数据'}, 400
+        fence, error = validate_fence(data)
+        if error is not None:
+            return {'message': error}, 400
+        fence_id = data.get('fence_id') or f"fence_{int(time.time() * 1000)}"
+        fence['update_time'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        fences[fence_id] = fence
+        return {'message': '地理围栏已保存', 'fence_id': fence_id}, 200
+
+    def _op_delete_geofence(self, fences, data):
+        fence_id = (data or {}).get('fence_id')
+        if not fence_id:
+            return {'message': '缺少fence_id字段'}, 400
+        if fence_id not in fences:
+            return {'message': '未找到该地理围栏'}, 404
+        del fences[fence_id]
+        return {'message': '删除成功'}, 200
+
+    def _op_create_post(self, community, payload):
+        payload = payload or {}
+        posts = community.setdefault('posts', [])
+        post_id = (max((p.get('id', 0) for p in posts), default=0) + 1)
+        posts.insert(0, {
+            'id': post_id,
+            'title': payload.get('title', '').strip(),
+            'content': payload.get('content', '').strip(),
+            'author': payload.get('author', '匿名'),
+            'timestamp': datetime.now().isoformat(),
+            'likes': 0,
+            'comments': [],
+        })
+        return {'message': '发帖成功', 'post_id': post_id}, 200
+
+    def _op_comment_post(self, community, payload):
+        payload = payload or {}
+        post_id = payload.get('post_id')
+        text = payload.get('text', '').strip()
+        author = payload.get('author', '匿名')
+        if post_id is None or text == '':
+            return {'message': '参数缺失'}, 400
+        for p in community.get('posts', []):
+            if p.get('id') == post_id:
+                comments = p.setdefault('comments', [])
+                comments.append({
+                    'id': (max((c.get('id', 0) for c in comments), default=0) + 1),
+                    'author': author,
+                    'text': text,
+                    'timestamp': datetime.now().isoformat(),
+                })
+                return {'message': '评论成功'}, 200
+        return {'message': '未找到帖子'}, 404
+
+    def _op_like_post(self, community, payload):
+        post_id = (payload or {}).get('post_id')
+        if post_id is None:
+            return {'message': '参数缺失'}, 400
+        for p in community.get('posts', []):
+            if p.get('id') == post_id:
+                p['likes'] = int(p.get('likes', 0)) + 1
+                return {'message': '已点赞', 'likes': p['likes']}, 200
+        return {'message': '未找到帖子'}, 404
+
+    def _asset_ops(self):
+        """操作名 -> (assets 下的文件, 操作函数)"""
+        return {
+            'update_family_question': ('family_info.json', self._op_update_family_question),
+            'delete_family_question': ('family_info.json', self._op_delete_family_question),
+            'update_face_info': ('face_info.json', self._op_update_face_info),
+            'delete_face_info': ('face_info.json', self._op_delete_face_info),
+            'update_qr_code_info': ('qr_code_info.json', self._op_update_qr_code_info),
+            'delete_qr_code_info': ('qr_code_info.json', self._op_delete_qr_code_info),
+            'update_photo_info': ('photo_info.json', self._op_update_photo_info),
+            'delete_photo_info': ('photo_info.json', self._op_delete_photo_info),
+            'update_schedule': ('reminders.json', self._op_update_schedule),
+            'delete_schedule': ('reminders.json', self._op_delete_schedule),
+            'update_geofence': ('geofences.json', self._op_update_geofence),
+            'delete_geofence': ('geofences.json', self._op_delete_geofence),
+            'create_post': ('community.json', self._op_create_post),
+            'comment_post': ('community.json', self._op_comment_post),
+            'like_post': ('community.json', self._op_like_post),
+        }
+
+    def apply_asset_op(self, op_name, data):
+        """单条修改接口：在同一次写锁内完成 读取-修改-保存"""
+        filename, op = self._asset_ops()[op_name]
+        try:
+            path = os.path.join(self.ASSETS_FOLDER, filename)
+            with self.json_store.transaction([path]) as txn:
+                doc = txn.load(path)
+                if doc is None:
+                    doc = {}
+                body, status = op(doc, data)
+                if status == 200:
+                    txn.save(path, doc, indent=2)
+            if status == 200:
+                logger.info(f"[{datetime.now()}] {op_name}: {body}")
+            return jsonify(body), status
+        except Exception as e:
+            logger.error(f"{op_name} 处理失败: {e}")
+            return jsonify({'message': '服务器内部错误'}), 500
+
     # ========== 简易账号存储（明文，仅演示用途） ==========
-    def load_users(self):
+    def load_users(self, readonly=False):
         try:
-            with self.file_lock:
-                if os.path.exists(self.users_file_path):
-                    with open(self.users_file_path, 'r', encoding='utf-8') as f:
-                        data = json.load(f)
-                        if isinstance(data, list):
-                            return {'users': data}
-                        if isinstance(data, dict) and 'users' in data:
-                            return {'users': data.get('users', [])}
+            data = self.json_store.load(self.users_file_path, copy=not readonly)
+            if isinstance(data, list):
+                return {'users': data}
+            if isinstance(data, dict) and 'users' in data:
+                return {'users': data.get('users', [])}
         except Exception as e:
             logger.error(f"加载用户数据失败: {e}")
         return {'users': []}
 
     def save_users(self, users):
         try:
-            with self.file_lock:
-                with open(self.users_file_path, 'w', encoding='utf-8') as f:
-                    json.dump(users, f, ensure_ascii=False, indent=4)
+            self.json_store.save(self.users_file_path, users, indent=4)
             return True
         except Exception as e:
             logger.error(f"保存用户数据失败: {e}")
@@ -246,64 +772,223 @@ class DogServer:
             logger.error(f"停止视频直播失败: {e}")
             return False
 
-    def broadcast_notification(self, data: dict):
+    def broadcast_notification(self, data: dict, history=True, strict=False):
         """推送通知。
 
         约定：
         - data['to'] == 'all' 或 None: 广播
         - data['to'] == <client_id>: 定向给某一端
         - data['to'] == {'any_of': [id1,id2]}: 多播（任一匹配都发送）
+        history=False 用于实时状态这类瞬时事件：不分配 id（客户端不回执）、不记入历史、不跟踪送达
+        返回发布时在线且会收到该通知的订阅者数量（不含发送方；多进程时包括连接在其他进程上的订阅者）；
+        普通类型的广播不逐个统计接收方，返回 None（需要时用 count_online）
+        多进程时通知总线不可用：关键通知留待重发线程重新发布；strict=True 时抛出 ConnectionError，否则返回 0
         """
-        try:
-            # 记录历史（最多 200 条），并分配 id
-            with self.notification_history_lock:
-                if 'id' not in data:
-                    data['id'] = self.notification_next_id
-                    self.notification_next_id += 1
-                self.notification_history.append(data)
-                if len(self.notification_history) > 200:
-                    self.notification_history = self.notification_history[-200:]
-
-            target = data.get('to')
-            with self.notification_lock:
-                subs = dict(self.notification_subscribers)
-
-            # 广播
-            if target is None or target == 'all':
-                for _, q in subs.items():
-                    try:
-                        q.put_nowait(data)
-                    except Exception:
-                        continue
+        if self.notify_bus is not None:
+            # 经集线器分配 id 并转发给所有进程，本进程收到转发后由 _publish_local 写入环形缓冲区
+            try:
+                return self.notify_bus.publish(data, history=history)
+            except ConnectionError as e:
+                if history and data.get('type') in self.delivery.critical_types:
+                    self.unpublished.append(data)
+                    logger.error(f"推送关键通知失败，总线恢复后重试 type={data.get('type')}: {e}")
+                else:
+                    logger.error(f"推送通知失败: {e}")
+                if strict:
+                    raise
+                return 0
+        return self._publish_local(data, history)
+
+    def _publish_unpublished(self):
+        """按顺序重新发布总线不可用时未发出的关键通知，遇到失败即停止等下一轮"""
+        while self.unpublished:
+            data = self.unpublished[0]
+            try:
+                self.notify_bus.publish(data)
+            except ConnectionError:
                 return
+            self.unpublished.popleft()
+            logger.warning(f"[notifications] 已重新发布关键通知 id={data.get('id')} type={data.get('type')}")
 
-            # 多播
-            if isinstance(target, dict) and isinstance(target.get('any_of'), list):
-                for cid in target.get('any_of'):
-                    q = subs.get(str(cid))
-                    if q is None:
-                        continue
-                    try:
-                        q.put_nowait(data)
-                    except Exception:
+    def _publish_local(self, data, history=True):
+        """
+        写入本进程的环形缓冲区，并登记送达跟踪
+        定向 / 多播和关键类型的通知在发布时确定接收方（只查 'to' 中的 client_id；关键类型的广播需要枚举，用于重发）；
+        普通广播不枚举订阅者，保持一次写入，接收方在 mark_sent 时登记
+        多进程时每个进程都会收到同一条通知，按总线同步的在线状态登记，各进程的记录一致
+        """
+        online = None
+        on_assign = None
+        if history:
+            target = compile_target(data.get('to'))
+            offline = []
+            if target is not None or data.get('type') in self.delivery.critical_types:
+                online, offline = self._online_recipients(data, target)
+            # 分配 id 后、订阅者读到之前登记，避免 sent 先于跟踪记录到达
+            on_assign = lambda event: self.delivery.track(event, online or (), offline)
+        else:
+            online = ()
+        try:
+            # 写入环形缓冲区一次，各订阅者按自己的游标读取
+            self.notifications.publish(data, history=history, on_assign=on_assign)
+        except Exception as e:
+            logger.error(f"推送通知失败: {e}")
+            return 0
+        return len(online) if online is not None else None
+
+    def _online_recipients(self, data, target):
+        """
+        返回 (在线且会收到的接收方, 定向但不在线的接收方)，不含发送方
+        target 为 None（广播）时枚举所有进程的订阅者，否则只查 target 中的 client_id
+        """
+        sender = data.get('from')
+        with self.notification_lock:
+            if target is None:
+                subscribers = dict(self.subscriber_topics)
+            else:
+                subscribers = {cid: self.subscriber_topics[cid] for cid in target if cid in self.subscriber_topics}
+        if self.notify_bus is not None:
+            for cid, topic in self.notify_bus.remote_subscribers(target).items():
+                subscribers.setdefault(cid, topic)
+        candidates = subscribers if target is None else target
+        online = [cid for cid in candidates if cid != sender and cid in subscribers
+                  and accepts(target, data, cid, subscribers[cid])]
+        offline = [cid for cid in target if cid not in subscribers] if target is not None else []
+        return online, offline
+
+    def count_online(self, data):
+        """统计在线且会收到该通知的订阅者数量（O(订阅者)，只在调用方需要时使用）"""
+        return len(self._online_recipients(data, compile_target(data.get('to')))[0])
+
+    def mark_sent(self, client_id, event, state='sent'):
+        """通知已写入 client_id 的连接（SSE 路由与通知网关调用）；合并时被覆盖的通知以 state='superseded' 记录"""
+        if isinstance(event.get('id'), int) and self.delivery.mark(event['id'], client_id, state):
+            if self.notify_bus is not None:
+                self.notify_bus.mark(event['id'], client_id, state)
+
+    def _redelivery_loop(self, interval=5):
+        """
+        关键通知超时未回执时，按原 id 重新推送给未回执且连接在本进程的接收方（不再记入历史）
+        不在线的接收方重连时通过 Last-Event-ID 补发；多进程时各进程只重发给自己的连接，不会重复
+        """
+        while not self.redelivery_stop.wait(interval):
+            try:
+                if self.unpublished:
+                    self._publish_unpublished()
+                for event, pending in self.delivery.due():
+                    with self.notification_lock:
+                        pending = [cid for cid in pending if cid in self.notification_subscribers]
+                    if not pending:
                         continue
+                    logger.warning(f"[notifications] 重发未回执的通知 id={event['id']} type={event.get('type')} to={pending}")
+                    self._publish_local(dict(event, to={'any_of': pending}, redelivery=True), history=False)
+            except Exception as e:
+                logger.error(f"通知重发失败: {e}")
+
+    def add_subscriber(self, client_id, live=False, topic=None):
+        """登记一个订阅连接，返回连接标识；同一 client_id 的旧连接随之失效（SSE 路由与通知网关共用）"""
+        token = object()
+        with self.notification_lock:
+            self.notification_subscribers[client_id] = token
+            self.subscriber_topics[client_id] = topic
+            if live:
+                self.live_subscribers.add(client_id)
+            else:
+                self.live_subscribers.discard(client_id)
+            logger.info(f"[notifications] subscribers={len(self.notification_subscribers)}")
+        if self.notify_bus is not None:
+            self.notify_bus.presence(client_id, topic)
+        return token
+
+    def is_subscriber(self, client_id, token):
+        """连接是否仍是该 client_id 当前有效的订阅"""
+        return self.notification_subscribers.get(client_id) is token
+
+    def remove_subscriber(self, client_id, token):
+        with self.notification_lock:
+            if self.notification_subscribers.get(client_id) is not token:
                 return
-
-            # 定向
-            q = subs.get(str(target))
-            if q is not None:
-                try:
-                    q.put_nowait(data)
-                except Exception:
-                    pass
+            del self.notification_subscribers[client_id]
+            self.subscriber_topics.pop(client_id, None)
+            self.live_subscribers.discard(client_id)
+        if self.notify_bus is not None:
+            self.notify_bus.presence(client_id, online=False)
+
+    def _local_subscribers(self):
+        """本进程的订阅者及其过滤条件（重新连接通知总线后上报）"""
+        with self.notification_lock:
+            return dict(self.subscriber_topics)
+
+    def _push_live_state(self, name, value):
+        """实时状态变化时推送给订阅了 live 的客户端，事件类型为状态名（dog_location / companion_status）"""
+        with self.notification_lock:
+            targets = list(self.live_subscribers)
+        if targets:
+            self.broadcast_notification({
+                'type': name,
+                'timestamp': datetime.now().isoformat(),
+                'payload': value,
+                'to': {'any_of': targets},
+            }, history=False)
+
+    def _arm_companion_timer(self, status):
+        """陪伴中时设置超时定时器，到期未收到新心跳则标记为不陪伴"""
+        if not status or not status.get('is_accompanying'):
+            self.live_state.set_timer('companion_status', None, None)
+            return
+        ts = parse_timestamp(status.get('timestamp'))
+        remaining = 0 if ts is None else self.COMPANION_STALE_SECONDS - (time.time() - ts)
+        self.live_state.set_timer('companion_status', remaining, self._mark_companion_stale)
+
+    def _mark_companion_stale(self):
+        status = self.live_state.get('companion_status')
+        if not status or not status.get('is_accompanying'):
+            return
+        ts = parse_timestamp(status.get('timestamp'))
+        if ts is not None and time.time() - ts < self.COMPANION_STALE_SECONDS:
+            # 定时器到期前刚收到新心跳
+            self._arm_companion_timer(status)
+            return
+        self.live_state.set('companion_status', dict(status, is_accompanying=False))
+        logger.info(f"[{datetime.now()}] 陪伴心跳超时，标记为不陪伴")
+
+    def check_geofences(self, fixes):
+        """按顺序用新位置（含 lat/lon 的记录）检查地理围栏，进出围栏时推送通知"""
+        try:
+            fences, version = self.load_assets_versioned('geofences.json')
+            if version != self.geofences.version:
+                self.geofences.load(fences, version)
+            events = []
+            for fix in fixes:
+                lat, lon = float(fix['lat']), float(fix['lon'])
+                for fence_id, name, event in self.geofences.update(lat, lon):
+                    events.append((fence_id, name, event, lat, lon))
         except Exception as e:
-            logger.error(f"推送通知失败: {e}")
+            logger.error(f"地理围栏检查失败: {e}")
+            return
+        for fence_id, name, event, lat, lon in events:
+            action = '进入' if event == 'enter' else '离开'
+            self.broadcast_notification({
+                'type': 'geofence',
+                'timestamp': datetime.now().isoformat(),
+                'message': f"地理围栏提醒：{action}「{name}」",
+                'payload': {
+                    'fence_id': fence_id,
+                    'name': name,
+                    'event': event,
+                    'lat': lat,
+                    'lon': lon,
+                },
+            })
 
     def _schedule_notifier_loop(self):
-        """定期检查日程，时间到点时推送通知"""
+        """定期检查日程，时间到点时推送通知（多进程时只由集线器所在的进程推送，避免重复提醒）"""
         while not self.schedule_notifier_stop.is_set():
+            if self.notify_bus is not None and self.notify_bus.hub is None:
+                self.schedule_notifier_stop.wait(30)
+                continue
             try:
-                schedules = self.load_assets_json('reminders.json').get('reminders', [])
+                schedules = self.load_assets_json('reminders.json', readonly=True).get('reminders', [])
                 now = datetime.now()
                 today_str = now.strftime('%Y-%m-%d')
 
@@ -350,6 +1035,50 @@ class DogServer:
             # 间隔 30 秒检查一次
             self.schedule_notifier_stop.wait(30)
     
+    def _retention_loop(self, interval=60, maintenance_interval=3600):
+        """定期写出已结束的汇总桶；每小时清理内存中的过期数据并压缩各层日志"""
+        last_maintenance = time.time()
+        while not self.retention_stop.wait(interval):
+            now = time.time()
+            try:
+                for rollup in (self.gps_rollup, self.activity_rollup):
+                    rollup.flush(now)
+                if now - last_maintenance < maintenance_interval:
+                    continue
+                last_maintenance = now
+                self.activity_store.prune(now - self.ACTIVITY_RETENTION_DAYS * 86400)
+                self.trajectory.prune(now - self.GPS_RETENTION_DAYS * 86400)
+                for tier, store in self.activity_tier_stores.items():
+                    store.prune(now - self.ACTIVITY_ROLLUP_RETENTION_DAYS[tier] * 86400)
+                for rollup in (self.gps_rollup, self.activity_rollup):
+                    rollup.prune(now)
+                    rollup.compact()
+                for log in (self.gps_log, self.activity_log):
+                    log.compact()
+                self.notification_log.prune(now)
+            except Exception as e:
+                logger.error(f"分层保留维护失败: {e}")
+
+    def _gps_raw_range(self, start, end, max_points):
+        """从新到旧读取 [start, end) 内的原始 GPS 记录，超过 max_points 条时返回 None"""
+        items = []
+        cursor = None
+        while True:
+            page, cursor = self.gps_log.page_before(cursor, 500)
+            for record in page:
+                ts = parse_timestamp(record.get('server_received_time')) if isinstance(record, dict) else None
+                if ts is None or ts >= end:
+                    continue
+                if ts < start:
+                    items.reverse()
+                    return items
+                items.append(record)
+                if len(items) > max_points:
+                    return None
+            if cursor is None:
+                items.reverse()
+                return items
+
     def setup_routes(self):
         """设置所有API路由"""
         
@@ -411,7 +1140,7 @@ class DogServer:
                 if not phone or not password:
                     return jsonify({'message': '手机号和密码不能为空'}), 400
 
-                users = self.load_users()['users']
+                users = self.load_users(readonly=True)['users']
                 matched = next((u for u in users if u.get('phone') == phone and u.get('password') == password), None)
                 if matched:
                     return jsonify({'message': '登录成功', 'phone': phone}), 200
@@ -431,6 +1160,24 @@ class DogServer:
                 'dialog_history': self.dialog_history,
             })
         
+        # 文件锁竞争情况（等待/持有耗时）
+        @self.app.route('/get_lock_stats', methods=['GET'])
+        def get_lock_stats():
+            try:
+                root_dir = os.path.dirname(self.UPLOAD_FOLDER)
+                stats = {
+                    os.path.relpath(path, root_dir): value
+                    for path, value in self.file_locks.stats().items()
+                }
+                return jsonify({
+                    'locks': stats,
+                    'store': self.json_store.stats(),
+                    'timestamp': datetime.now().isoformat()
+                }), 200
+            except Exception as e:
+                logger.error(f"获取锁统计失败: {e}")
+                return jsonify({'message': '服务器内部错误'}), 500
+
         # 识别结果查询路由
         @self.app.route('/recognition_results')
         def get_recognition_results():
@@ -483,23 +1230,133 @@ class DogServer:
         @self.app.route('/get_family_info', methods=['GET'])
         def get_family_info():
             try:
-                family_info = self.load_assets_json('family_info.json')
+                family_info, version = self.load_assets_versioned('family_info.json')
                 if family_info:
-                    return jsonify(family_info), 200
+                    return self.cached_json_response('family_info', version, lambda: family_info)
                 else:
                     return jsonify({'message': '未找到家庭信息'}), 404
             except Exception as e:
                 logger.error(f"获取家庭信息时出错: {e}")
                 return jsonify({'message': '服务器内部错误'}), 500
         
+        # ========== 记忆库增量同步 ==========
+        @self.app.route('/sync', methods=['GET'])
+        def sync_collections():
+            """
+            返回 since 版本之后记忆库（人脸、照片、药品、问答、日程）中新增/修改/删除的记录
+            查询参数: since=<上次同步返回的 version>, epoch=<上次同步返回的 epoch>
+            - 增量: {"reset": false, "changes": [{"collection", "op": "upsert|delete", "key", "record", "version"}]}
+              列表型集合的 key 为主键（日程 id），问答按位置编号为 "#<下标>"；"_meta" 表示列表以外字段的变化
+            - 首次同步、服务器重启（epoch 变化或未带 epoch）或变更日志已被淘汰时返回全量: {"reset": true, "collections": {...}}
+            """
+            try:
+                since = int(request.args.get('since', 0))
+                epoch = request.args.get('epoch')
+                # 先触发一次加载，使磁盘上被手工修改的文件也记入变更日志
+                for filename in self.SYNC_COLLECTIONS.values():
+                    self.load_assets_versioned(filename)
+                version = self.json_store.version
+
+                changes = None
+                # 版本号只在同一 epoch 内有意义，未带 epoch 的 since 无法判断是否跨过了重启
+                if since > 0 and epoch == self.json_store.epoch:
+                    changes = self.json_store.changes.since(since)
+
+                if changes is None:
+                    collections = {
+                        name: self.load_assets_versioned(filename)[0]
+                        for name, filename in self.SYNC_COLLECTIONS.items()
+                    }
+                    return jsonify({
+                        'epoch': self.json_store.epoch,
+                        'version': version,
+                        'reset': True,
+                        'collections': collections,
+                    }), 200
+
+                return jsonify({
+                    'epoch': self.json_store.epoch,
+                    'version': version,
+                    'reset': False,
+                    'changes': [
+                        {'collection': name, 'op': op, 'key': key, 'record': record, 'version': seq}
+                        for seq, name, op, key, record in changes if seq <= version
+                    ],
+                }), 200
+            except ValueError:
+                return jsonify({'message': 'since 参数必须是整数'}), 400
+            except Exception as e:
+                logger.error(f"增量同步失败: {e}")
+                return jsonify({'message': '服务器内部错误'}), 500
+
+        @self.app.route('/batch', methods=['POST'])
+        def batch_asset_ops():
+            """
+            批量修改记忆库，一次请求、每个集合只写一次盘
+            请求体:
+            {
+              "ops": [
+                {"op": "update_photo_info", "data": {...}},
+                {"op": "delete_face_info", "data": {"face_id": "face_00001"}}
+              ],
+              "atomic": true   # 默认 true：任一操作失败则全部不生效
+            }
+            op 取值与单条接口同名：update/delete_face_info、update/delete_photo_info、update/delete_qr_code_info、
+            update/delete_family_question、update/delete_schedule、update/delete_geofence；社区：create_post、comment_post、like_post
+            """
+            try:
+                body = request.get_json(silent=True)
+                if isinstance(body, list):
+                    body = {'ops': body}
+                if not isinstance(body, dict) or not isinstance(body.get('ops'), list):
+                    return jsonify({'message': '缺少 ops 列表'}), 400
+                ops = body['ops']
+                atomic = bool(body.get('atomic', True))
+
+                table = self._asset_ops()
+                for index, item in enumerate(ops):
+                    if not isinstance(item, dict) or item.get('op') not in table:
+                        return jsonify({'message': f'第 {index} 个操作无效: {item.get("op") if isinstance(item, dict) else item}'}), 400
+
+                paths = {os.path.join(self.ASSETS_FOLDER, table[item['op']][0]) for item in ops}
+                results = []
+                failed = False
+                with self.json_store.transaction(paths) as txn:
+                    docs = {}
+                    touched = set()
+                    for index, item in enumerate(ops):
+                        filename, op = table[item['op']]
+                        path = os.path.join(self.ASSETS_FOLDER, filename)
+                        if path not in docs:
+                            docs[path] = txn.load(path) or {}
+                        result, status = op(docs[path], item.get('data'))
+                        results.append(dict(result, index=index, op=item['op'], status=status))
+                        if status == 200:
+                            touched.add(path)
+                        else:
+                            failed = True
+                    applied = not (failed and atomic)
+                    if applied:
+                        for path in touched:
+                            txn.save(path, docs[path], indent=2)
+
+                logger.info(f"[{datetime.now()}] 批量操作 {len(ops)} 条，失败 {sum(r['status'] != 200 for r in results)} 条，已生效: {applied}")
+                return jsonify({
+                    'message': '批量操作完成' if applied else '存在失败的操作，全部未生效',
+                    'applied': applied,
+                    'results': results,
+                }), 200 if applied else 400
+            except Exception as e:
+                logger.error(f"批量操作失败: {e}")
+                return jsonify({'message': '服务器内部错误'}), 500
+
         # ========== 问答数据管理 API (记忆库) ==========
         @self.app.route('/get_family_questions', methods=['GET'])
         def get_family_questions():
             """获取所有问答数据"""
             try:
-                family_info = self.load_assets_json('family_info.json')
-                questions = family_info.get('questions', [])
-                return jsonify(questions), 200
+                family_info, version = self.load_assets_versioned('family_info.json')
+                return self.cached_json_response('family_questions', version, lambda: family_info.get('questions', []))
             except Exception as e:
                 logger.error(f"获取问答数据时出错: {e}")
                 return jsonify({'message': '服务器内部错误'}), 500
@@ -507,76 +1364,12 @@ class DogServer:
         @self.app.route('/update_family_question', methods=['POST'])
         def update_family_question():
             """更新或添加问答数据"""
-            try:
-                data = request.get_json()
-                if not data:
-                    return jsonify({'message': '未接收到有效数据'}), 400
-                
-                question_id = data.get('question_id')  # 可以是索引或None（新增）
-                question_text = data.get('question', '')
-                answer_text = data.get('answer', '')
-                command = data.get('command', '')
-                audio_file = data.get('audio_file', '')
-                
-                if not question_text or not answer_text:
-                    return jsonify({'message': '问题和答案不能为空'}), 400
-                
-                # 加载现有数据
-                family_info = self.load_assets_json('family_info.json')
-                if 'questions' not in family_info:
-                    family_info['questions'] = []
-                
-                # 创建新的问答对象
-                new_question = {
-                    'question': question_text,
-                    'answer': answer_text,
-                    'update_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                    'audio_file': audio_file or '',
-                    'command': command or ''
-                }
-                
-                # 如果有question_id，更新现有问题；否则添加新问题
-                if question_id is not None and isinstance(question_id, int) and 0 <= question_id < len(family_info['questions']):
-                    family_info['questions'][question_id] = new_question
-                else:
-                    family_info['questions'].append(new_question)
-                
-                if self.save_assets_json(family_info, 'family_info.json'):
-                    logger.info(f"[{datetime.now()}] 问答数据已更新")
-                    return jsonify({'message': '问答数据更新成功', 'question_id': len(family_info['questions']) - 1}), 200
-                else:
-                    return jsonify({'message': '保存失败'}), 500
-                    
-            except Exception as e:
-                logger.error(f"更新问答数据时出错: {e}")
-                return jsonify({'message': '服务器内部错误'}), 500
+            return self.apply_asset_op('update_family_question', request.get_json(silent=True))
         
         @self.app.route('/delete_family_question', methods=['POST'])
         def delete_family_question():
             """删除问答数据"""
-            try:
-                data = request.get_json()
-                question_id = data.get('question_id')
-                
-                if question_id is None:
-                    return jsonify({'message': '缺少question_id字段'}), 400
-                
-                family_info = self.load_assets_json('family_info.json')
-                if 'questions' not in family_info:
-                    return jsonify({'message': '未找到问答数据'}), 404
-                
-                if isinstance(question_id, int) and 0 <= question_id < len(family_info['questions']):
-                    del family_info['questions'][question_id]
-                    if self.save_assets_json(family_info, 'family_info.json'):
-                        return jsonify({'message': '删除成功'}), 200
-                    else:
-                        return jsonify({'message': '保存失败'}), 500
-                else:
-                    return jsonify({'message': '无效的question_id'}), 400
-                    
-            except Exception as e:
-                logger.error(f"删除问答数据时出错: {e}")
-                return jsonify({'message': '服务器内部错误'}), 500
+            return self.apply_asset_op('delete_family_question', request.get_json(silent=True))
         
         # 图片上传路由
         @self.app.route('/upload_pic', methods=['POST'])
@@ -672,15 +1465,11 @@ class DogServer:
                 # 添加时间戳
                 gps_data['server_received_time'] = datetime.now().isoformat()
                 
-                # 保存GPS记录
-                gps_history = self.load_json_data('gps_history.json') or []
-                gps_history.append(gps_data)
-                
-                # 只保留最近100条记录
-                if len(gps_history) > 100:
-                    gps_history = gps_history[-100:]
-                
-                if self.save_json_data(gps_history, 'gps_history.json'):
+                # 追加GPS记录
+                if self.append_record(self.gps_log, gps_data):
+                    self.gps_rollup.add([gps_data])
+                    self.trajectory.add(gps_data)
+                    self.check_geofences([gps_data])
                     logger.info(f"[{datetime.now()}] 接收到GPS数据 - 纬度: {gps_data['lat']}, 经度: {gps_data['lon']}")
                     
                     # 这里可以添加机器狗导航逻辑
@@ -697,23 +1486,191 @@ class DogServer:
                 logger.error(f"处理GPS数据时出错: {e}")
                 return jsonify({'message': '服务器内部错误'}), 500
         
+        @self.app.route('/ingest', methods=['POST'])
+        def ingest():
+            """
+            批量上传 GPS 和患者活动记录（机器人离线缓存后一次性上传）
+            请求体: JSON 数组、{"gps": [...], "activity": [...]}，
+                    或 Content-Type: application/x-ndjson 每行一条；可用 Content-Encoding: gzip
+            每条记录单独校验，合法记录按类型各一次追加写入
+            GPS 记录的 timestamp 为定位时间（未带时用接收时间），晚于服务器时间或早于保留期的记录被拒绝
+            返回: {"received", "accepted": {"gps", "activity"}, "rejected", "errors": [{"index", "error"}]}
+            """
+            try:
+                try:
+                    items = decode_body(
+                        request.get_data(cache=False),
+                        request.headers.get('Content-Encoding'),
+                        request.mimetype,
+                    )
+                except ValueError as e:
+                    return jsonify({'message': f'请求体无效: {e}'}), 400
+                if not items:
+                    return jsonify({'message': '未接收到有效数据'}), 400
+                if len(items) > self.MAX_INGEST_RECORDS:
+                    return jsonify({'message': f'单次最多上传 {self.MAX_INGEST_RECORDS} 条记录'}), 413
+
+                accepted, rejected, errors = validate_batch(items, time.time(), {
+                    'gps': self.GPS_RETENTION_DAYS,
+                    'activity': self.ACTIVITY_RETENTION_DAYS,
+                })
+                fixes = accepted['gps']
+                activities = accepted['activity']
+                # 离线缓存的定位早于已有的最新位置时照常追加（O(1)），日志在压缩时按时间重排，
+                # 读取方（tail、轨迹索引、汇总）都按时间戳处理
+                last_ts = self.trajectory.latest
+                try:
+                    self.gps_log.append_many(fixes)
+                    self.activity_log.append_many(activities)
+                except Exception as e:
+                    logger.error(f"批量写入记录失败: {e}")
+                    return jsonify({'message': '保存失败'}), 500
+                if fixes:
+                    self.gps_rollup.add(fixes)
+                    self.trajectory.add_many(fixes)
+                    # 围栏状态只随更新的位置前进，早于已知最新位置的定位不再触发进出通知
+                    self.check_geofences([
+                        fix for fix in fixes
+                        if last_ts is None or parse_timestamp(fix['server_received_time']) >= last_ts
+                    ])
+                if activities:
+                    for activity in activities:
+                        self.activity_stats.add(activity)
+                    self.activity_store.extend(activities)
+                    self.activity_rollup.add(activities)
+                logger.info(
+                    f"[{datetime.now()}] 批量上传: GPS {len(fixes)} 条, 活动 {len(activities)} 条, 拒绝 {rejected} 条"
+                )
+                return jsonify({
+                    'received': len(items),
+                    'accepted': {'gps': len(fixes), 'activity': len(activities)},
+                    'rejected': rejected,
+                    'errors': errors,
+                }), 200
+            except Exception as e:
+                logger.error(f"批量上传时出错: {e}")
+                return jsonify({'message': '服务器内部错误'}), 500
+
         # 获取GPS历史记录路由
         @self.app.route('/get_gps_history', methods=['GET'])
         def get_gps_history():
+            """
+            获取GPS历史（默认最近100条，按时间先后）
+            查询参数: limit, fields；传 cursor 时从新到旧分页，返回 {"items", "next_cursor"}
+            """
             try:
-                gps_history = self.load_json_data('gps_history.json') or []
+                limit, cursor, paged, fields = self.page_args(default_limit=100, max_limit=5000)
+                if paged:
+                    items, next_state = self.gps_log.page_before(cursor, limit)
+                    return jsonify({
+                        'items': [project(item, fields) for item in items],
+                        'next_cursor': encode_cursor(next_state) if next_state else None,
+                    }), 200
+                gps_history = self.gps_log.tail(limit)
+                if fields is not None:
+                    gps_history = [project(item, fields) for item in gps_history]
                 return jsonify(gps_history), 200
+            except ValueError as e:
+                return jsonify({'message': f'参数错误: {e}'}), 400
             except Exception as e:
                 logger.error(f"获取GPS历史时出错: {e}")
                 return jsonify({'message': '服务器内部错误'}), 500
         
+        @self.app.route('/get_gps_summary', methods=['GET'])
+        def get_gps_summary():
+            """
+            按时间范围获取GPS轨迹，根据跨度自动选择数据层
+            参数: from / to（ISO8601 或 epoch 秒，默认最近 24 小时），tier（可选，raw|minute|hour）
+            返回: tier、items（raw 为原始记录，minute/hour 为 {start, count, lat, lon, distance_m}）
+                  以及范围内的总点数 count 和总距离 distance_m
+            """
+            try:
+                now = time.time()
+                try:
+                    end = parse_range_time(request.args.get('to'), now)
+                    start = parse_range_time(request.args.get('from'), end - 86400)
+                    if start >= end:
+                        raise ValueError('from 必须早于 to')
+                    tier = request.args.get('tier') or self.gps_rollup.choose_tier(
+                        start, end, now, self.GPS_RETENTION_DAYS * 86400
+                    )
+                    if tier != 'raw' and tier not in TIER_WIDTHS:
+                        raise ValueError(f'无效的 tier: {tier}')
+                except ValueError as e:
+                    return jsonify({'message': str(e)}), 400
+
+                items = None
+                if tier == 'raw':
+                    items = self._gps_raw_range(start, end, max_points=5000)
+                    if items is None:
+                        # 原始点太多，改用分钟汇总
+                        tier = 'minute'
+                if items is not None:
+                    distance = 0.0
+                    for a, b in zip(items, items[1:]):
+                        try:
+                            distance += haversine_m(float(a['lat']), float(a['lon']), float(b['lat']), float(b['lon']))
+                        except (KeyError, TypeError, ValueError):
+                            continue
+                    count = len(items)
+                else:
+                    items = self.gps_rollup.query(tier, start, end)
+                    count = sum(row['count'] for row in items)
+                    distance = sum(row.get('distance_m', 0.0) for row in items)
+                return jsonify({
+                    'from': datetime.fromtimestamp(start).isoformat(),
+                    'to': datetime.fromtimestamp(end).isoformat(),
+                    'tier': tier,
+                    'count': count,
+                    'distance_m': round(distance, 1),
+                    'items': items,
+                }), 200
+            except Exception as e:
+                logger.error(f"获取GPS轨迹汇总时出错: {e}")
+                return jsonify({'message': '服务器内部错误'}), 500
+
+        @self.app.route('/gps/query', methods=['GET'])
+        def gps_query():
+            """
+            轨迹查询
+            参数:
+              bbox: min_lat,min_lon,max_lat,max_lon（可选，只返回框内的点）
+              from / to: ISO8601 或 epoch 秒，默认最近 24 小时
+              tolerance: 路径简化的容差（米），默认 10，0 表示不简化
+            返回: paths（简化后的路径，每个点为 [lat, lon, 时间]）、涉及的轨迹段汇总（距离、时长、停留）
+            """
+            try:
+                try:
+                    end = parse_range_time(request.args.get('to'), time.time())
+                    start = parse_range_time(request.args.get('from'), end - 86400)
+                    if start >= end:
+                        raise ValueError('from 必须早于 to')
+                    bbox = request.args.get('bbox')
+                    if bbox:
+                        bbox = [float(v) for v in bbox.split(',')]
+                        if len(bbox) != 4 or bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+                            raise ValueError('bbox 格式应为 min_lat,min_lon,max_lat,max_lon')
+                    tolerance = max(0.0, float(request.args.get('tolerance', 10)))
+                except ValueError as e:
+                    return jsonify({'message': f'参数错误: {e}'}), 400
+                result = self.trajectory.query(start, end, bbox or None, tolerance)
+                result.update({
+                    'from': datetime.fromtimestamp(start).isoformat(),
+                    'to': datetime.fromtimestamp(end).isoformat(),
+                    'tolerance': tolerance,
+                })
+                return jsonify(result), 200
+            except Exception as e:
+                logger.error(f"轨迹查询时出错: {e}")
+                return jsonify({'message': '服务器内部错误'}), 500
+
         # ========== 人脸信息管理 API ==========
         @self.app.route('/get_face_info', methods=['GET'])
         def get_face_info():
             """获取所有人脸信息"""
             try:
-                face_info = self.load_assets_json('face_info.json')
-                return jsonify(face_info), 200
+                face_info, version = self.load_assets_versioned('face_info.json')
+                return self.cached_json_response('face_info', version, lambda: face_info)
             except Exception as e:
                 logger.error(f"获取人脸信息时出错: {e}")
                 return jsonify({'message': '服务器内部错误'}), 500
@@ -721,70 +1678,12 @@ class DogServer:
         @self.app.route('/update_face_info', methods=['POST'])
         def update_face_info():
             """更新或添加人脸信息"""
-            try:
-                data = request.get_json()
-                if not data:
-                    return jsonify({'message': '未接收到有效数据'}), 400
-                
-                face_id = data.get('face_id')
-                name = data.get('name', '')
-                description = data.get('description', '')
-                audio_file = data.get('audio_file', '')
-                image_file = data.get('image_file', '')
-                
-                if not face_id:
-                    return jsonify({'message': '缺少face_id字段'}), 400
-                if not face_id.startswith('face_'):
-                    face_id = f"face_{face_id}"
-                
-                # 加载现有数据
-                face_info = self.load_assets_json('face_info.json')
-                existing = face_info.get(face_id, {})
-                
-                # 更新或添加（保留已有的图片/音频信息，如果未传入则不覆盖）
-                face_info[face_id] = {
-                    'name': name or existing.get('name', ''),
-                    'description': description,
-                    'update_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                    'audio_file': audio_file if audio_file != '' else existing.get('audio_file', ''),
-                    'image_file': image_file if image_file != '' else existing.get('image_file', ''),
-                }
-                
-                if self.save_assets_json(face_info, 'face_info.json'):
-                    logger.info(f"[{datetime.now()}] 人脸信息已更新: {face_id}")
-                    return jsonify({'message': '人脸信息更新成功', 'face_id': face_id}), 200
-                else:
-                    return jsonify({'message': '保存失败'}), 500
-                    
-            except Exception as e:
-                logger.error(f"更新人脸信息时出错: {e}")
-                return jsonify({'message': '服务器内部错误'}), 500
+            return self.apply_asset_op('update_face_info', request.get_json(silent=True))
         
         @self.app.route('/delete_face_info', methods=['POST'])
         def delete_face_info():
             """删除人脸信息"""
-            try:
-                data = request.get_json()
-                face_id = data.get('face_id')
-                
-                if not face_id:
-                    return jsonify({'message': '缺少face_id字段'}), 400
-                if not face_id.startswith('face_'):
-                    face_id = f"face_{face_id}"
-                
-                face_info = self.load_assets_json('face_info.json')
-                if face_id in face_info:
-                    del face_info[face_id]
-                    if self.save_assets_json(face_info, 'face_info.json'):
-                        return jsonify({'message': '删除成功'}), 200
-                    else:
-                        return jsonify({'message': '保存失败'}), 500
-                else:
-                    return jsonify({'message': '未找到该人脸信息'}), 404
-                    
-            except Exception as e:
-                logger.error(f"删除人脸信息时出错: {e}")
-                return jsonify({'message': '服务器内部错误'}), 500
+            return self.apply_asset_op('delete_face_info', request.get_json(silent=True))
         
         # 上传人脸照片到face_detector目录
         @self.app.route('/upload_face_image', methods=['POST'])
@@ -850,8 +1749,8 @@ class DogServer:
         def get_qr_code_info():
             """获取所有药品信息"""
             try:
-                qr_info = self.load_assets_json('qr_code_info.json')
-                return jsonify(qr_info), 200
+                qr_info, version = self.load_assets_versioned('qr_code_info.json')
+                return self.cached_json_response('qr_code_info', version, lambda: qr_info)
             except Exception as e:
                 logger.error(f"获取药品信息时出错: {e}")
                 return jsonify({'message': '服务器内部错误'}), 500
@@ -859,69 +1758,39 @@ class DogServer:
         @self.app.route('/update_qr_code_info', methods=['POST'])
         def update_qr_code_info():
             """更新或添加药品信息"""
-            try:
-                data = request.get_json()
-                if not data:
-                    return jsonify({'message': '未接收到有效数据'}), 400
-                
-                med_id = data.get('med_id')
-                description = data.get('description', '')
-                audio_file = data.get('audio_file', '')
-                
-                if not med_id:
-                    return jsonify({'message': '缺少med_id字段'}), 400
-                
-                # 加载现有数据
-                qr_info = self.load_assets_json('qr_code_info.json')
-                
-                # 更新或添加
-                qr_info[med_id] = {
-                    'description': description,
-                    'update_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                    'audio_file': audio_file
-                }
-                
-                if self.save_assets_json(qr_info, 'qr_code_info.json'):
-                    logger.info(f"[{datetime.now()}] 药品信息已更新: {med_id}")
-                    return jsonify({'message': '药品信息更新成功', 'med_id': med_id}), 200
-                else:
-                    return jsonify({'message': '保存失败'}), 500
-                    
-            except Exception as e:
-                logger.error(f"更新药品信息时出错: {e}")
-                return jsonify({'message': '服务器内部错误'}), 500
+            return self.apply_asset_op('update_qr_code_info', request.get_json(silent=True))
         
         @self.app.route('/delete_qr_code_info', methods=['POST'])
         def delete_qr_code_info():
             """删除药品信息"""
-            try:
-                data = request.get_json()
-                med_id = data.get('med_id')
-                
-                if not med_id:
-                    return jsonify({'message': '缺少med_id字段'}), 400
-                
-                qr_info = self.load_assets_json('qr_code_info.json')
-                if med_id in qr_info:
-                    del qr_info[med_id]
-                    if self.save_assets_json(qr_info, 'qr_code_info.json'):
-                        return jsonify({'message': '删除成功'}), 200
-                    else:
-                        return jsonify({'message': '保存失败'}), 500
-                else:
-                    return jsonify({'message': '未找到该药品信息'}), 404
-                    
-            except Exception as e:
-                logger.error(f"删除药品信息时出错: {e}")
-                return jsonify({'message': '服务器内部错误'}), 500
+            return self.apply_asset_op('delete_qr_code_info', request.get_json(silent=True))
         
         # ========== 照片信息管理 API (记忆库) ==========
         @self.app.route('/get_photo_info', methods=['GET'])
         def get_photo_info():
-            """获取所有照片信息"""
+            """
+            获取所有照片信息
+            查询参数（可选）: limit, fields；传 cursor 时按 photo_id 分页，返回 {"items": [{"photo_id", ...}], "next_cursor"}
+            """
             try:
-                photo_info = self.load_assets_json('photo_info.json')
-                return jsonify(photo_info), 200
+                photo_info, version = self.load_assets_versioned('photo_info.json')
+                limit, cursor, paged, fields = self.page_args()
+                if not paged and limit is None and fields is None:
+                    return self.cached_json_response('photo_info', version, lambda: photo_info)
+
+                index = self.page_index(
+                    'photo_info', version,
+                    lambda: [(pid, (pid, record)) for pid, record in photo_info.items()],
+                )
+                items, last_key = index.page(cursor.get('k') if cursor else None, limit or len(index.items))
+                if paged:
+                    return jsonify({
+                        'items': [dict(project(record, fields), photo_id=pid) for pid, record in items],
+                        'next_cursor': encode_cursor({'k': last_key}) if last_key is not None else None,
+                    }), 200
+                return jsonify({pid: project(record, fields) for pid, record in items}), 200
+            except (ValueError, TypeError) as e:
+                return jsonify({'message': f'参数错误: {e}'}), 400
             except Exception as e:
                 logger.error(f"获取照片信息时出错: {e}")
                 return jsonify({'message': '服务器内部错误'}), 500
@@ -929,81 +1798,12 @@ class DogServer:
         @self.app.route('/update_photo_info', methods=['POST'])
         def update_photo_info():
             """更新或添加照片信息"""
-            try:
-                data = request.get_json()
-                if not data:
-                    return jsonify({'message': '未接收到有效数据'}), 400
-                
-                photo_id = data.get('photo_id')
-                description = data.get('description', '')
-                audio_file = data.get('audio_file', '')
-                title = data.get('title', '')
-                event_date = data.get('event_date', '')
-                image_file = data.get('image_file', '')
-                location = data.get('location', '')
-                tags = data.get('tags', [])
-                people = data.get('people', [])
-                emotion = data.get('emotion', '')
-
-                if isinstance(tags, str):
-                    tags = [t.strip() for t in tags.split(',') if t.strip()]
-                if isinstance(people, str):
-                    people = [p.strip() for p in people.split(',') if p.strip()]
-                
-                if not photo_id:
-                    return jsonify({'message': '缺少photo_id字段'}), 400
-                
-                # 加载现有数据
-                photo_info = self.load_assets_json('photo_info.json')
-                existing = photo_info.get(photo_id, {})
-                
-                # 更新或添加
-                photo_info[photo_id] = {
-                    'title': title or existing.get('title', ''),
-                    'description': description or existing.get('description', ''),
-                    'event_date': event_date or existing.get('event_date', ''),
-                    'update_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                    'image_file': image_file or existing.get('image_file', ''),
-                    'audio_file': audio_file or existing.get('audio_file', ''),
-                    'location': location or existing.get('location', ''),
-                    'tags': tags or existing.get('tags', []),
-                    'people': people or existing.get('people', []),
-                    'emotion': emotion or existing.get('emotion', '')
-                }
-                
-                if self.save_assets_json(photo_info, 'photo_info.json'):
-                    logger.info(f"[{datetime.now()}] 照片信息已更新: {photo_id}")
-                    return jsonify({'message': '照片信息更新成功', 'photo_id': photo_id}), 200
-                else:
-                    return jsonify({'message': '保存失败'}), 500
-                    
-            except Exception as e:
-                logger.error(f"更新照片信息时出错: {e}")
-                return jsonify({'message': '服务器内部错误'}), 500
+            return self.apply_asset_op('update_photo_info', request.get_json(silent=True))
         
         @self.app.route('/delete_photo_info', methods=['POST'])
         def delete_photo_info():
             """删除照片信息"""
-            try:
-                data = request.get_json()
-                photo_id = data.get('photo_id')
-                
-                if not photo_id:
-                    return jsonify({'message': '缺少photo_id字段'}), 400
-                
-                photo_info = self.load_assets_json('photo_info.json')
-                if photo_id in photo_info:
-                    del photo_info[photo_id]
-                    if self.save_assets_json(photo_info, 'photo_info.json'):
-                        return jsonify({'message': '删除成功'}), 200
-                    else:
-                        return jsonify({'message': '保存失败'}), 500
-                else:
-                    return jsonify({'message': '未找到该照片信息'}), 404
-                    
-            except Exception as e:
-                logger.error(f"删除照片信息时出错: {e}")
-                return jsonify({'message': '服务器内部错误'}), 500
+            return self.apply_asset_op('delete_photo_info', request.get_json(silent=True))
         
         # 上传记忆库照片到photo_detector目录
         @self.app.route('/upload_photo_image', methods=['POST'])
@@ -1118,43 +1918,95 @@ class DogServer:
             try:
                 data = request.get_json() or {}
                 logger.warning(f"[{datetime.now()}] 收到SOS: {data}")
-                self.broadcast_notification({
+                notif = {
                     'type': 'sos',
                     'timestamp': datetime.now().isoformat(),
                     'payload': data,
-                    'message': data.get('message', '患者发出了SOS求助')
-                })
-                return jsonify({'message': 'SOS已接收'}), 200
+                    'message': data.get('message', '患者发出了SOS求助'),
+                    # 回执只推送给发起方
+                    'from': data.get('from') or data.get('client_id'),
+                }
+                self.broadcast_notification(notif)
+                return jsonify({'message': 'SOS已接收', 'id': notif.get('id')}), 200
             except Exception as e:
                 logger.error(f"处理SOS时出错: {e}")
                 return jsonify({'message': '服务器内部错误'}), 500
 
         @self.app.route('/notifications/subscribe')
         def subscribe_notifications():
-            """基于SSE的通知订阅通道"""
+            """
+            基于SSE的通知订阅通道（live=1 时同时接收 dog_location / companion_status 的实时变化）
+            每条带 id 的通知以 SSE id 发送；重连时带上 Last-Event-ID 请求头（或 last_event_id 参数），
+            先补发断线期间错过的通知再转为实时推送，不会重复
+            可选过滤参数 types / senders / recipients（逗号分隔，支持 * 通配和 ! 排除），
+            例如 types=sos,schedule* 或 types=!ack&recipients=!all，只推送符合条件的通知
+            同时到达的多条通知合并为一次写入；coalesce=<毫秒>（最大 5000）时收到通知后再等待该时长一起发送，
+            同一批中 collapse key 相同的通知（如多次位置 / 陪伴状态更新）只发送最新一条
+            """
             client_id = request.args.get('client_id') or 'unknown'
-            q = Queue()
+            live = request.args.get('live') in ('1', 'true')
+            topic = TopicFilter.from_args(request.args)
+            window = coalesce_window(request.args)
+            last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+            try:
+                last_event_id = int(last_event_id) if last_event_id else None
+            except ValueError:
+                last_event_id = None
             logger.info(f"[notifications] SSE subscribe client_id={client_id}")
-            with self.notification_lock:
-                self.notification_subscribers[client_id] = q
-                logger.info(f"[notifications] subscribers={len(self.notification_subscribers)}")
+            token = self.add_subscriber(client_id, live, topic)
+
+            # 可选压缩模式：?compress=gzip 且客户端接受 gzip 时，整个事件流按 gzip 流式输出
+            stream = None
+            if request.args.get('compress') in ('1', 'true', 'gzip') and request.accept_encodings['gzip']:
+                stream = GzipStream()
+
+            def frames():
+                # 客户端断线后 3 秒重连；同时让响应头立即发出
+                yield 'retry: 3000\n\n'
+                if last_event_id is None:
+                    cursor = self.notifications.next_seq
+                else:
+                    missed, cursor, complete = self.notifications.resume(last_event_id, client_id, topic)
+                    logger.info(f"[notifications] resume client_id={client_id} last_event_id={last_event_id} replay={len(missed)}")
+                    if not complete:
+                        # 断线期间的部分通知已超出历史范围（SSE 注释，客户端可据此刷新通知列表）
+                        yield ': replay-incomplete\n\n'
+                    if missed:
+                        yield ''.join(sse_frame(item) for item in missed)
+                        for item in missed:
+                            self.mark_sent(client_id, item)
+                while self.is_subscriber(client_id, token):
+                    items, cursor, dropped = self.notifications.read(cursor, client_id, timeout=25, topic=topic)
+                    if dropped:
+                        logger.warning(f"[notifications] client_id={client_id} 读取过慢，跳过 {dropped} 条")
+                    if not items:
+                        # 心跳，保持连接（使用SSE注释，避免触发客户端通知）
+                        logger.debug(f"[notifications] keepalive to={client_id}")
+                        yield ': keepalive\n\n'
+                        continue
+                    if window:
+                        deadline = time.monotonic() + window
+                        while True:
+                            remaining = deadline - time.monotonic()
+                            if remaining <= 0:
+                                break
+                            more, cursor, dropped = self.notifications.read(cursor, client_id, timeout=remaining, topic=topic)
+                            items.extend(more)
+                    items, superseded = coalesce(items, self.delivery.critical_types)
+                    for item in superseded:
+                        self.mark_sent(client_id, item, 'superseded')
+                    logger.debug(f"[notifications] deliver to={client_id} count={len(items)} ids={[item.get('id') for item in items]}")
+                    yield ''.join(sse_frame(item) for item in items)
+                    for item in items:
+                        self.mark_sent(client_id, item)
 
             def gen():
                 try:
-                    while True:
-                        try:
-                            item = q.get(timeout=25)
-                            logger.info(f"[notifications] deliver to={client_id} type={item.get('type')} id={item.get('id')}")
-                            yield f"data: {json.dumps(item, ensure_ascii=False)}\n\n"
-                        except Exception:
-                            # 心跳，保持连接（使用SSE注释，避免触发客户端通知）
-                            logger.debug(f"[notifications] keepalive to={client_id}")
-                            yield ': keepalive\n\n'
+                    for frame in frames():
+                        yield stream.feed(frame) if stream is not None else frame
                 finally:
-                    with self.notification_lock:
-                        if self.notification_subscribers.get(client_id) is q:
-                            del self.notification_subscribers[client_id]
-                        logger.info(f"[notifications] SSE disconnect client_id={client_id} subscribers={len(self.notification_subscribers)}")
+                    self.remove_subscriber(client_id, token)
+                    logger.info(f"[notifications] SSE disconnect client_id={client_id} subscribers={len(self.notification_subscribers)}")
 
             headers = {
                 'Content-Type': 'text/event-stream',
@@ -1163,17 +2015,30 @@ class DogServer:
                 'Connection': 'keep-alive',
                 'Access-Control-Allow-Origin': '*'
             }
+            if stream is not None:
+                headers['Content-Encoding'] = 'gzip'
+                headers['Vary'] = 'Accept-Encoding'
             return Response(stream_with_context(gen()), headers=headers)
 
         @self.app.route('/notifications/history', methods=['GET'])
         def notifications_history():
-            """拉取最近通知历史（用于重连补偿与通知中心列表）"""
+            """
+            拉取通知历史（用于重连补偿与通知中心列表），按 id 升序
+            参数: limit（默认 50，最大 200）；since_id: 只返回 id 更大的通知（从旧到新翻页），不传时返回最新的 limit 条；
+            type: 通知类型，多个用逗号分隔；client_id: 只返回广播和发给该客户端的通知
+            """
             try:
                 limit = int(request.args.get('limit', 50))
                 limit = max(1, min(limit, 200))
-                with self.notification_history_lock:
-                    items = list(self.notification_history)[-limit:]
-                logger.debug(f"[notifications] history limit={limit} -> {len(items)}")
+                since_id = request.args.get('since_id')
+                since_id = int(since_id) if since_id else None
+                types = [t for t in request.args.get('type', '').split(',') if t] or None
+                client_id = request.args.get('client_id') or None
+            except ValueError:
+                return jsonify({'message': 'limit 和 since_id 必须是整数'}), 400
+            try:
+                items = self.notification_log.query(since_id=since_id, types=types, recipient=client_id, limit=limit)
+                logger.debug(f"[notifications] history since_id={since_id} type={types} limit={limit} -> {len(items)}")
                 return jsonify(items), 200
             except Exception as e:
                 logger.error(f"获取通知历史失败: {e}")
@@ -1181,28 +2046,44 @@ class DogServer:
 
         @self.app.route('/notifications/ack', methods=['POST'])
         def notifications_ack():
-            """通知确认回执（应用内弹窗已展示/已处理）"""
+            """
+            通知确认回执（应用内弹窗已展示/已处理）
+            记入送达跟踪（/notifications/status/<id>），并只推送给通知的发送方（没有发送方时不推送）
+            """
             try:
                 data = request.get_json() or {}
                 notif_id = data.get('id')
                 client_id = data.get('client_id')
                 logger.debug(f"[notifications] ack id={notif_id} from_client={client_id}")
-                ack = {
-                    'type': 'ack',
-                    'timestamp': datetime.now().isoformat(),
-                    'payload': {
-                        'id': notif_id,
-                        'client_id': client_id,
-                    },
-                    'message': 'ack'
-                }
-                # ack 也进入推送通道，便于另一端看到“已送达/已查看”
-                self.broadcast_notification(ack)
-                return jsonify({'message': 'ok'}), 200
+                tracked = isinstance(notif_id, int) and self.delivery.mark(notif_id, client_id, 'acked')
+                if tracked and self.notify_bus is not None:
+                    # 其他进程也停止重发，并能在 /notifications/status 中看到回执
+                    self.notify_bus.mark(notif_id, client_id, 'acked')
+                sender = self.delivery.sender(notif_id) if isinstance(notif_id, int) else None
+                if tracked and sender is not None and sender != client_id:
+                    self.broadcast_notification({
+                        'type': 'ack',
+                        'timestamp': datetime.now().isoformat(),
+                        'payload': {
+                            'id': notif_id,
+                            'client_id': client_id,
+                        },
+                        'message': 'ack',
+                        'to': sender,
+                    }, history=False)
+                return jsonify({'message': 'ok', 'tracked': tracked}), 200
             except Exception as e:
                 logger.error(f"通知确认失败: {e}")
                 return jsonify({'message': '服务器内部错误'}), 500
 
+        @self.app.route('/notifications/status/<int:notif_id>', methods=['GET'])
+        def notification_status(notif_id):
+            """通知的送达状态：每个接收方的 pending / enqueued / sent / acked 及时间"""
+            status = self.delivery.status(notif_id)
+            if status is None:
+                return jsonify({'message': '通知不存在或状态已过期'}), 404
+            return jsonify(status), 200
+
         @self.app.route('/notifications/publish', methods=['POST'])
         def publish_notification():
             try:
@@ -1224,12 +2105,16 @@ class DogServer:
                     'from': data.get('from'),
                     'to': data.get('to'),
                 }
-                self.broadcast_notification(notif)
+                try:
+                    online = self.broadcast_notification(notif, strict=True)
+                except ConnectionError:
+                    queued = notif['type'] in self.delivery.critical_types
+                    return jsonify({'message': '通知总线不可用' + ('，已排队稍后重发' if queued else ''), 'queued': queued}), 503
 
                 if require_delivery:
-                    # 至少存在 1 个订阅者才算“可送达”（不保证对方已看见，但保证连接在线）
-                    with self.notification_lock:
-                        online = len(self.notification_subscribers)
+                    if online is None:
+                        online = self.count_online(notif)
+                    # 至少 1 个在线的接收方才算“可送达”（是否已看见见 /notifications/status/<id>）
                     return jsonify({'message': '已推送', 'delivered_possible': online > 0, 'online_subscribers': online, 'id': notif.get('id')}), 200
 
                 return jsonify({'message': '已推送', 'id': notif.get('id')}), 200
@@ -1241,64 +2126,19 @@ class DogServer:
         @self.app.route('/get_schedule', methods=['GET'])
         def get_schedule():
             try:
-                data = self.load_assets_json('reminders.json')
-                return jsonify(data.get('reminders', [])), 200
+                data, version = self.load_assets_versioned('reminders.json')
+                return self.cached_json_response('schedule', version, lambda: data.get('reminders', []))
             except Exception as e:
                 logger.error(f"获取日程失败: {e}")
                 return jsonify({'message': '服务器内部错误'}), 500
 
         @self.app.route('/update_schedule', methods=['POST'])
         def update_schedule():
-            try:
-                payload = request.get_json()
-                if not payload:
-                    return jsonify({'message': '未接收到数据'}), 400
-
-                schedules = self.load_assets_json('reminders.json').get('reminders', [])
-                schedule_id = payload.get('schedule_id')
-                if schedule_id is None:
-                    schedule_id = (max((item.get('id', 0) for item in schedules), default=0) + 1)
-                    schedules.append({
-                        'id': schedule_id,
-                        'time': payload.get('time', ''),
-                        'event': payload.get('event', ''),
-                        'completed': bool(payload.get('completed', False)),
-                      })
-                else:
-                    updated = False
-                    for item in schedules:
-                        if item.get('id') == schedule_id:
-                            item['time'] = payload.get('time', item['time'])
-                            item['event'] = payload.get('event', item['event'])
-                            item['completed'] = bool(payload.get('completed', item['completed']))
-                            updated = True
-                            break
-                    if not updated:
-                        return jsonify({'message': '未找到对应日程'}), 404
-
-                if self.save_assets_json({'reminders': schedules}, 'reminders.json'):
-                    return jsonify({'message': '日程保存成功', 'schedule_id': schedule_id}), 200
-                return jsonify({'message': '保存失败'}), 500
-            except Exception as e:
-                logger.error(f"保存日程失败: {e}")
-                return jsonify({'message': '服务器内部错误'}), 500
+            return self.apply_asset_op('update_schedule', request.get_json(silent=True))
 
         @self.app.route('/delete_schedule', methods=['POST'])
         def delete_schedule():
-            try:
-                data = request.get_json()
-                schedule_id = data.get('schedule_id')
-                if schedule_id is None:
-                    return jsonify({'message': '缺少 schedule_id'}), 400
-
-                schedules = self.load_assets_json('reminders.json').get('reminders', [])
-                schedules = [item for item in schedules if item.get('id') != schedule_id]
-                if self.save_assets_json({'reminders': schedules}, 'reminders.json'):
-                    return jsonify({'message': '删除成功'}), 200
-                return jsonify({'message': '保存失败'}), 500
-            except Exception as e:
-                logger.error(f"删除日程失败: {e}")
-                return jsonify({'message': '服务器内部错误'}), 500
+            return self.apply_asset_op('delete_schedule', request.get_json(silent=True))
 
         # 新增：重要消息广播 API
         @self.app.route('/broadcast_important_message', methods=['POST'])
@@ -1341,7 +2181,7 @@ class DogServer:
             若不存在或已过期，返回 { "has_message": false }。
             """
             try:
-                data = self.load_json_data('important_message.json')
+                data = self.load_json_data('important_message.json', readonly=True)
                 if not data:
                     return jsonify({'has_message': False}), 200
 
@@ -1385,20 +2225,19 @@ class DogServer:
                     return jsonify({'message': '未接收到有效数据'}), 400
                 
                 activity = {
-                    'activity_type': data.get('activity_type', 'other'),
+                    'activity_type': data.get('activity_type') or 'other',
                     'description': data.get('description', ''),
                     'timestamp': data.get('timestamp') or datetime.now().isoformat(),
                 }
+                # 活动类型作为统计和索引的键，必须在写入日志之前校验
+                if not isinstance(activity['activity_type'], str):
+                    return jsonify({'message': 'activity_type 必须是字符串'}), 400
                 
-                # 保存活动记录
-                activities = self.load_json_data('activity_records.json') or []
-                activities.append(activity)
-                
-                # 只保留最近200条记录
-                if len(activities) > 200:
-                    activities = activities[-200:]
-                
-                if self.save_json_data(activities, 'activity_records.json'):
+                # 追加活动记录
+                if self.append_record(self.activity_log, activity):
+                    self.activity_stats.add(activity)
+                    self.activity_store.add(activity)
+                    self.activity_rollup.add([activity])
                     logger.info(f"[{datetime.now()}] 患者活动已记录: {activity}")
                     return jsonify({'message': '活动记录已保存'}), 200
                 return jsonify({'message': '保存失败'}), 500
@@ -1411,71 +2250,59 @@ class DogServer:
             """
             获取患者活动统计信息
             返回: 最近7天、24小时、1小时的活动数据及图表数据
+            统计由 ActivityAggregator 在上传时增量维护，这里直接读取
             """
             try:
-                from datetime import timedelta
-                activities = self.load_json_data('activity_records.json') or []
-                
-                now = datetime.now()
-                one_hour_ago = now - timedelta(hours=1)
-                one_day_ago = now - timedelta(days=1)
-                seven_days_ago = now - timedelta(days=7)
-                
-                # 统计不同时间段的活动
-                one_hour_activities = []
-                one_day_activities = []
-                seven_day_activities = []
-                
-                for activity in activities:
-                    try:
-                        activity_time = datetime.fromisoformat(activity['timestamp'])
-                        if activity_time > one_hour_ago:
-                            one_hour_activities.append(activity)
-                        if activity_time > one_day_ago:
-                            one_day_activities.append(activity)
-                        if activity_time > seven_days_ago:
-                            seven_day_activities.append(activity)
-                    except Exception:
-                        pass
-                
-                # 统计各类型活动次数
-                def count_by_type(activities_list):
-                    counts = {}
-                    for activity in activities_list:
-                        atype = activity.get('activity_type', 'other')
-                        counts[atype] = counts.get(atype, 0) + 1
-                    return counts
-                
-                # 按小时统计最近24小时的活动
-                hourly_counts = [0] * 24
-                for activity in one_day_activities:
-                    try:
-                        activity_time = datetime.fromisoformat(activity['timestamp'])
-                        hour = activity_time.hour
-                        hourly_counts[hour] += 1
-                    except Exception:
-                        pass
-                
-                return jsonify({
-                    'hour': {
-                        'count': len(one_hour_activities),
-                        'by_type': count_by_type(one_hour_activities)
-                    },
-                    'day': {
-                        'count': len(one_day_activities),
-                        'by_type': count_by_type(one_day_activities),
-                        'hourly': hourly_counts  # 24小时数据，供图表使用
-                    },
-                    'week': {
-                        'count': len(seven_day_activities),
-                        'by_type': count_by_type(seven_day_activities)
-                    },
-                    'timestamp': datetime.now().isoformat()
-                }), 200
+                stats = self.activity_stats.snapshot()
+                stats['timestamp'] = datetime.now().isoformat()
+                return jsonify(stats), 200
             except Exception as e:
                 logger.error(f"获取活动统计时出错: {e}")
                 return jsonify({'message': '服务器内部错误'}), 500
 
+        @self.app.route('/get_activity_range', methods=['GET'])
+        def get_activity_range():
+            """
+            按时间范围统计患者活动
+            参数:
+              from / to: ISO8601 时间或 epoch 秒，默认最近 7 天
+              type: 活动类型，多个用逗号分隔，默认全部
+              bucket: hour|day|week|month 或秒数，默认 day（按本地日历对齐）
+            返回: 总数、各类型数量以及每个分桶的数量；
+            范围超出原始记录保留期时，更早的部分使用分钟 / 小时汇总（tier 字段为所用的汇总层）
+            """
+            try:
+                now = time.time()
+                try:
+                    end = parse_range_time(request.args.get('to'), now)
+                    start = parse_range_time(request.args.get('from'), end - 7 * 86400)
+                    bucket = parse_bucket(request.args.get('bucket'))
+                    if start >= end:
+                        raise ValueError('from 必须早于 to')
+                    types = parse_fields(request.args.get('type'))
+                    tier = self.activity_rollup.choose_tier(start, end, now, None)
+                    raw_floor = now - self.ACTIVITY_RETENTION_DAYS * 86400
+                    if start >= raw_floor:
+                        tier = 'raw'
+                        older = None
+                    else:
+                        # 分界对齐到汇总桶，避免同一段数据被原始记录和汇总重复统计
+                        width = TIER_WIDTHS[tier]
+                        older = (self.activity_tier_stores[tier], -(-raw_floor // width) * width)
+                    result = self.activity_store.histogram(start, end, bucket, types, older)
+                except ValueError as e:
+                    return jsonify({'message': str(e)}), 400
+                result.update({
+                    'from': datetime.fromtimestamp(start).isoformat(),
+                    'to': datetime.fromtimestamp(end).isoformat(),
+                    'bucket': bucket,
+                    'tier': tier,
+                })
+                return jsonify(result), 200
+            except Exception as e:
+                logger.error(f"按时间范围统计活动时出错: {e}")
+                return jsonify({'message': '服务器内部错误'}), 500
+
         @self.app.route('/update_dog_location', methods=['POST'])
         def update_dog_location():
             """
@@ -1500,22 +2327,48 @@ class DogServer:
                     'timestamp': data.get('timestamp') or datetime.now().isoformat(),
                 }
                 
-                # 保存最新位置
-                if self.save_json_data(location, 'dog_location.json'):
-                    logger.info(f"[{datetime.now()}] 机器狗位置已更新: {location}")
-                    return jsonify({'message': '位置信息已保存'}), 200
-                return jsonify({'message': '保存失败'}), 500
+                # 更新内存中的最新位置（后台限速落盘）
+                self.live_state.set('dog_location', location)
+                logger.info(f"[{datetime.now()}] 机器狗位置已更新: {location}")
+                self.check_geofences([location])
+                return jsonify({'message': '位置信息已保存'}), 200
             except Exception as e:
                 logger.error(f"保存位置信息时出错: {e}")
                 return jsonify({'message': '服务器内部错误'}), 500
 
+        # ========== 地理围栏 API ==========
+        @self.app.route('/geofences', methods=['GET'])
+        def get_geofences():
+            """获取地理围栏配置，以及当前所在的围栏（inside）"""
+            try:
+                fences = self.load_assets_json('geofences.json', readonly=True)
+                return jsonify({'fences': fences, 'inside': self.geofences.inside()}), 200
+            except Exception as e:
+                logger.error(f"获取地理围栏时出错: {e}")
+                return jsonify({'message': '服务器内部错误'}), 500
+
+        @self.app.route('/geofences/update', methods=['POST'])
+        def update_geofence():
+            """
+            添加或更新地理围栏
+            请求体: {"fence_id"(可选，不传时生成), "name", "type": "circle|polygon",
+                     "center": [lat, lon], "radius_m" | "points": [[lat, lon], ...],
+                     "notify": ["enter", "exit"], "hysteresis_m", "enabled"}
+            """
+            return self.apply_asset_op('update_geofence', request.get_json(silent=True))
+
+        @self.app.route('/geofences/delete', methods=['POST'])
+        def delete_geofence():
+            """删除地理围栏，请求体: {"fence_id"}"""
+            return self.apply_asset_op('delete_geofence', request.get_json(silent=True))
+
         @self.app.route('/get_dog_location', methods=['GET'])
         def get_dog_location():
             """
-            获取机器狗当前位置
+            获取机器狗当前位置（内存中的最新值）
             """
             try:
-                location = self.load_json_data('dog_location.json')
+                location = self.live_state.get('dog_location')
                 if location:
                     return jsonify(location), 200
                 return jsonify({
@@ -1548,11 +2401,11 @@ class DogServer:
                     'timestamp': data.get('timestamp') or datetime.now().isoformat(),
                 }
                 
-                # 保存当前陪伴状态
-                if self.save_json_data(status, 'companion_status.json'):
-                    logger.info(f"[{datetime.now()}] 陪伴状态已更新: {status}")
-                    return jsonify({'message': '状态已保存'}), 200
-                return jsonify({'message': '保存失败'}), 500
+                # 更新内存中的陪伴状态（后台限速落盘），并重新设置超时定时器
+                self.live_state.set('companion_status', status)
+                self._arm_companion_timer(status)
+                logger.info(f"[{datetime.now()}] 陪伴状态已更新: {status}")
+                return jsonify({'message': '状态已保存'}), 200
             except Exception as e:
                 logger.error(f"保存陪伴状态时出错: {e}")
                 return jsonify({'message': '服务器内部错误'}), 500
@@ -1561,17 +2414,11 @@ class DogServer:
         def get_companion_status():
             """
             获取机器狗陪伴状态
+            心跳超过 COMPANION_STALE_SECONDS 未更新时由定时器标记为不陪伴，这里直接返回内存中的值
             """
             try:
-                status = self.load_json_data('companion_status.json')
+                status = self.live_state.get('companion_status')
                 if status:
-                    # 检查最后一次更新是否超过5分钟，如果是则认为不陪伴
-                    try:
-                        last_update = datetime.fromisoformat(status['timestamp'])
-                        if (datetime.now() - last_update).total_seconds() > 300:
-                            status['is_accompanying'] = False
-                    except Exception:
-                        pass
                     return jsonify(status), 200
                 return jsonify({
                     'is_accompanying': False,
@@ -1585,85 +2432,47 @@ class DogServer:
         # ========== 社区论坛 API ==========
         @self.app.route('/community/get_posts', methods=['GET'])
         def get_community_posts():
+            """
+            获取社区帖子（新帖在前）
+            查询参数（可选）: limit, fields（支持派生字段 comment_count）；传 cursor 时分页，返回 {"items", "next_cursor"}
+            """
             try:
-                data = self.load_assets_json('community.json')
-                return jsonify(data.get('posts', [])), 200
+                data, version = self.load_assets_versioned('community.json')
+                limit, cursor, paged, fields = self.page_args()
+                if not paged and limit is None and fields is None:
+                    return self.cached_json_response('community_posts', version, lambda: data.get('posts', []))
+
+                # 排序键 [-id, 原位置]：新帖在前，id 相同时保持原顺序
+                index = self.page_index(
+                    'community_posts', version,
+                    lambda: [([-int(p.get('id') or 0), pos], p) for pos, p in enumerate(data.get('posts', []))],
+                )
+                items, last_key = index.page(cursor.get('k') if cursor else None, limit or len(index.items))
+                virtual = {'comment_count': lambda p: len(p.get('comments', []))}
+                items = [project(p, fields, virtual) for p in items]
+                if paged:
+                    return jsonify({
+                        'items': items,
+                        'next_cursor': encode_cursor({'k': last_key}) if last_key is not None else None,
+                    }), 200
+                return jsonify(items), 200
+            except (ValueError, TypeError) as e:
+                return jsonify({'message': f'参数错误: {e}'}), 400
             except Exception as e:
                 logger.error(f"获取社区帖子失败: {e}")
                 return jsonify({'message': '服务器内部错误'}), 500
 
         @self.app.route('/community/create_post', methods=['POST'])
         def create_community_post():
-            try:
-                payload = request.get_json() or {}
-                posts = self.load_assets_json('community.json').get('posts', [])
-                post_id = (max((p.get('id', 0) for p in posts), default=0) + 1)
-                post = {
-                    'id': post_id,
-                    'title': payload.get('title', '').strip(),
-                    'content': payload.get('content', '').strip(),
-                    'author': payload.get('author', '匿名'),
-                    'timestamp': datetime.now().isoformat(),
-                    'likes': 0,
-                    'comments': [],
-                }
-                posts.insert(0, post)
-                if self.save_assets_json({'posts': posts}, 'community.json'):
-                    return jsonify({'message': '发帖成功', 'post_id': post_id}), 200
-                return jsonify({'message': '保存失败'}), 500
-            except Exception as e:
-                logger.error(f"创建帖子失败: {e}")
-                return jsonify({'message': '服务器内部错误'}), 500
+            return self.apply_asset_op('create_post', request.get_json(silent=True))
 
         @self.app.route('/community/comment_post', methods=['POST'])
         def comment_community_post():
-            try:
-                payload = request.get_json() or {}
-                post_id = payload.get('post_id')
-                text = payload.get('text', '').strip()
-                author = payload.get('author', '匿名')
-                if post_id is None or text == '':
-                    return jsonify({'message': '参数缺失'}), 400
-
-                data = self.load_assets_json('community.json')
-                posts = data.get('posts', [])
-                for p in posts:
-                    if p.get('id') == post_id:
-                        comment = {
-                            'id': (max((c.get('id', 0) for c in p.get('comments', [])), default=0) + 1),
-                            'author': author,
-                            'text': text,
-                            'timestamp': datetime.now().isoformat(),
-                        }
-                        p.setdefault('comments', []).append(comment)
-                        if self.save_assets_json({'posts': posts}, 'community.json'):
-                            return jsonify({'message': '评论成功'}), 200
-                        return jsonify({'message': '保存失败'}), 500
-
-                return jsonify({'message': '未找到帖子'}), 404
-            except Exception as e:
-                logger.error(f"评论失败: {e}")
-                return jsonify({'message': '服务器内部错误'}), 500
+            return self.apply_asset_op('comment_post', request.get_json(silent=True))
 
         @self.app.route('/community/like_post', methods=['POST'])
         def like_community_post():
-            try:
-                payload = request.get_json() or {}
-                post_id = payload.get('post_id')
-                if post_id is None:
-                    return jsonify({'message': '参数缺失'}), 400
-                data = self.load_assets_json('community.json')
-                posts = data.get('posts', [])
-                for p in posts:
-                    if p.get('id') == post_id:
-                        p['likes'] = int(p.get('likes', 0)) + 1
-                        if self.save_assets_json({'posts': posts}, 'community.json'):
-                            return jsonify({'message': '已点赞', 'likes': p['likes']}), 200
-                        return jsonify({'message': '保存失败'}), 500
-                return jsonify({'message': '未找到帖子'}), 404
-            except Exception as e:
-                logger.error(f"点赞失败: {e}")
-                return jsonify({'message': '服务器内部错误'}), 500
+            return self.apply_asset_op('like_post', request.get_json(silent=True))
 
         # ========== 视频直播 API ==========
         @self.app.route('/get_available_videos', methods=['GET'])
@@ -1764,6 +2573,26 @@ class DogServer:
                 logger.error(f"获取直播状态失败: {e}")
                 return jsonify({'message': '服务器内部错误'}), 500
 
+        # 较大的 JSON 响应按 Accept-Encoding 压缩（已压缩或流式响应跳过）
+        @self.app.after_request
+        def compress_json_response(resp):
+            try:
+                if (resp.status_code != 200 or resp.direct_passthrough or resp.is_streamed
+                        or resp.mimetype != 'application/json' or 'Content-Encoding' in resp.headers):
+                    return resp
+                body = resp.get_data()
+                if len(body) < self.COMPRESS_MIN_SIZE:
+                    return resp
+                resp.vary.add('Accept-Encoding')
+                encoding = negotiate(request.accept_encodings)
+                if encoding is None:
+                    return resp
+                resp.set_data(compress(body, encoding))
+                resp.headers['Content-Encoding'] = encoding
+            except Exception as e:
+                logger.error(f"压缩响应失败: {e}")
+            return resp
+
         # 错误处理
         @self.app.errorhandler(413)
         def too_large(e):
@@ -1789,6 +2618,26 @@ class DogServer:
         # 使用多线程模式运行
         self.app.run(host='0.0.0.0', port=port, debug=False, threaded=True)
     
+    def shutdown(self):
+        """停止后台线程，并把延迟写的数据全部落盘"""
+        self.schedule_notifier_stop.set()
+        self.retention_stop.set()
+        self.redelivery_stop.set()
+        self.live_state.close()
+        for rollup in (self.gps_rollup, self.activity_rollup):
+            try:
+                rollup.close()
+            except Exception as e:
+                logger.error(f"关闭汇总日志失败: {e}")
+        for log in (self.gps_log, self.activity_log):
+            try:
+                log.close()
+            except Exception as e:
+                logger.error(f"关闭 {os.path.basename(log.path)} 失败: {e}")
+        self.notification_log.close()
+        if not self.json_store.close():
+            logger.error("退出时仍有数据未能写入磁盘")
+
     def start(self, port=8080):
         """启动服务器线程"""
         server_thread = threading.Thread(target=self.run_server, kwargs={'port': port})
@@ -1809,6 +2658,7 @@ def main():
             # 例如：处理视觉识别、运动控制等
             time.sleep(1)
     except KeyboardInterrupt:
+        dog_server.shutdown()
         print("程序退出")
 
 if __name__ == '__main__':
@@ -0,0 +1,211 @@
+"""
+地理围栏
+围栏配置保存在 assets/geofences.json（{fence_id: 围栏}），支持两种形状：
+- 圆形: {"type": "circle", "center": [lat, lon], "radius_m": 半径}
+- 多边形: {"type": "polygon", "points": [[lat, lon], ...]}
+可选字段: name、enabled（默认 true）、notify（["enter", "exit"] 的子集，默认两者）、hysteresis_m
+每次位置更新时通过网格索引只检查附近的围栏和当前所在的围栏；
+进出判断带迟滞：进入要求进入边界内 hysteresis_m 米，离开要求离开边界外 hysteresis_m 米，避免在边界附近来回抖动；
+小围栏的迟滞不超过围栏内部最深处（圆为半径，多边形为内切圆半径的估计）的 HYSTERESIS_MAX_FRACTION，保证能够触发进入
+"""
+import math
+from threading import Lock
+
+from rollups import EARTH_RADIUS_M
+
+M_PER_DEG = math.radians(1) * EARTH_RADIUS_M
+HYSTERESIS_MAX_FRACTION = 0.5
+
+
+def validate_fence(fence):
+    """校验并规范化一个围栏定义，返回 (围栏, 错误信息)"""
+    if not isinstance(fence, dict):
+        return None, '围栏必须是对象'
+    shape = fence.get('type')
+    notify = fence.get('notify')
+    if notify is None:
+        notify = ['enter', 'exit']
+    elif isinstance(notify, str):
+        notify = [notify]
+    result = {
+        'name': str(fence.get('name', '')),
+        'type': shape,
+        'enabled': bool(fence.get('enabled', True)),
+        'notify': [e for e in notify if e in ('enter', 'exit')],
+    }
+    try:
+        if fence.get('hysteresis_m') is not None:
+            result['hysteresis_m'] = max(0.0, float(fence['hysteresis_m']))
+        if shape == 'circle':
+            lat, lon = (float(v) for v in fence['center'])
+            radius = float(fence['radius_m'])
+            if radius <= 0:
+                return None, 'radius_m 必须大于 0'
+            result.update({'center': [lat, lon], 'radius_m': radius})
+        elif shape == 'polygon':
+            points = [[float(p[0]), float(p[1])] for p in fence['points']]
+            if len(points) < 3:
+                return None, '多边形至少需要 3 个顶点'
+            result['points'] = points
+        else:
+            return None, 'type 必须是 circle 或 polygon'
+    except KeyError as e:
+        return None, f'缺少字段: {e.args[0]}'
+    except (TypeError, ValueError, IndexError):
+        return None, '坐标格式错误'
+    for lat, lon in [result['center']] if shape == 'circle' else result['points']:
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            return None, '经纬度超出范围'
+    return result, None
+
+
+class _CompiledFence:
+    """预处理后的围栏：以参考点做等距投影（米），计算点到边界的有符号距离"""
+    def __init__(self, fence_id, fence, default_hysteresis):
+        self.id = fence_id
+        self.name = fence.get('name') or fence_id
+        self.notify = set(fence.get('notify', ('enter', 'exit')))
+        hysteresis = fence.get('hysteresis_m', default_hysteresis)
+        if fence['type'] == 'circle':
+            self.ref = tuple(fence['center'])
+            self.radius = fence['radius_m']
+            self.polygon = None
+            dlat = self.radius / M_PER_DEG
+            dlon = dlat / max(math.cos(math.radians(self.ref[0])), 1e-6)
+            self.bbox = (self.ref[0] - dlat, self.ref[1] - dlon, self.ref[0] + dlat, self.ref[1] + dlon)
+        else:
+            points = fence['points']
+            self.ref = tuple(points[0])
+            self.radius = None
+            self.polygon = [self._project(lat, lon) for lat, lon in points]
+            lats = [p[0] for p in points]
+            lons = [p[1] for p in points]
+            self.bbox = (min(lats), min(lons), max(lats), max(lons))
+        self.hysteresis = min(hysteresis, self._depth() * HYSTERESIS_MAX_FRACTION)
+
+    def _depth(self, samples=16):
+        """围栏内部离边界最远的距离（米）；多边形在外接矩形内取网格点估计，结果不大于真实值"""
+        if self.polygon is None:
+            return self.radius
+        min_lat, min_lon, max_lat, max_lon = self.bbox
+        depth = 0.0
+        for i in range(samples + 1):
+            lat = min_lat + (max_lat - min_lat) * i / samples
+            for j in range(samples + 1):
+                lon = min_lon + (max_lon - min_lon) * j / samples
+                depth = max(depth, -self.signed_distance(lat, lon))
+        return depth
+
+    def _project(self, lat, lon):
+        return (
+            (lon - self.ref[1]) * M_PER_DEG * math.cos(math.radians(self.ref[0])),
+            (lat - self.ref[0]) * M_PER_DEG,
+        )
+
+    def signed_distance(self, lat, lon):
+        """点到边界的距离（米），在围栏内为负"""
+        x, y = self._project(lat, lon)
+        if self.polygon is None:
+            return math.hypot(x, y) - self.radius
+        inside = False
+        nearest = float('inf')
+        poly = self.polygon
+        for i in range(len(poly)):
+            ax, ay = poly[i - 1]
+            bx, by = poly[i]
+            if (ay > y) != (by > y) and x < (bx - ax) * (y - ay) / (by - ay) + ax:
+                inside = not inside
+            dx, dy = bx - ax, by - ay
+            seg2 = dx * dx + dy * dy
+            t = 0.0 if seg2 == 0 else max(0.0, min(1.0, ((x - ax) * dx + (y - ay) * dy) / seg2))
+            nearest = min(nearest, math.hypot(x - ax - t * dx, y - ay - t * dy))
+        return -nearest if inside else nearest
+
+
+class GeofenceEngine:
+    """
+    围栏判断引擎（跟踪单个对象的位置）
+    网格索引：cell_deg 大小的网格 -> 外接矩形（含迟滞余量）与之相交的围栏；
+    覆盖网格过多的大围栏放在 _large 中每次都检查
+    """
+    def __init__(self, cell_deg=0.005, hysteresis_m=15.0, max_cells=10000):
+        self.cell_deg = cell_deg
+        self.hysteresis_m = hysteresis_m
+        self.max_cells = max_cells
+        self.version = None
+        self._lock = Lock()
+        self._fences = {}
+        self._grid = {}
+        self._large = []
+        self._inside = set()  # 当前所在的围栏 id
+        self._known = set()  # 已经确定过初始状态的围栏 id（新增的围栏在下一次位置更新时确定）
+
+    def _cell(self, lat, lon):
+        return (math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg))
+
+    def load(self, fences, version=None):
+        """用 {fence_id: 围栏} 重建索引；保留仍然存在的围栏的进出状态"""
+        compiled = {}
+        for fence_id, fence in (fences or {}).items():
+            fence, error = validate_fence(fence)
+            if error is None and fence['enabled']:
+                compiled[fence_id] = _CompiledFence(fence_id, fence, self.hysteresis_m)
+        grid = {}
+        large = []
+        for fence in compiled.values():
+            min_lat, min_lon, max_lat, max_lon = fence.bbox
+            margin_lat = fence.hysteresis / M_PER_DEG
+            margin_lon = margin_lat / max(math.cos(math.radians(max(abs(min_lat), abs(max_lat)))), 1e-6)
+            r0, c0 = self._cell(min_lat - margin_lat, min_lon - margin_lon)
+            r1, c1 = self._cell(max_lat + margin_lat, max_lon + margin_lon)
+            if (r1 - r0 + 1) * (c1 - c0 + 1) > self.max_cells:
+                large.append(fence)
+                continue
+            for r in range(r0, r1 + 1):
+                for c in range(c0, c1 + 1):
+                    grid.setdefault((r, c), []).append(fence)
+        with self._lock:
+            self._fences = compiled
+            self._grid = grid
+            self._large = large
+            self._inside &= set(compiled)
+            self._known &= set(compiled)
+            self.version = version
+
+    def update(self, lat, lon):
+        """
+        输入新位置，返回发生的进出事件 [(围栏 id, 名称, 'enter' | 'exit')]（已按围栏的 notify 设置过滤）
+        围栏第一次被判断时只记录初始状态，不产生事件
+        """
+        events = []
+        with self._lock:
+            candidates = {f.id: f for f in self._grid.get(self._cell(lat, lon), ())}
+            for fence in self._large:
+                candidates[fence.id] = fence
+            for fence_id in self._inside:
+                candidates.setdefault(fence_id, self._fences[fence_id])
+            for fence in candidates.values():
+                d = fence.signed_distance(lat, lon)
+                was_inside = fence.id in self._inside
+                if fence.id not in self._known:
+                    self._known.add(fence.id)
+                    if d <= 0:
+                        self._inside.add(fence.id)
+                    continue
+                if not was_inside and d < -fence.hysteresis:
+                    self._inside.add(fence.id)
+                    event = 'enter'
+                elif was_inside and d > fence.hysteresis:
+                    self._inside.discard(fence.id)
+                    event = 'exit'
+                else:
+                    continue
+                if event in fence.notify:
+                    events.append((fence.id, fence.name, event))
+            # 不在候选中的围栏离当前位置很远，确定在外面
+            self._known = set(self._fences)
+        return events
+
+    def inside(self):
+        with self._lock:
+            return sorted(self._inside)
@@ -0,0 +1,161 @@
+"""
+GPS / 活动记录的批量上传
+请求体可以是 JSON 数组、{"gps": [...], "activity": [...]} 对象，或 NDJSON（每行一条记录）；
+支持 Content-Encoding: gzip。每条记录用 kind 字段（gps / activity）指明类型，
+未指定时有 activity_type 的视为活动，有 lat/lon 的视为 GPS。
+离线缓存的记录保留各自的时间（GPS 的 timestamp 写入 server_received_time，未带时间时用接收时间）；
+晚于接收时间 MAX_CLOCK_SKEW 秒以上、或早于保留期的记录被拒绝
+"""
+import json
+import zlib
+from datetime import datetime
+
+from storage import parse_timestamp
+
+MAX_CLOCK_SKEW = 300  # 秒，允许设备时钟比服务器快的量
+
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl', 'application/x-jsonlines')
+
+
+def decode_body(data, content_encoding, mimetype, max_size=64 * 1024 * 1024):
+    """返回 [(序号, 记录或 None, 错误信息或 None)]；整体格式错误时抛出 ValueError"""
+    if (content_encoding or '').lower() == 'gzip':
+        try:
+            decompressor = zlib.decompressobj(31)
+            data = decompressor.decompress(data, max_size + 1)
+        except zlib.error:
+            raise ValueError('gzip 数据无效')
+        if len(data) > max_size:
+            raise ValueError('解压后的数据过大')
+    try:
+        text = data.decode('utf-8')
+    except UnicodeDecodeError:
+        raise ValueError('请求体必须是 UTF-8 编码')
+    if mimetype in NDJSON_MIMETYPES:
+        items = []
+        index = 0
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            try:
+                items.append((index, json.loads(line), None))
+            except ValueError:
+                items.append((index, None, '不是有效的 JSON'))
+            index += 1
+        return items
+    try:
+        body = json.loads(text)
+    except ValueError:
+        raise ValueError('不是有效的 JSON')
+    if isinstance(body, dict):
+        records = []
+        for kind in ('gps', 'activity'):
+            for record in body.get(kind) or []:
+                if isinstance(record, dict):
+                    record = dict(record, kind=kind)
+                records.append(record)
+        body = records
+    if not isinstance(body, list):
+        raise ValueError('请求体应为数组、对象或 NDJSON')
+    return [(i, record, None) for i, record in enumerate(body)]
+
+
+def classify(record):
+    kind = record.get('kind')
+    if kind in ('gps', 'activity'):
+        return kind
+    if kind is not None:
+        return None
+    if 'activity_type' in record:
+        return 'activity'
+    if 'lat' in record and 'lon' in record:
+        return 'gps'
+    return None
+
+
+def _check_time(value, now, retention_days):
+    """校验记录自带的时间，返回 (epoch 秒, 错误信息)"""
+    ts = parse_timestamp(value)
+    if ts is None:
+        return None, '时间戳格式无效'
+    if ts > now + MAX_CLOCK_SKEW:
+        return None, '时间戳晚于服务器时间'
+    if retention_days is not None and ts < now - retention_days * 86400:
+        return None, '时间戳早于保留期'
+    return ts, None
+
+
+def validate_gps(record, now, retention_days=None):
+    """返回 (要保存的记录, 错误信息)"""
+    try:
+        lat = float(record['lat'])
+        lon = float(record['lon'])
+    except KeyError as e:
+        return None, f'缺少必要GPS字段: {e.args[0]}'
+    except (TypeError, ValueError):
+        return None, '经纬度必须是数字'
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return None, '经纬度超出范围'
+    fix = {k: v for k, v in record.items() if k != 'kind'}
+    received_at = datetime.fromtimestamp(now).isoformat()
+    if record.get('timestamp') in (None, ''):
+        fix['server_received_time'] = received_at
+    else:
+        ts, error = _check_time(record['timestamp'], now, retention_days)
+        if error is not None:
+            return None, error
+        # 轨迹、汇总和保留都按 server_received_time 计时，这里用定位本身的时间
+        fix['server_received_time'] = datetime.fromtimestamp(ts).isoformat()
+        fix['ingested_at'] = received_at
+    return fix, None
+
+
+def validate_activity(record, now, retention_days=None):
+    atype = record.get('activity_type') or 'other'
+    if not isinstance(atype, str):
+        return None, 'activity_type 必须是字符串'
+    timestamp = record.get('timestamp')
+    if timestamp in (None, ''):
+        timestamp = datetime.fromtimestamp(now).isoformat()
+    else:
+        _, error = _check_time(timestamp, now, retention_days)
+        if error is not None:
+            return None, error
+    return {
+        'activity_type': atype,
+        'description': record.get('description', ''),
+        'timestamp': timestamp,
+    }, None
+
+
+VALIDATORS = {'gps': validate_gps, 'activity': validate_activity}
+
+
+def validate_batch(items, now, retention=None, max_errors=100):
+    """
+    now 为接收时间（epoch 秒），retention 为 {类型: 保留天数}
+    返回 ({'gps': [...], 'activity': [...]}, 被拒绝的数量, 错误列表)，GPS 记录按时间排序
+    错误列表最多 max_errors 条，每条为 {'index', 'error'}
+    """
+    retention = retention or {}
+    accepted = {'gps': [], 'activity': []}
+    rejected = 0
+    errors = []
+    for index, record, error in items:
+        if error is None:
+            if not isinstance(record, dict):
+                error = '记录必须是对象'
+            else:
+                kind = classify(record)
+                if kind is None:
+                    error = '无法识别的记录类型'
+                else:
+                    value, error = VALIDATORS[kind](record, now, retention.get(kind))
+                    if error is None:
+                        accepted[kind].append(value)
+        if error is not None:
+            rejected += 1
+            if len(errors) < max_errors:
+                errors.append({'index': index, 'error': error})
+    accepted['gps'].sort(key=lambda fix: parse_timestamp(fix['server_received_time']))
+    return accepted, rejected, errors
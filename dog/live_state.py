@@ -0,0 +1,111 @@
+"""
+实时状态登记表（机器狗最新位置、陪伴状态等高频轮询的小状态）
+- 读：直接返回内存中的当前值，不读盘、不加文件锁
+- 写：只更新内存；后台线程按 persist_interval 限速落盘，同一项在间隔内多次更新只写最后一次
+- 定时器：到期时在后台线程中回调（例如陪伴心跳超时后标记为不陪伴），更新时重新设置
+- 值发生变化时调用 on_change(name, value)，用于推送给订阅端
+"""
+import time
+import logging
+from threading import Condition, Thread
+
+logger = logging.getLogger(__name__)
+
+
+class LiveStateRegistry:
+    def __init__(self, persist, persist_interval=2.0, on_change=None):
+        self._persist = persist  # persist(name, value)
+        self.persist_interval = persist_interval
+        self._on_change = on_change
+        self._values = {}
+        self._dirty = {}  # name -> 可以落盘的最早时间（monotonic）
+        self._last_persist = {}
+        self._timers = {}  # name -> (到期时间（monotonic）, callback)
+        self._cond = Condition()
+        self._stopped = False
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def get(self, name, default=None):
+        """返回当前值（共享对象，调用方不得修改）"""
+        with self._cond:
+            return self._values.get(name, default)
+
+    def load(self, name, value):
+        """设置初始值（启动时从磁盘读取），不落盘、不推送"""
+        with self._cond:
+            self._values[name] = value
+
+    def set(self, name, value):
+        """更新状态，返回值是否发生变化"""
+        with self._cond:
+            changed = self._values.get(name) != value
+            self._values[name] = value
+            if name not in self._dirty:
+                self._dirty[name] = self._last_persist.get(name, float('-inf')) + self.persist_interval
+                self._cond.notify()
+        if changed and self._on_change is not None:
+            try:
+                self._on_change(name, value)
+            except Exception as e:
+                logger.error(f"推送状态 {name} 失败: {e}")
+        return changed
+
+    def set_timer(self, name, delay, callback):
+        """delay 秒后调用 callback()；同名定时器会被替换，delay 为 None 时取消"""
+        with self._cond:
+            if delay is None:
+                self._timers.pop(name, None)
+            else:
+                self._timers[name] = (time.monotonic() + max(0.0, delay), callback)
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    now = time.monotonic()
+                    deadlines = list(self._dirty.values()) + [t[0] for t in self._timers.values()]
+                    if deadlines and min(deadlines) <= now:
+                        break
+                    self._cond.wait(min(deadlines) - now if deadlines else None)
+                if self._stopped:
+                    return
+                now = time.monotonic()
+                to_persist = [(name, self._values[name]) for name, due in self._dirty.items() if due <= now]
+                for name, _ in to_persist:
+                    del self._dirty[name]
+                    self._last_persist[name] = now
+                fired = [name for name, (due, _) in self._timers.items() if due <= now]
+                callbacks = [self._timers.pop(name)[1] for name in fired]
+            for name, value in to_persist:
+                self._write(name, value)
+            for callback in callbacks:
+                try:
+                    callback()
+                except Exception as e:
+                    logger.error(f"状态定时器回调失败: {e}")
+
+    def _write(self, name, value):
+        try:
+            self._persist(name, value)
+        except Exception as e:
+            logger.error(f"保存状态 {name} 失败: {e}")
+
+    def flush(self):
+        """立即写出所有未落盘的状态"""
+        with self._cond:
+            pending = [(name, self._values[name]) for name in self._dirty]
+            self._dirty.clear()
+            now = time.monotonic()
+            for name, _ in pending:
+                self._last_persist[name] = now
+        for name, value in pending:
+            self._write(name, value)
+
+    def close(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._thread.join(timeout=5)
+        self.flush()
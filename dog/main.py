@@ -12,6 +12,7 @@ if BASE_DIR not in sys.path:
 
 from dog_server import DogServer
 from webrtc_server import WebRTCServer
+from notify_gateway import NotificationGateway
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -21,6 +22,11 @@ class AppLauncher:
         self.dog_server = DogServer()
         self.webrtc_server = WebRTCServer()
         self.api_port = 8080
+        # 通知网关：在一个事件循环上承载所有 SSE / WebSocket 通知订阅（地址同 /notifications/subscribe）
+        self.notify_port = self.api_port + 2
+        self.notify_gateway = NotificationGateway(
+            self.dog_server.notifications, self.dog_server, port=self.notify_port
+        )
 
     def start(self):
         def start_dog():
@@ -33,14 +39,25 @@ class AppLauncher:
             self.webrtc_server.run(host='0.0.0.0', port=webrtc_port, debug=False)
 
         start_dog()
+        try:
+            self.notify_gateway.start()
+        except OSError as e:
+            # 网关不可用时客户端仍可使用 api 端口上的 /notifications/subscribe
+            logger.error(f"通知网关启动失败: {e}")
         import threading
         t2 = threading.Thread(target=start_webrtc, daemon=True)
         t2.start()
 
         # 信号处理与阻塞主线程
-        logger.info("两个后端已启动，按 Ctrl+C 退出")
-        while True:
-            time.sleep(1)
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        logger.info(f"后端已启动（通知网关端口 {self.notify_port}），按 Ctrl+C 退出")
+        try:
+            while True:
+                time.sleep(1)
+        except (KeyboardInterrupt, SystemExit):
+            logger.info("正在退出，写入未落盘的数据...")
+            self.notify_gateway.stop()
+            self.dog_server.shutdown()
 
 
 
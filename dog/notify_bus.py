@@ -0,0 +1,367 @@
+"""
+通知分发
+所有通知按序号写入同一个环形缓冲区，每个 SSE 订阅者只保存自己的读取游标：
+- 发布：分配序号、写入一个槽位、唤醒等待的订阅者，不为每个订阅者复制或入队
+- 订阅：从自己的游标开始读取并按 'to' 过滤；落后超过 capacity 条的慢客户端直接跳到最旧的一条，
+  不会像每个订阅者一个无界队列那样无限堆积
+- 历史：最近 history_size 条需要记入历史的通知，SSE 重连时按 Last-Event-ID 从这里补发断线期间错过的通知；
+  配置了持久化日志（NotificationLog）时，通知 id 由日志分配、重启后不重复，超出内存历史的补发从日志读取
+- 监听：其他线程 / 事件循环通过 add_listener 得到发布提醒，再用 entries 按游标批量读取（见 notify_gateway）
+- 过滤：订阅时可按通知类型、发送方、接收方过滤（TopicFilter），网关用 SubscriptionIndex 按类型只找出相关的连接
+- 合并：一次读到的多条通知合并为一次写入；订阅时可设合并窗口（coalesce 毫秒），同一批中 collapse key 相同的通知只推送最新一条（关键类型不合并）
+"""
+import fnmatch
+import json
+import time
+import logging
+from collections import deque
+from threading import Condition, Lock
+
+logger = logging.getLogger(__name__)
+
+# 没有显式 collapse_key 时，这些类型的通知以类型作为 collapse key（新的状态覆盖旧的）
+COLLAPSIBLE_TYPES = ('dog_location', 'companion_status')
+MAX_COALESCE_MS = 5000
+
+
+def sse_frame(event):
+    """一条通知的 SSE 帧；带整数 id 的通知同时输出 SSE id，供重连时的 Last-Event-ID 使用"""
+    lines = f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+    if isinstance(event.get('id'), int):
+        return f"id: {event['id']}\n" + lines
+    return lines
+
+
+def collapse_key(event):
+    key = event.get('collapse_key')
+    if key is None and event.get('type') in COLLAPSIBLE_TYPES:
+        key = event['type']
+    return key
+
+
+def coalesce(events, keep_types=()):
+    """
+    同一 collapse key 的通知只保留最新的一条，其余保持原顺序，返回 (保留的通知, 被覆盖的通知)
+    keep_types 中的类型（关键通知）不合并，每条都要单独送达和回执
+    """
+    latest = {}
+    keys = [None if event.get('type') in keep_types else collapse_key(event) for event in events]
+    for i, key in enumerate(keys):
+        if key is not None:
+            latest[key] = i
+    if len(latest) == sum(key is not None for key in keys):
+        return events, []
+    kept, superseded = [], []
+    for i, (event, key) in enumerate(zip(events, keys)):
+        (kept if key is None or latest[key] == i else superseded).append(event)
+    return kept, superseded
+
+
+def coalesce_window(args):
+    """订阅参数 coalesce（毫秒，最大 MAX_COALESCE_MS）转为秒，未指定或无效时为 0（不等待）"""
+    try:
+        ms = int(args.get('coalesce') or 0)
+    except ValueError:
+        return 0.0
+    return max(0, min(ms, MAX_COALESCE_MS)) / 1000.0
+
+
+def compile_target(target):
+    """
+    把通知的 'to' 转为接收者集合，None 表示广播
+    - None / 'all': 广播
+    - <client_id>: 定向
+    - {'any_of': [id1, id2]}: 多播
+    """
+    if target is None or target == 'all':
+        return None
+    if isinstance(target, dict) and isinstance(target.get('any_of'), list):
+        return frozenset(str(cid) for cid in target['any_of'])
+    return frozenset([str(target)])
+
+
+class _Patterns:
+    """
+    一组匹配模式（逗号分隔）：'sos' 精确匹配，'sched*' 通配符，'!ack' 排除
+    只有排除项时表示除这些之外的全部
+    """
+    MAX_CACHE = 1024
+
+    def __init__(self, spec):
+        self.include = set()
+        self.include_wild = []
+        self.exclude = set()
+        self.exclude_wild = []
+        for item in spec.split(','):
+            item = item.strip()
+            negate = item.startswith('!')
+            if negate:
+                item = item[1:].strip()
+            if not item:
+                continue
+            wild = any(ch in item for ch in '*?[')
+            if negate:
+                (self.exclude_wild.append if wild else self.exclude.add)(item)
+            else:
+                (self.include_wild.append if wild else self.include.add)(item)
+        self._cache = {}
+
+    @property
+    def exact(self):
+        """只由精确值组成时返回这些值（可建索引），否则为 None"""
+        if self.include and not self.include_wild:
+            return self.include
+        return None
+
+    def match(self, value):
+        value = '' if value is None else str(value)
+        result = self._cache.get(value)
+        if result is None:
+            if value in self.exclude or any(fnmatch.fnmatchcase(value, p) for p in self.exclude_wild):
+                result = False
+            elif not self.include and not self.include_wild:
+                result = True
+            else:
+                result = value in self.include or any(fnmatch.fnmatchcase(value, p) for p in self.include_wild)
+            if len(self._cache) >= self.MAX_CACHE:
+                self._cache.clear()
+            self._cache[value] = result
+        return result
+
+
+class TopicFilter:
+    """
+    订阅过滤条件，每一维为逗号分隔的模式（见 _Patterns），未指定的维度不过滤：
+    - types: 通知类型（type）
+    - senders: 发送方（from）
+    - recipients: 接收方（to），广播为 'all'，定向 / 多播为其中的 client_id，任一匹配即可
+    """
+    def __init__(self, types=None, senders=None, recipients=None):
+        self._specs = {'types': types, 'senders': senders, 'recipients': recipients}
+        self.types = _Patterns(types) if types else None
+        self.senders = _Patterns(senders) if senders else None
+        self.recipients = _Patterns(recipients) if recipients else None
+
+    @classmethod
+    def from_args(cls, args):
+        """从查询参数（types / senders / recipients）创建，都未指定时返回 None"""
+        specs = [args.get(name) for name in ('types', 'senders', 'recipients')]
+        if not any(specs):
+            return None
+        return cls(*specs)
+
+    def to_args(self):
+        """还原为 from_args 的参数（经通知总线转发给其他进程）"""
+        return {name: spec for name, spec in self._specs.items() if spec}
+
+    @property
+    def exact_types(self):
+        return self.types.exact if self.types is not None else None
+
+    def matches(self, target, event):
+        if self.types is not None and not self.types.match(event.get('type')):
+            return False
+        if self.senders is not None and not self.senders.match(event.get('from')):
+            return False
+        if self.recipients is not None:
+            values = ('all',) if target is None else target
+            if not any(self.recipients.match(v) for v in values):
+                return False
+        return True
+
+
+def accepts(target, event, client_id, topic=None):
+    """通知是否发给 client_id，且符合其订阅过滤条件"""
+    if target is not None and client_id not in target:
+        return False
+    return topic is None or topic.matches(target, event)
+
+
+class SubscriptionIndex:
+    """
+    订阅者按通知类型建立的索引：只订阅确定类型的订阅者挂在这些类型下，
+    未限定类型或使用了通配 / 排除的放在 _any 中，广播时只需检查 candidates(type) 返回的订阅者
+    """
+    def __init__(self):
+        self._by_type = {}  # type -> {key: value}
+        self._any = {}
+        self._types = {}  # key -> 所在的类型集合（None 表示在 _any 中）
+
+    def add(self, key, topic, value):
+        self.remove(key)
+        types = topic.exact_types if topic is not None else None
+        if types is None:
+            self._any[key] = value
+        else:
+            for event_type in types:
+                self._by_type.setdefault(event_type, {})[key] = value
+        self._types[key] = types
+
+    def remove(self, key):
+        if key not in self._types:
+            return
+        types = self._types.pop(key)
+        if types is None:
+            self._any.pop(key, None)
+            return
+        for event_type in types:
+            members = self._by_type.get(event_type)
+            if members is not None:
+                members.pop(key, None)
+                if not members:
+                    del self._by_type[event_type]
+
+    def candidates(self, event_type):
+        members = self._by_type.get(event_type)
+        if not members:
+            return list(self._any.values())
+        return list(self._any.values()) + list(members.values())
+
+
+class NotificationRing:
+    def __init__(self, capacity=1024, history_size=200, log=None):
+        self.capacity = capacity
+        self._slots = [None] * capacity  # (目标集合, 通知)
+        self._next_seq = 0
+        self._log = None
+        self._next_id = 1
+        self._history = deque(maxlen=history_size)  # (目标集合, 通知)
+        self._cond = Condition()
+        self._publish_lock = Lock()  # 发布者之间排队，保证 id 与序号顺序一致；读取方只用 _cond
+        self._listeners = []
+        if log is not None:
+            self.attach_log(log)
+
+    def attach_log(self, log):
+        """
+        配置持久化日志并从中载入最近的历史
+        可以在已经开始发布之后调用（例如先创建环形缓冲区，再连接会立即转发通知的总线）：
+        查询日志时不持有锁，期间发布的、比查询结果更新的通知保留在历史中
+        """
+        logged = log.query(limit=self._history.maxlen)
+        last_id = logged[-1]['id'] if logged else 0
+        with self._publish_lock:
+            with self._cond:
+                newer = [(target, event) for target, event in self._history if event.get('id', 0) > last_id]
+                self._history.clear()
+                for event in logged:
+                    self._history.append((compile_target(event.get('to')), event))
+                self._history.extend(newer)
+                self._next_id = max(self._next_id, log.next_id)
+                self._log = log
+
+    def add_listener(self, callback):
+        """每次发布后（锁外）调用 callback(序号)；回调应尽快返回，例如只唤醒另一个事件循环"""
+        self._listeners.append(callback)
+
+    @property
+    def next_seq(self):
+        """下一条通知的序号，新订阅者从这里开始读"""
+        with self._cond:
+            return self._next_seq
+
+    def publish(self, event, history=True, on_assign=None):
+        """
+        发布通知，返回序号
+        history=True 时分配通知 id（客户端据此回执）并记入历史；False 用于不需要回执的瞬时事件
+        on_assign(event) 在分配 id 之后、订阅者能读到之前调用（持有锁，应只做内存操作）
+        写日志（磁盘或总线）时不持有 _cond，读取通知的订阅者不会等待 I/O
+        """
+        target = compile_target(event.get('to'))
+        with self._publish_lock:
+            next_id = self._next_id
+            if history:
+                if self._log is not None:
+                    next_id = self._log.append(event) + 1
+                elif 'id' not in event:
+                    event['id'] = next_id
+                    next_id += 1
+            with self._cond:
+                self._next_id = next_id
+                if history:
+                    self._history.append((target, event))
+                if on_assign is not None:
+                    on_assign(event)
+                seq = self._next_seq
+                self._slots[seq % self.capacity] = (target, event)
+                self._next_seq = seq + 1
+                self._cond.notify_all()
+        for callback in self._listeners:
+            try:
+                callback(seq)
+            except Exception as e:
+                logger.error(f"通知监听回调失败: {e}")
+        return seq
+
+    def read(self, cursor, client_id, timeout, max_items=100, topic=None):
+        """
+        从 cursor 开始读取发给 client_id（且符合 topic 过滤条件）的通知，没有新通知时最多等待 timeout 秒
+        返回 (通知列表, 新游标, 因落后太多被跳过的条数)
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                oldest = max(0, self._next_seq - self.capacity)
+                dropped = 0
+                if cursor < oldest:
+                    dropped = oldest - cursor
+                    cursor = oldest
+                items = []
+                while cursor < self._next_seq and len(items) < max_items:
+                    target, event = self._slots[cursor % self.capacity]
+                    cursor += 1
+                    if accepts(target, event, client_id, topic):
+                        items.append(event)
+                if items or dropped:
+                    return items, cursor, dropped
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return [], cursor, 0
+                self._cond.wait(remaining)
+
+    def entries(self, cursor, max_items=1000):
+        """
+        不等待、不过滤地读取 cursor 之后的通知，返回 ([(序号, 目标集合, 通知)], 新游标, 被跳过的条数)
+        用于由调用方自己按目标分发的场景（一次读取，分发给所有连接）
+        """
+        with self._cond:
+            oldest = max(0, self._next_seq - self.capacity)
+            dropped = 0
+            if cursor < oldest:
+                dropped = oldest - cursor
+                cursor = oldest
+            items = []
+            while cursor < self._next_seq and len(items) < max_items:
+                target, event = self._slots[cursor % self.capacity]
+                items.append((cursor, target, event))
+                cursor += 1
+        return items, cursor, dropped
+
+    def history(self, limit):
+        with self._cond:
+            items = [event for _, event in self._history]
+        return items[-limit:]
+
+    def resume(self, last_id, client_id, topic=None):
+        """
+        SSE 断线重连：返回 (id 大于 last_id 且发给 client_id 的历史通知, 实时读取的起始游标, 是否完整)
+        历史与游标在同一把锁内取得，补发的通知不会再从实时通道重复收到；
+        last_id 比当前最大 id 还大时说明服务重启过、id 重新计数，补发全部历史。
+        last_id 早于历史中最旧的一条时，从持久化日志读取（最多 capacity 条）；仍无法补全时 complete 为 False
+        """
+        with self._cond:
+            history = list(self._history)
+            cursor = self._next_seq
+            newest = self._next_id - 1
+        if last_id > newest:
+            last_id = 0
+        history = [(target, event) for target, event in history if isinstance(event.get('id'), int)]
+        complete = not history or history[0][1]['id'] <= last_id + 1
+        if not complete and self._log is not None:
+            # 游标之后发布的通知会从实时通道收到，这里只取到 newest 为止
+            logged = self._log.query(since_id=last_id, recipient=client_id, limit=self.capacity)
+            history = [(compile_target(event.get('to')), event) for event in logged if event['id'] <= newest]
+            complete = len(logged) < self.capacity or bool(history and history[-1][1]['id'] == newest)
+        items = [event for target, event in history
+                 if event['id'] > last_id and accepts(target, event, client_id, topic)]
+        return items, cursor, complete
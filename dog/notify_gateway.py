@@ -0,0 +1,355 @@
+"""
+异步通知网关
+在一个 asyncio 事件循环上服务所有通知订阅连接，空闲的订阅只占一个套接字和少量内存，不再各占一个线程：
+- 地址与 Flask 路由相同：GET /notifications/subscribe?client_id=&live=&compress=&last_event_id=，
+  同样支持 types / senders / recipients 过滤；广播时通过 SubscriptionIndex 只检查订阅了该类型的连接
+- 一次唤醒中发给同一连接的多条通知合并为一次写入；coalesce=<毫秒> 的连接在窗口结束时统一发送，并按 collapse key 去掉被覆盖的通知（关键类型不合并）
+- 普通请求返回 SSE 事件流，格式与 Flask 版本一致（retry、id、data、keepalive 注释，支持 Last-Event-ID 补发和 gzip）
+- 带 Upgrade: websocket 的请求升级为 WebSocket，每条通知为一个文本帧（JSON），心跳为 ping 帧
+- 通知仍由 broadcast_notification 写入 NotificationRing；环形缓冲区发布后通过 call_soon_threadsafe 唤醒事件循环，
+  网关用一个全局游标读取新通知并按目标直接写入对应连接
+- 写缓冲超过 max_buffer 的慢客户端直接断开，由客户端带 Last-Event-ID 重连补发
+"""
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import struct
+import threading
+from urllib.parse import parse_qs, urlsplit
+
+from compression import GzipStream
+from notify_bus import SubscriptionIndex, TopicFilter, coalesce, coalesce_window, sse_frame
+
+logger = logging.getLogger(__name__)
+
+SUBSCRIBE_PATH = '/notifications/subscribe'
+WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+WS_MAX_PAYLOAD = 64 * 1024
+
+
+def _ws_frame(opcode, payload=b''):
+    """服务端发出的 WebSocket 帧（不加掩码）"""
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8')
+    n = len(payload)
+    if n < 126:
+        header = struct.pack('!BB', 0x80 | opcode, n)
+    elif n < 65536:
+        header = struct.pack('!BBH', 0x80 | opcode, 126, n)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, 127, n)
+    return header + payload
+
+
+def _http_response(status, headers=(), body=b''):
+    lines = [f'HTTP/1.1 {status}'] + [f'{k}: {v}' for k, v in headers]
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body
+
+
+class _Connection:
+    """一个订阅连接（SSE 或 WebSocket）"""
+    __slots__ = ('client_id', 'token', 'writer', 'websocket', 'stream', 'topic', 'start_seq',
+                 'window', 'pending', 'flush_handle')
+
+    def __init__(self, client_id, token, writer, websocket, stream, topic, window=0.0):
+        self.client_id = client_id
+        self.token = token
+        self.writer = writer
+        self.websocket = websocket
+        self.stream = stream  # SSE 的 GzipStream，未压缩时为 None
+        self.topic = topic  # TopicFilter，不过滤时为 None
+        self.start_seq = 0  # 序号小于它的通知已在订阅 / 补发时处理过
+        self.window = window  # 合并窗口（秒），0 表示每次唤醒立即发送
+        self.pending = []  # 窗口内等待发送的通知
+        self.flush_handle = None
+
+    def write(self, data):
+        if self.writer.is_closing():
+            return
+        if self.stream is not None:
+            data = self.stream.feed(data)
+        elif isinstance(data, str):
+            data = data.encode('utf-8')
+        self.writer.write(data)
+
+    def send(self, events):
+        """多条通知一次写入"""
+        if self.websocket:
+            self.write(b''.join(_ws_frame(0x1, json.dumps(event, ensure_ascii=False)) for event in events))
+        else:
+            self.write(''.join(sse_frame(event) for event in events))
+
+    def keepalive(self):
+        self.write(_ws_frame(0x9) if self.websocket else ': keepalive\n\n')
+
+    def buffered(self):
+        transport = self.writer.transport
+        return transport.get_write_buffer_size() if transport is not None else 0
+
+    def close(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if not self.writer.is_closing():
+            self.writer.close()
+
+
+class NotificationGateway:
+    """
+    ring: NotificationRing；subscribers: 提供 add_subscriber / is_subscriber / remove_subscriber / mark_sent 和 delivery（DogServer），
+    与 Flask 的 SSE 路由共用订阅登记和送达跟踪，在线人数、live 订阅和同一 client_id 重连的处理保持一致
+    """
+    def __init__(self, ring, subscribers, host='0.0.0.0', port=8082, keepalive=25, max_buffer=1024 * 1024):
+        self.ring = ring
+        self.subscribers = subscribers
+        self.host = host
+        self.port = port
+        self.keepalive = keepalive
+        self.max_buffer = max_buffer
+        self._loop = None
+        self._thread = None
+        self._server = None
+        self._keepalive_task = None
+        self._connections = {}  # client_id -> _Connection
+        self._index = SubscriptionIndex()  # 按通知类型索引的连接，用于广播
+        self._cursor = 0
+        self._wake_pending = False
+        ring.add_listener(self._on_publish)
+
+    def start(self):
+        """在独立线程的事件循环中启动监听，端口绑定失败时抛出异常"""
+        self._loop = asyncio.new_event_loop()
+        self._loop.run_until_complete(self._start())
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+
+    async def _start(self):
+        self._cursor = self.ring.next_seq
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self._keepalive_task = asyncio.ensure_future(self._keepalive_loop())
+        logger.info(f"[gateway] 通知网关监听 {self.host}:{self.port}")
+
+    def stop(self):
+        if self._loop is None or not self._loop.is_running():
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._stop(), self._loop).result(timeout=5)
+        except Exception as e:
+            logger.error(f"[gateway] 关闭通知网关失败: {e}")
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+
+    async def _stop(self):
+        self._keepalive_task.cancel()
+        self._server.close()
+        for conn in list(self._connections.values()):
+            conn.close()
+        await self._server.wait_closed()
+
+    def connection_count(self):
+        return len(self._connections)
+
+    # ---------- 分发 ----------
+
+    def _on_publish(self, seq):
+        """在发布通知的线程中调用：只唤醒事件循环一次，由 _dispatch 批量读取"""
+        loop = self._loop
+        if loop is None or self._wake_pending:
+            return
+        self._wake_pending = True
+        try:
+            loop.call_soon_threadsafe(self._dispatch)
+        except RuntimeError:
+            # 事件循环已关闭
+            pass
+
+    def _dispatch(self):
+        self._wake_pending = False
+        batches = {}  # 连接 -> 本次要发送的通知
+        while True:
+            items, self._cursor, dropped = self.ring.entries(self._cursor)
+            if dropped:
+                logger.warning(f"[gateway] 分发过慢，跳过 {dropped} 条通知")
+            if not items:
+                break
+            for seq, target, event in items:
+                if target is None:
+                    conns = self._index.candidates(event.get('type'))
+                else:
+                    conns = [self._connections[cid] for cid in target if cid in self._connections]
+                for conn in conns:
+                    if seq >= conn.start_seq and (conn.topic is None or conn.topic.matches(target, event)):
+                        batches.setdefault(conn, []).append(event)
+        for conn, events in batches.items():
+            if not conn.window:
+                self._send(conn, events)
+                continue
+            conn.pending.extend(events)
+            if conn.flush_handle is None:
+                conn.flush_handle = self._loop.call_later(conn.window, self._flush, conn)
+
+    def _flush(self, conn):
+        """合并窗口结束，发送窗口内积累的通知"""
+        conn.flush_handle = None
+        events, conn.pending = conn.pending, []
+        if events:
+            self._send(conn, events)
+
+    def _send(self, conn, events, collapse=True):
+        if collapse:
+            events, superseded = coalesce(events, self.subscribers.delivery.critical_types)
+            for event in superseded:
+                self.subscribers.mark_sent(conn.client_id, event, 'superseded')
+        try:
+            conn.send(events)
+        except Exception as e:
+            logger.error(f"[gateway] 推送失败 client_id={conn.client_id}: {e}")
+            conn.close()
+            return
+        logger.debug(f"[gateway] deliver to={conn.client_id} count={len(events)}")
+        for event in events:
+            self.subscribers.mark_sent(conn.client_id, event)
+        if conn.buffered() > self.max_buffer:
+            logger.warning(f"[gateway] client_id={conn.client_id} 读取过慢，断开连接等待重连补发")
+            conn.writer.transport.abort()
+
+    async def _keepalive_loop(self):
+        while True:
+            await asyncio.sleep(self.keepalive)
+            for conn in list(self._connections.values()):
+                if not self.subscribers.is_subscriber(conn.client_id, conn.token):
+                    # 同一 client_id 已从其他通道（Flask SSE）重新订阅
+                    conn.close()
+                    continue
+                conn.keepalive()
+
+    # ---------- 连接处理 ----------
+
+    async def _read_request(self, reader):
+        """读取请求行和请求头，返回 (方法, 路径, 查询参数, 请求头)"""
+        data = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout=10)
+        lines = data.decode('latin-1').split('\r\n')
+        method, target, _ = lines[0].split(' ', 2)
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+        url = urlsplit(target)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        return method, url.path, query, headers
+
+    async def _handle(self, reader, writer):
+        conn = None
+        try:
+            try:
+                method, path, query, headers = await self._read_request(reader)
+            except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+                writer.write(_http_response('400 Bad Request', [('Connection', 'close')]))
+                return
+            if path != SUBSCRIBE_PATH or method != 'GET':
+                writer.write(_http_response('404 Not Found', [('Connection', 'close')]))
+                return
+
+            client_id = query.get('client_id') or 'unknown'
+            live = query.get('live') in ('1', 'true')
+            topic = TopicFilter.from_args(query)
+            window = coalesce_window(query)
+            last_event_id = headers.get('last-event-id') or query.get('last_event_id')
+            try:
+                last_event_id = int(last_event_id) if last_event_id else None
+            except ValueError:
+                last_event_id = None
+
+            websocket = headers.get('upgrade', '').lower() == 'websocket'
+            stream = None
+            if websocket:
+                key = headers.get('sec-websocket-key')
+                if not key:
+                    writer.write(_http_response('400 Bad Request', [('Connection', 'close')]))
+                    return
+                accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode('latin-1')).digest()).decode('ascii')
+                writer.write(_http_response('101 Switching Protocols', [
+                    ('Upgrade', 'websocket'),
+                    ('Connection', 'Upgrade'),
+                    ('Sec-WebSocket-Accept', accept),
+                ]))
+            else:
+                response_headers = [
+                    ('Content-Type', 'text/event-stream'),
+                    ('Cache-Control', 'no-cache'),
+                    ('X-Accel-Buffering', 'no'),
+                    ('Connection', 'close'),
+                    ('Access-Control-Allow-Origin', '*'),
+                ]
+                if query.get('compress') in ('1', 'true', 'gzip') and 'gzip' in headers.get('accept-encoding', ''):
+                    stream = GzipStream()
+                    response_headers += [('Content-Encoding', 'gzip'), ('Vary', 'Accept-Encoding')]
+                writer.write(_http_response('200 OK', response_headers))
+
+            logger.info(f"[gateway] subscribe client_id={client_id} websocket={websocket}")
+            token = self.subscribers.add_subscriber(client_id, live, topic)
+            conn = _Connection(client_id, token, writer, websocket, stream, topic, window)
+            if not websocket:
+                # 客户端断线后 3 秒重连
+                conn.write('retry: 3000\n\n')
+            if last_event_id is None:
+                conn.start_seq = self.ring.next_seq
+            else:
+                missed, conn.start_seq, complete = self.ring.resume(last_event_id, client_id, topic)
+                logger.info(f"[gateway] resume client_id={client_id} last_event_id={last_event_id} replay={len(missed)}")
+                if not complete and not websocket:
+                    conn.write(': replay-incomplete\n\n')
+                if missed:
+                    self._send(conn, missed, collapse=False)
+            previous = self._connections.get(client_id)
+            self._connections[client_id] = conn
+            self._index.add(client_id, topic, conn)
+            if previous is not None:
+                previous.close()
+
+            if websocket:
+                await self._read_websocket(reader, conn)
+            else:
+                # SSE 客户端不会再发送数据，读到 EOF 即为断开
+                while await reader.read(1024):
+                    pass
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            logger.error(f"[gateway] 处理订阅连接出错: {e}")
+        finally:
+            if conn is not None:
+                conn.close()
+                if self._connections.get(conn.client_id) is conn:
+                    del self._connections[conn.client_id]
+                    self._index.remove(conn.client_id)
+                self.subscribers.remove_subscriber(conn.client_id, conn.token)
+                logger.info(f"[gateway] disconnect client_id={conn.client_id} connections={len(self._connections)}")
+            if not writer.is_closing():
+                writer.close()
+
+    async def _read_websocket(self, reader, conn):
+        """处理客户端发来的帧：回应 ping、关闭握手；其他消息忽略（回执仍走 POST /notifications/ack）"""
+        while True:
+            first, second = await reader.readexactly(2)
+            opcode = first & 0x0F
+            length = second & 0x7F
+            if length == 126:
+                length = struct.unpack('!H', await reader.readexactly(2))[0]
+            elif length == 127:
+                length = struct.unpack('!Q', await reader.readexactly(8))[0]
+            if length > WS_MAX_PAYLOAD:
+                conn.write(_ws_frame(0x8, struct.pack('!H', 1009)))
+                return
+            mask = await reader.readexactly(4) if second & 0x80 else None
+            payload = await reader.readexactly(length)
+            if mask is not None:
+                payload = bytes(b ^ mask[i & 3] for i, b in enumerate(payload))
+            if opcode == 0x8:
+                conn.write(_ws_frame(0x8, payload[:2]))
+                return
+            if opcode == 0x9:
+                conn.write(_ws_frame(0xA, payload))
@@ -0,0 +1,478 @@
+"""
+多进程通知总线（Unix 域套接字）
+多个 DogServer 进程（worker）共享同一套通知：
+- 集线器（hub）：持有通知日志（NotificationLog），统一分配 id、写日志，再把每条通知按顺序转发给所有 worker；
+  每个 worker 连接有自己的发送队列和写线程，慢的 worker 积压过多时被断开，不影响其他 worker 发布
+- 每个 worker 通过 NotificationBus 连接集线器：发布时把通知发给集线器，等集线器转发回来（已带 id）后
+  写入本进程的 NotificationRing，由持有 SSE / WebSocket 连接的那个进程推送给客户端
+- 选举：各 worker 启动时对 <socket>.lock 加文件锁，拿到锁的进程同时运行集线器；该进程退出后锁自动释放，
+  其他 worker 断线重连时重新选举，由新的集线器接着日志中最后一个 id 继续编号
+- 在线状态：各 worker 把本进程订阅者的上线 / 下线（presence）发给集线器，集线器转发给其他 worker，
+  worker 断开时通知其他 worker 清除它的订阅者（leave）；发布时据此统计所有进程中在线的接收方
+- 送达状态：sent / acked 经总线转发（mark），各进程的送达跟踪保持一致
+- 协议：每行一个 JSON 对象（op: hello / welcome / publish / event / query / result / mark / presence / leave）
+NotificationBus 同时实现 NotificationLog 的接口（next_id / append / query / prune / close），可直接作为环形缓冲区的日志
+"""
+import os
+import json
+import fcntl
+import socket
+import struct
+import logging
+import itertools
+from collections import deque
+from threading import Condition, Event, Lock, RLock, Thread
+
+from notify_bus import TopicFilter
+
+logger = logging.getLogger(__name__)
+
+
+_DISCONNECTED = object()  # 等待应答期间连接断开
+
+
+def _dumps(message):
+    return (json.dumps(message, ensure_ascii=False, separators=(',', ':')) + '\n').encode('utf-8')
+
+
+def _close(sock):
+    """关闭连接；先 shutdown，读线程持有的 makefile 还未关闭时对端也能立即读到 EOF"""
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+    try:
+        sock.close()
+    except OSError:
+        pass
+
+
+class _Outbox:
+    """
+    一个 worker 连接的发送队列：集线器持锁时只入队，由该连接自己的线程写 socket，
+    慢的 worker 不会拖住其他 worker 的发布；所有写入经同一个线程，消息不会交错
+    """
+    def __init__(self, conn, max_frames, on_error):
+        self.conn = conn
+        self.max_frames = max_frames
+        self.on_error = on_error
+        self._frames = deque()
+        self._cond = Condition()
+        self._closed = False
+        Thread(target=self._run, daemon=True).start()
+
+    def put(self, data):
+        """入队，队列已满或已关闭时返回 False"""
+        with self._cond:
+            if self._closed or len(self._frames) >= self.max_frames:
+                return False
+            self._frames.append(data)
+            self._cond.notify()
+            return True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._frames and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                data = self._frames.popleft()
+            try:
+                self.conn.sendall(data)
+            except OSError as e:
+                self.on_error(e)
+                return
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._frames.clear()
+            self._cond.notify()
+
+
+class NotificationHub:
+    """集线器：接受 worker 连接，分配 id 并按顺序向所有 worker 转发通知"""
+    def __init__(self, path, log, send_timeout=5.0, max_queue=10000):
+        self.path = path
+        self.log = log
+        self.send_timeout = send_timeout
+        self.max_queue = max_queue
+        self._lock = RLock()  # 保证分配 id、写日志、入队转发的顺序一致（断开 worker 时会重入）
+        self._conns = {}  # 连接编号 -> (socket, _Outbox)
+        self._clients = set()  # 已握手、接收转发的连接编号
+        self._presence = {}  # 连接编号 -> {client_id: 订阅过滤参数}
+        self._ids = itertools.count(1)
+        self._server = None
+        self._stopped = False
+
+    def start(self):
+        if os.path.exists(self.path):
+            # 上一个集线器进程异常退出留下的套接字文件
+            os.unlink(self.path)
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(self.path)
+        self._server.listen(64)
+        Thread(target=self._accept_loop, daemon=True).start()
+        logger.info(f"[bus] 通知集线器已启动 {self.path}，下一个 id 为 {self.log.next_id}")
+
+    def _accept_loop(self):
+        while not self._stopped:
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                return
+            if self._stopped:
+                _close(conn)
+                return
+            # 读取不设超时；写入超过 send_timeout 秒未完成视为该 worker 卡住
+            seconds = int(self.send_timeout)
+            conn.setsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO,
+                            struct.pack('ll', seconds, int((self.send_timeout - seconds) * 1e6)))
+            client = next(self._ids)
+            outbox = _Outbox(conn, self.max_queue, lambda e, client=client: self._send_failed(client, e))
+            with self._lock:
+                self._conns[client] = (conn, outbox)
+            Thread(target=self._serve, args=(client, conn), daemon=True).start()
+
+    def _serve(self, client, conn):
+        try:
+            with conn.makefile('rb') as reader:
+                for line in reader:
+                    try:
+                        message = json.loads(line)
+                    except ValueError:
+                        continue
+                    self._handle(client, message)
+        except OSError:
+            pass
+        finally:
+            self._drop(client)
+
+    def _handle(self, client, message):
+        op = message.get('op')
+        if op == 'publish':
+            event = message['event']
+            history = message.get('history', True)
+            with self._lock:
+                if history:
+                    self.log.append(event)
+                self._broadcast(_dumps({
+                    'op': 'event', 'event': event, 'history': history,
+                    'origin': client, 'ref': message.get('ref'),
+                }))
+        elif op == 'mark':
+            with self._lock:
+                self._broadcast(_dumps(message), exclude=client)
+        elif op == 'presence':
+            with self._lock:
+                subscribers = self._presence.setdefault(client, {})
+                if message.get('online'):
+                    subscribers[message['client_id']] = message.get('topic')
+                else:
+                    subscribers.pop(message['client_id'], None)
+                self._broadcast(_dumps(dict(message, worker=client)), exclude=client)
+        elif op == 'query':
+            items = self.log.query(**message.get('args', {}))
+            self._send(client, _dumps({'op': 'result', 'ref': message.get('ref'), 'items': items}))
+        elif op == 'hello':
+            # 握手后才加入转发：welcome 是该 worker 收到的第一条消息，其中的在线状态与之后转发的 presence 衔接
+            with self._lock:
+                presence = [[worker, cid, topic] for worker, subscribers in self._presence.items()
+                            for cid, topic in subscribers.items()]
+                self._send(client, _dumps({
+                    'op': 'welcome', 'client': client, 'next_id': self.log.next_id, 'presence': presence,
+                }))
+                if client in self._conns:
+                    self._clients.add(client)
+
+    def _broadcast(self, data, exclude=None):
+        for client in list(self._clients):
+            if client != exclude:
+                self._send(client, data)
+
+    def _send(self, client, data):
+        entry = self._conns.get(client)
+        if entry is None:
+            return
+        if not entry[1].put(data):
+            # 积压超过 max_queue 条的 worker 断开，由它重连（其 SSE 客户端按 Last-Event-ID 补发）
+            logger.warning(f"[bus] worker {client} 发送队列已满，断开")
+            self._drop(client)
+
+    def _send_failed(self, client, error):
+        # 写不进去（超过 send_timeout）的 worker 断开，由它重连
+        logger.warning(f"[bus] worker {client} 发送失败，断开: {error}")
+        self._drop(client)
+
+    def _drop(self, client):
+        with self._lock:
+            entry = self._conns.pop(client, None)
+            self._clients.discard(client)
+            if self._presence.pop(client, None) and not self._stopped:
+                # 其他 worker 清除该 worker 的订阅者
+                self._broadcast(_dumps({'op': 'leave', 'worker': client}))
+        if entry is not None:
+            entry[1].close()
+            _close(entry[0])
+
+    def prune(self, now=None):
+        with self._lock:
+            return self.log.prune(now)
+
+    def close(self):
+        self._stopped = True
+        if self._server is not None:
+            # shutdown 唤醒阻塞在 accept 的线程，之后的连接请求直接失败，由其他 worker 重新选举
+            _close(self._server)
+        for client in list(self._conns):
+            self._drop(client)
+        self.log.close()
+
+
+class NotificationBus:
+    """
+    worker 端：连接集线器（必要时自己成为集线器）
+    on_event(event, history) 在收到集线器转发的通知时调用（写入本进程的环形缓冲区），返回值作为 publish 的返回值；
+    on_mark(event_id, client_id, state) 在其他 worker 转发送达状态（sent / acked）时调用
+    subscribers() 返回本进程的订阅者 {client_id: TopicFilter 或 None}，每次（重新）连接集线器后重新上报
+    log_factory() 在本进程成为集线器时创建通知日志
+    """
+    def __init__(self, path, log_factory, on_event, on_mark=None, subscribers=None, timeout=5.0):
+        self.path = path
+        self.log_factory = log_factory
+        self.on_event = on_event
+        self.on_mark = on_mark
+        self.subscribers = subscribers
+        self.timeout = timeout
+        self.hub = None
+        self._lock_file = None
+        self._sock = None
+        self._client = None
+        self._send_lock = Lock()
+        self._refs = itertools.count(1)
+        self._waiting = {}  # ref -> [Event, 结果]
+        self._presence = {}  # 其他 worker 的订阅者：连接编号 -> {client_id: TopicFilter 或 None}
+        self._presence_lock = Lock()
+        self._next_id = 1
+        self._stopped = False
+        self._connected = Event()
+        self._connect()
+        Thread(target=self._read_loop, daemon=True).start()
+
+    # ---------- 连接与选举 ----------
+
+    def _try_become_hub(self):
+        if self.hub is not None:
+            return
+        if self._lock_file is None:
+            self._lock_file = open(self.path + '.lock', 'a')
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (OSError, ValueError):
+            # 其他进程持有锁，或本进程正在关闭（锁文件已关闭）
+            return
+        if self._stopped:
+            return
+        self.hub = NotificationHub(self.path, self.log_factory())
+        self.hub.start()
+
+    def _connect(self):
+        for _ in range(max(1, int(self.timeout / 0.1))):
+            if self._stopped:
+                break
+            self._try_become_hub()
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.path)
+                reader = sock.makefile('rb')
+                sock.sendall(_dumps({'op': 'hello', 'pid': os.getpid()}))
+                welcome = json.loads(reader.readline())
+            except (OSError, ValueError):
+                # 集线器尚未启动或正在退出
+                sock.close()
+                Event().wait(0.1)
+                continue
+            self._sock = sock
+            self._reader = reader
+            self._client = welcome['client']
+            self._next_id = max(self._next_id, welcome['next_id'])
+            with self._presence_lock:
+                self._presence = {}
+                for worker, client_id, topic in welcome.get('presence', []):
+                    self._presence.setdefault(worker, {})[client_id] = TopicFilter.from_args(topic or {})
+            if self.subscribers is not None:
+                for client_id, topic in self.subscribers().items():
+                    self.presence(client_id, topic)
+            self._connected.set()
+            logger.info(f"[bus] 已连接通知总线 {self.path}（worker {self._client}{'，集线器' if self.hub else ''}）")
+            return
+        raise ConnectionError(f'无法连接通知总线 {self.path}')
+
+    def _read_loop(self):
+        while not self._stopped:
+            try:
+                line = self._reader.readline()
+            except (OSError, ValueError):
+                line = b''
+            if not line:
+                if self._stopped:
+                    return
+                logger.warning("[bus] 与通知集线器的连接断开，重新连接")
+                self._connected.clear()
+                with self._presence_lock:
+                    self._presence = {}
+                self._fail_waiting()
+                try:
+                    self._connect()
+                except ConnectionError as e:
+                    if self._stopped:
+                        return
+                    logger.error(f"[bus] {e}")
+                    Event().wait(1)
+                continue
+            try:
+                self._dispatch(json.loads(line))
+            except Exception as e:
+                logger.error(f"[bus] 处理总线消息失败: {e}")
+
+    def _dispatch(self, message):
+        op = message.get('op')
+        if op == 'event':
+            event = message['event']
+            if isinstance(event.get('id'), int):
+                self._next_id = max(self._next_id, event['id'] + 1)
+            result = self.on_event(event, message.get('history', True))
+            if message.get('origin') == self._client:
+                self._resolve(message.get('ref'), (event, result))
+        elif op == 'result':
+            self._resolve(message.get('ref'), message.get('items', []))
+        elif op == 'mark' and self.on_mark is not None:
+            self.on_mark(message['id'], message['client_id'], message['state'])
+        elif op == 'presence':
+            with self._presence_lock:
+                subscribers = self._presence.setdefault(message['worker'], {})
+                if message.get('online'):
+                    subscribers[message['client_id']] = TopicFilter.from_args(message.get('topic') or {})
+                else:
+                    subscribers.pop(message['client_id'], None)
+        elif op == 'leave':
+            with self._presence_lock:
+                self._presence.pop(message['worker'], None)
+
+    def _resolve(self, ref, value):
+        waiter = self._waiting.pop(ref, None)
+        if waiter is not None:
+            waiter[1] = value
+            waiter[0].set()
+
+    def _fail_waiting(self):
+        for ref in list(self._waiting):
+            self._resolve(ref, _DISCONNECTED)
+
+    def _request(self, message, retries=1):
+        """
+        发送请求并等待集线器的应答，超时时返回 None
+        等待期间连接断开（例如集线器退出、重新选举）时，重连后重发，最多 retries 次；
+        发布因此是至少一次：旧集线器已转发但未应答的通知可能再发布一次
+        """
+        for _ in range(retries + 1):
+            if not self._connected.wait(self.timeout):
+                return None
+            ref = next(self._refs)
+            waiter = [Event(), None]
+            self._waiting[ref] = waiter
+            message['ref'] = ref
+            sock = self._sock
+            try:
+                with self._send_lock:
+                    sock.sendall(_dumps(message))
+            except OSError as e:
+                self._waiting.pop(ref, None)
+                logger.error(f"[bus] 发送到通知总线失败: {e}")
+                if self._sock is sock:
+                    # 读线程读到断开后重新连接，重连前的重发在下一轮等待
+                    self._connected.clear()
+                continue
+            if not waiter[0].wait(self.timeout):
+                self._waiting.pop(ref, None)
+                return None
+            if waiter[1] is not _DISCONNECTED:
+                return waiter[1]
+        return None
+
+    # ---------- 发布 ----------
+
+    def publish(self, event, history=True):
+        """
+        经集线器发布通知：返回本进程 on_event 的返回值，并把集线器分配的 id 写回 event
+        集线器不可用时抛出 ConnectionError
+        """
+        reply = self._request({'op': 'publish', 'event': event, 'history': history})
+        if reply is None:
+            raise ConnectionError('通知总线不可用')
+        echoed, result = reply
+        if 'id' in echoed:
+            event['id'] = echoed['id']
+        return result
+
+    def mark(self, event_id, client_id, state):
+        """把送达状态（sent / acked）转发给其他 worker"""
+        self._send({'op': 'mark', 'id': event_id, 'client_id': client_id, 'state': state})
+
+    def presence(self, client_id, topic=None, online=True):
+        """上报本进程订阅者的上线（附订阅过滤条件）/ 下线"""
+        self._send({
+            'op': 'presence', 'client_id': client_id, 'online': online,
+            'topic': topic.to_args() if topic is not None else None,
+        })
+
+    def remote_subscribers(self, client_ids=None):
+        """连接在其他 worker 上的订阅者 {client_id: TopicFilter 或 None}；给出 client_ids 时只查这些"""
+        with self._presence_lock:
+            if client_ids is None:
+                return {cid: topic for subscribers in self._presence.values() for cid, topic in subscribers.items()}
+            return {cid: subscribers[cid] for subscribers in self._presence.values()
+                    for cid in client_ids if cid in subscribers}
+
+    def _send(self, message):
+        """发送不需要应答的消息；断线时丢弃，重新连接后在线状态会整体重新上报"""
+        try:
+            with self._send_lock:
+                self._sock.sendall(_dumps(message))
+        except OSError as e:
+            logger.error(f"[bus] 发送 {message['op']} 失败: {e}")
+
+    # ---------- NotificationLog 接口 ----------
+
+    @property
+    def next_id(self):
+        return self._next_id
+
+    def append(self, event):
+        """通知已由集线器写入日志并分配 id"""
+        return event['id']
+
+    def query(self, since_id=None, types=None, recipient=None, limit=50):
+        items = self._request({'op': 'query', 'args': {
+            'since_id': since_id, 'types': types, 'recipient': recipient, 'limit': limit,
+        }})
+        if items is None:
+            raise ConnectionError('通知总线不可用')
+        return items
+
+    def prune(self, now=None):
+        """日志保留由集线器所在的进程执行"""
+        if self.hub is not None:
+            return self.hub.prune(now)
+        return 0
+
+    def close(self):
+        self._stopped = True
+        if self._sock is not None:
+            _close(self._sock)
+        if self.hub is not None:
+            self.hub.close()
+            self.hub = None
+        if self._lock_file is not None:
+            self._lock_file.close()
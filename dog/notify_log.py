@@ -0,0 +1,260 @@
+"""
+通知日志（持久化）
+- 分段保存在一个目录下，每段一个 JSONL 文件（文件名为段内第一条通知的 id），写满 segment_size 条后换新段
+- 追加为 O(1)：只在当前段末尾写一行，不重写文件；id 单调递增，重启后接着最后一条继续编号
+- 内存索引：id -> (段, 文件偏移)，type -> [id]，接收方 -> [id]（广播记为 'all'），均为有序列表，
+  since_id 查询为二分查找，按偏移直接读取对应的行
+- 保留：按段整体删除最后写入时间早于 retention_days 的段
+"""
+import os
+import json
+import time
+import logging
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from heapq import merge
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+BROADCAST = 'all'
+
+
+def recipients_of(event):
+    """通知的接收方列表，广播为 ['all']"""
+    target = event.get('to')
+    if target is None or target == BROADCAST:
+        return [BROADCAST]
+    if isinstance(target, dict) and isinstance(target.get('any_of'), list):
+        return [str(cid) for cid in target['any_of']]
+    return [str(target)]
+
+
+class NotificationLog:
+    def __init__(self, directory, retention_days=30, segment_size=10000, cache_size=1000):
+        self.directory = directory
+        self.retention_days = retention_days
+        self.segment_size = segment_size
+        self.cache_size = cache_size
+        self._lock = Lock()
+        self._segments = []  # 各段第一条通知的 id（有序）
+        self._ids = []  # 所有保留通知的 id（有序）
+        self._offsets = []  # 与 _ids 对应的文件偏移
+        self._by_type = {}  # type -> [id]
+        self._by_recipient = {}  # client_id / 'all' -> [id]
+        self._cache = OrderedDict()  # 最近追加 / 读取过的通知
+        self._file = None
+        self._count = 0  # 当前段的条数
+        self._next_id = 1
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    @property
+    def next_id(self):
+        with self._lock:
+            return self._next_id
+
+    def _segment_path(self, first_id):
+        return os.path.join(self.directory, f'{first_id:012d}.jsonl')
+
+    def _load(self):
+        """启动时扫描各段建立索引；最后一段末尾不完整的行（崩溃时写了一半）会被截掉"""
+        names = sorted(n for n in os.listdir(self.directory) if n.endswith('.jsonl') and n[:-6].isdigit())
+        for i, name in enumerate(names):
+            first_id = int(name[:-6])
+            path = os.path.join(self.directory, name)
+            count = 0
+            offset = 0
+            with open(path, 'rb+') as f:
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        f.truncate(offset)
+                        break
+                    try:
+                        event = json.loads(line)
+                        event_id = int(event['id'])
+                    except (ValueError, KeyError, TypeError):
+                        offset += len(line)
+                        continue
+                    if event_id >= self._next_id:
+                        self._index(event_id, offset, event)
+                        self._next_id = event_id + 1
+                        count += 1
+                    offset += len(line)
+            if count or i == len(names) - 1:
+                self._segments.append(first_id)
+                self._count = count
+            else:
+                os.remove(path)
+        logger.info(f"[notifications] 通知日志已加载 {len(self._ids)} 条，下一个 id 为 {self._next_id}")
+
+    def _index(self, event_id, offset, event):
+        self._ids.append(event_id)
+        self._offsets.append(offset)
+        self._by_type.setdefault(str(event.get('type')), []).append(event_id)
+        for recipient in recipients_of(event):
+            self._by_recipient.setdefault(recipient, []).append(event_id)
+
+    def _cache_put(self, event_id, event):
+        """调用方持有锁"""
+        self._cache[event_id] = event
+        self._cache.move_to_end(event_id)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def append(self, event):
+        """为通知分配 id（已有 id 时沿用）并追加到当前段，返回 id"""
+        with self._lock:
+            if not isinstance(event.get('id'), int) or event['id'] < self._next_id:
+                event['id'] = self._next_id
+            event_id = event['id']
+            line = (json.dumps(event, ensure_ascii=False, separators=(',', ':')) + '\n').encode('utf-8')
+            if not self._segments or self._count >= self.segment_size:
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                self._segments.append(event_id)
+                self._count = 0
+            if self._file is None:
+                self._file = open(self._segment_path(self._segments[-1]), 'ab')
+            offset = self._file.tell()
+            self._file.write(line)
+            self._file.flush()
+            self._count += 1
+            self._next_id = event_id + 1
+            self._index(event_id, offset, event)
+            self._cache_put(event_id, event)
+        return event_id
+
+    def _locate(self, event_ids):
+        """
+        调用方持有锁：缓存命中的通知直接返回，其余按段给出 (id, 文件偏移)，
+        由 _read_segments 在锁外读取（段只追加，当前段不会被 prune 删除）
+        """
+        cached = {}
+        by_segment = {}
+        for event_id in event_ids:
+            event = self._cache.get(event_id)
+            if event is not None:
+                cached[event_id] = event
+                continue
+            i = bisect_left(self._ids, event_id)
+            if i == len(self._ids) or self._ids[i] != event_id:
+                continue
+            segment = self._segments[bisect_right(self._segments, event_id) - 1]
+            by_segment.setdefault(segment, []).append((event_id, self._offsets[i]))
+        return cached, by_segment
+
+    def _read_segments(self, by_segment):
+        """按偏移读取通知（不持有锁）；同一段的多条只打开一次文件"""
+        result = {}
+        for segment, entries in by_segment.items():
+            try:
+                with open(self._segment_path(segment), 'rb') as f:
+                    for event_id, offset in entries:
+                        f.seek(offset)
+                        result[event_id] = json.loads(f.readline())
+            except FileNotFoundError:
+                # 读取期间该段已过保留期被删除
+                continue
+            except (OSError, ValueError) as e:
+                logger.error(f"读取通知日志段 {segment} 失败: {e}")
+        if result:
+            with self._lock:
+                for event_id, event in result.items():
+                    self._cache_put(event_id, event)
+        return result
+
+    def query(self, since_id=None, types=None, recipient=None, limit=50):
+        """
+        查询通知，按 id 升序返回
+        since_id: 只返回 id 大于它的前 limit 条；为 None 时返回最新的 limit 条
+        types: 通知类型列表；recipient: 只返回广播和发给该 client_id 的通知
+        每个索引列表只二分定位到 since_id，再惰性归并，取够 limit 条即停止
+        """
+        if not limit:
+            return []
+        with self._lock:
+            groups = []
+            if types:
+                groups.append([self._by_type.get(str(t), []) for t in types])
+            if recipient is not None:
+                groups.append([self._by_recipient.get(BROADCAST, []), self._by_recipient.get(str(recipient), [])])
+            if not groups:
+                groups.append([self._ids])
+            # 由总条数较少的一组驱动遍历，其余各组用二分判断是否包含
+            groups.sort(key=lambda lists: sum(len(ids) for ids in lists))
+            driver, filters = groups[0], groups[1:]
+            ids = []
+            for event_id in self._scan(driver, since_id):
+                if all(self._contains(lists, event_id) for lists in filters):
+                    ids.append(event_id)
+                    if len(ids) >= limit:
+                        break
+            if since_id is None:
+                ids.reverse()
+            found, by_segment = self._locate(ids)
+        # 读文件时不持有锁，不阻塞 append（发布通知）
+        found.update(self._read_segments(by_segment))
+        return [found[i] for i in ids if i in found]
+
+    @staticmethod
+    def _scan(lists, since_id):
+        """按 id 遍历多个有序列表的并集（去重）：since_id 为 None 时从最新往前，否则从 since_id 之后往后"""
+        if since_id is None:
+            streams = [map(ids.__getitem__, range(len(ids) - 1, -1, -1)) for ids in lists]
+            merged = merge(*streams, reverse=True)
+        else:
+            streams = [map(ids.__getitem__, range(bisect_right(ids, since_id), len(ids))) for ids in lists]
+            merged = merge(*streams)
+        last = None
+        for event_id in merged:
+            if event_id != last:
+                yield event_id
+                last = event_id
+
+    @staticmethod
+    def _contains(lists, event_id):
+        for ids in lists:
+            i = bisect_left(ids, event_id)
+            if i < len(ids) and ids[i] == event_id:
+                return True
+        return False
+
+    def prune(self, now=None):
+        """删除最后写入时间早于保留期的段（当前段除外），返回删除的通知条数"""
+        cutoff = (now or time.time()) - self.retention_days * 86400
+        with self._lock:
+            dropped = 0
+            while len(self._segments) > 1:
+                path = self._segment_path(self._segments[0])
+                try:
+                    if os.path.getmtime(path) >= cutoff:
+                        break
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logger.error(f"删除通知日志段失败: {e}")
+                    break
+                self._segments.pop(0)
+                end = bisect_left(self._ids, self._segments[0])
+                dropped += end
+                last_id = self._segments[0] - 1
+                del self._ids[:end]
+                del self._offsets[:end]
+                for index in (self._by_type, self._by_recipient):
+                    for key in list(index):
+                        ids = index[key]
+                        del ids[:bisect_right(ids, last_id)]
+                        if not ids:
+                            del index[key]
+                for event_id in [i for i in self._cache if i <= last_id]:
+                    del self._cache[event_id]
+            return dropped
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
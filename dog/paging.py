@@ -0,0 +1,68 @@
+"""
+列表接口的分页与字段投影
+- limit: 每页条数
+- cursor: 游标分页，传空字符串表示第一页；响应中的 next_cursor 为 null 时表示没有更多数据
+- fields: 逗号分隔的字段名，只返回这些字段
+"""
+import base64
+import json
+from bisect import bisect_right
+
+
+def encode_cursor(state):
+    raw = json.dumps(state, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """空游标返回 None；格式错误时抛出 ValueError"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        state = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except Exception:
+        raise ValueError('无效的 cursor')
+    if not isinstance(state, dict):
+        raise ValueError('无效的 cursor')
+    return state
+
+
+def parse_fields(value):
+    """'id,title' -> ['id', 'title']，未指定时返回 None"""
+    if not value:
+        return None
+    return [f.strip() for f in value.split(',') if f.strip()]
+
+
+def project(item, fields, virtual=None):
+    """只保留 fields 中的字段；virtual 为 {字段名: 计算函数}，用于 comment_count 这类派生字段"""
+    if fields is None or not isinstance(item, dict):
+        return item
+    result = {}
+    for f in fields:
+        if f in item:
+            result[f] = item[f]
+        elif virtual and f in virtual:
+            result[f] = virtual[f](item)
+    return result
+
+
+class SortedPageIndex:
+    """
+    按排序键排好序的记录索引，游标即上一页最后一条的排序键，翻页为二分查找 O(log n)
+    即使游标对应的记录已被删除，也能从它之后继续
+    """
+    def __init__(self, entries):
+        # entries: [(sort_key, item)]
+        entries = sorted(entries, key=lambda e: e[0])
+        self.keys = [e[0] for e in entries]
+        self.items = [e[1] for e in entries]
+
+    def page(self, after_key, limit):
+        """返回 (items, 最后一条的排序键或 None)"""
+        start = 0 if after_key is None else bisect_right(self.keys, after_key)
+        end = min(start + limit, len(self.items))
+        items = self.items[start:end]
+        last_key = self.keys[end - 1] if end < len(self.items) and items else None
+        return items, last_key
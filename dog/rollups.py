@@ -0,0 +1,275 @@
+"""
+时间序列的分层保留
+原始记录只保留最近一段时间，更早的趋势保存在按分钟 / 按小时的汇总（rollup）中：
+- GPS：点数、质心（经纬度均值）、区间内的移动距离
+- 患者活动：各类型的数量
+上传时汇总到当前分钟桶，桶结束后写入分钟层，同时合并进当前小时桶；
+晚到的记录直接写一条部分汇总，查询时按桶起点合并。
+重启时未结束的桶从原始记录 / 分钟层重放恢复，不需要在退出时落盘
+"""
+import math
+import logging
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from threading import Lock
+
+from storage import parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+# (层名, 桶宽秒数)，从细到粗
+TIERS = (('minute', 60), ('hour', 3600))
+TIER_WIDTHS = dict(TIERS)
+EARTH_RADIUS_M = 6371008.8
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """两点间的球面距离（米）"""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+class GpsRollupKind:
+    """GPS 汇总：点数、经纬度之和、移动距离（米）"""
+    timestamp_key = 'server_received_time'
+
+    def __init__(self, max_gap=600):
+        # 相邻两点间隔超过 max_gap 秒时不计距离（例如中途关机或没有信号）
+        self.max_gap = max_gap
+        self._last = None  # (ts, lat, lon)
+
+    def from_record(self, record, ts):
+        try:
+            lat = float(record['lat'])
+            lon = float(record['lon'])
+        except (KeyError, TypeError, ValueError):
+            return None
+        distance = 0.0
+        last = self._last
+        if last is not None and 0 <= ts - last[0] <= self.max_gap:
+            distance = haversine_m(last[1], last[2], lat, lon)
+        if last is None or ts >= last[0]:
+            self._last = (ts, lat, lon)
+        return {'count': 1, 'lat_sum': lat, 'lon_sum': lon, 'distance_m': distance}
+
+    def merge(self, acc, other):
+        acc['count'] += other['count']
+        acc['lat_sum'] += other['lat_sum']
+        acc['lon_sum'] += other['lon_sum']
+        acc['distance_m'] += other['distance_m']
+        return acc
+
+    def to_row(self, start, acc):
+        n = acc['count']
+        return {
+            'start': datetime.fromtimestamp(start).isoformat(),
+            'count': n,
+            'lat': round(acc['lat_sum'] / n, 7),
+            'lon': round(acc['lon_sum'] / n, 7),
+            'distance_m': round(acc['distance_m'], 1),
+        }
+
+    def from_row(self, row):
+        n = row['count']
+        return {
+            'count': n,
+            'lat_sum': row['lat'] * n,
+            'lon_sum': row['lon'] * n,
+            'distance_m': row.get('distance_m', 0.0),
+        }
+
+
+class ActivityRollupKind:
+    """患者活动汇总：总数和各类型数量"""
+    timestamp_key = 'timestamp'
+
+    def from_record(self, record, ts):
+        atype = record.get('activity_type', 'other')
+        if not isinstance(atype, str):
+            return None
+        return {'count': 1, 'by_type': {atype: 1}}
+
+    def merge(self, acc, other):
+        acc['count'] += other['count']
+        by_type = acc['by_type']
+        for atype, n in other['by_type'].items():
+            by_type[atype] = by_type.get(atype, 0) + n
+        return acc
+
+    def to_row(self, start, acc):
+        return {
+            'start': datetime.fromtimestamp(start).isoformat(),
+            'count': acc['count'],
+            'by_type': dict(acc['by_type']),
+        }
+
+    def from_row(self, row):
+        return {'count': row['count'], 'by_type': dict(row.get('by_type') or {})}
+
+
+class Rollup:
+    """
+    一个时间序列的分钟 / 小时汇总
+    logs: {层名: 日志}（AppendLog 或 SqliteAppendLog，时间字段为 start）
+    retention_days: {层名: 保留天数}
+    内存中按桶起点有序保存各层的汇总行，查询为二分查找
+    """
+    def __init__(self, kind, logs, retention_days):
+        self.kind = kind
+        self.logs = logs
+        self.retention = {tier: days * 86400 for tier, days in retention_days.items()}
+        self._lock = Lock()
+        self._open = {}  # 层名 -> [桶起点, 累加值]
+        self._starts = {tier: [] for tier, _ in TIERS}
+        self._rows = {tier: [] for tier, _ in TIERS}
+        self._pending = {tier: [] for tier, _ in TIERS}
+        self._listeners = []
+
+    def subscribe(self, callback):
+        """callback(层名, 桶起点, 汇总行)，每写入一条汇总调用一次（包括 load 时读到的历史汇总）"""
+        self._listeners.append(callback)
+
+    def load(self, raw_records):
+        """
+        读取各层已有的汇总，并恢复重启前未结束的桶：
+        小时桶从最后一个小时汇总之后的分钟汇总重放，分钟桶从最后一个分钟汇总之后的原始记录重放。
+        第一次启用时各层为空，会用全部原始记录补齐
+        """
+        with self._lock:
+            for tier, _ in TIERS:
+                for row in self.logs[tier].iter_records():
+                    start = parse_timestamp(row.get('start')) if isinstance(row, dict) else None
+                    if start is not None:
+                        self._insert(tier, start, row)
+            (minute, minute_width), (hour, hour_width) = TIERS
+            hour_mark = self._starts[hour][-1] + hour_width if self._starts[hour] else None
+            for start, row in zip(self._starts[minute], self._rows[minute]):
+                if hour_mark is None or start >= hour_mark:
+                    self._feed(1, start, self.kind.from_row(row))
+            minute_mark = self._starts[minute][-1] + minute_width if self._starts[minute] else None
+            replay = []
+            for record in raw_records:
+                ts = parse_timestamp(record.get(self.kind.timestamp_key)) if isinstance(record, dict) else None
+                if ts is not None and (minute_mark is None or ts >= minute_mark):
+                    replay.append((ts, record))
+            replay.sort(key=lambda item: item[0])
+            for ts, record in replay:
+                acc = self.kind.from_record(record, ts)
+                if acc is not None:
+                    self._feed(0, ts, acc)
+            self._write_pending()
+
+    def add(self, records):
+        """汇总新上传的原始记录"""
+        with self._lock:
+            for record in records:
+                ts = parse_timestamp(record.get(self.kind.timestamp_key))
+                if ts is None:
+                    continue
+                acc = self.kind.from_record(record, ts)
+                if acc is not None:
+                    self._feed(0, ts, acc)
+            self._write_pending()
+
+    def _feed(self, level, ts, acc):
+        tier, width = TIERS[level]
+        start = ts - ts % width
+        current = self._open.get(tier)
+        if current is not None and current[0] == start:
+            self.kind.merge(current[1], acc)
+        elif current is None or start > current[0]:
+            if current is not None:
+                self._emit(level, current[0], current[1])
+            self._open[tier] = [start, acc]
+        else:
+            # 晚到的记录：所在的桶已经写出，单独写一条部分汇总
+            self._emit(level, start, acc)
+
+    def _emit(self, level, start, acc):
+        tier = TIERS[level][0]
+        row = self.kind.to_row(start, acc)
+        self._insert(tier, start, row)
+        self._pending[tier].append(row)
+        if level + 1 < len(TIERS):
+            self._feed(level + 1, start, acc)
+
+    def _insert(self, tier, start, row):
+        starts = self._starts[tier]
+        i = bisect_right(starts, start)
+        starts.insert(i, start)
+        self._rows[tier].insert(i, row)
+        for callback in self._listeners:
+            callback(tier, start, row)
+
+    def _write_pending(self):
+        for tier, rows in self._pending.items():
+            if not rows:
+                continue
+            try:
+                self.logs[tier].append_many(rows)
+            except Exception as e:
+                logger.error(f"写入 {tier} 汇总失败: {e}")
+            self._pending[tier] = []
+
+    def flush(self, now):
+        """写出已经结束的桶（没有新数据到达时由后台线程调用）"""
+        with self._lock:
+            for level, (tier, width) in enumerate(TIERS):
+                current = self._open.get(tier)
+                if current is not None and current[0] + width <= now:
+                    del self._open[tier]
+                    self._emit(level, current[0], current[1])
+            self._write_pending()
+
+    def prune(self, now):
+        """丢弃内存中超过保留期的汇总（磁盘上的由日志压缩清理）"""
+        with self._lock:
+            for tier, _ in TIERS:
+                i = bisect_left(self._starts[tier], now - self.retention[tier])
+                del self._starts[tier][:i]
+                del self._rows[tier][:i]
+
+    def choose_tier(self, start, end, now, raw_retention, max_points=2000, raw_max_span=6 * 3600):
+        """
+        按查询跨度选择数据层：短时间且仍在原始保留期内用 'raw'，
+        否则选保留期覆盖 start 且桶数不超过 max_points 的最细一层
+        """
+        if raw_retention is not None and start >= now - raw_retention and end - start <= raw_max_span:
+            return 'raw'
+        for tier, width in TIERS:
+            if start >= now - self.retention[tier] and (end - start) / width <= max_points:
+                return tier
+        return TIERS[-1][0]
+
+    def query(self, tier, start, end):
+        """返回 [start, end) 内的汇总行（含尚未结束的当前桶），同一个桶的多条部分汇总会合并"""
+        with self._lock:
+            starts = self._starts[tier]
+            i = bisect_left(starts, start)
+            j = bisect_left(starts, end)
+            pairs = list(zip(starts[i:j], self._rows[tier][i:j]))
+            current = self._open.get(tier)
+            if current is not None and start <= current[0] < end:
+                pairs.append((current[0], self.kind.to_row(current[0], current[1])))
+                pairs.sort(key=lambda pair: pair[0])
+        result = []
+        last_start = None
+        for s, row in pairs:
+            if s == last_start:
+                acc = self.kind.merge(self.kind.from_row(result[-1]), self.kind.from_row(row))
+                result[-1] = self.kind.to_row(s, acc)
+            else:
+                result.append(row)
+                last_start = s
+        return result
+
+    def compact(self):
+        for log in self.logs.values():
+            log.compact()
+
+    def close(self):
+        for log in self.logs.values():
+            log.close()
@@ -0,0 +1,355 @@
+"""
+SQLite 存储后端
+把 JSON 文档拆成按主键存储的记录行（手机号、face_id、photo_id、med_id、帖子 id 等），
+保存时只写入发生变化的记录，不再整文件重写；GPS/活动等时间序列存到带时间索引的 events 表。
+对上层仍然是整文档的 load/save 接口，HTTP API 不变。
+首次使用时从现有 JSON 文件一次性迁移，迁移后 JSON 文件不再被读取。
+"""
+import json
+import os
+import sqlite3
+import time
+import logging
+from threading import Lock
+
+from storage import COLLECTION_SPECS, cursor_offset, parse_timestamp, split_records
+
+logger = logging.getLogger(__name__)
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS documents (
+    name TEXT PRIMARY KEY,
+    shape TEXT NOT NULL,
+    meta TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS records (
+    collection TEXT NOT NULL,
+    key TEXT NOT NULL,
+    ts REAL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (collection, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_records_ts ON records (collection, ts);
+CREATE TABLE IF NOT EXISTS events (
+    log TEXT NOT NULL,
+    ts REAL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_events_ts ON events (log, ts);
+'''
+
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+
+def _record_ts(record, time_field):
+    if time_field and isinstance(record, dict):
+        return parse_timestamp(record.get(time_field))
+    return None
+
+
+def decompose(data, spec):
+    """文档 -> (shape, meta, {key: (ts, data_json)})"""
+    split = split_records(data, spec)
+    if split is None:
+        return 'document', {}, {'': (None, _dumps(data))}
+    records, extra = split
+    time_field = spec.time_field
+    rows = {str(k): (_record_ts(v, time_field), _dumps(v)) for k, v in records.items()}
+    if spec.shape == 'map':
+        return 'map', {'order': list(rows)}, rows
+    return 'list', {'order': list(rows), 'container': spec.container, 'extra': extra}, rows
+
+
+def compose(shape, meta, rows):
+    """decompose 的逆过程，rows 为 {key: data_json}"""
+    if shape == 'document':
+        return json.loads(rows[''])
+    if shape == 'map':
+        return {k: json.loads(rows[k]) for k in meta['order'] if k in rows}
+    values = [json.loads(rows[k]) for k in meta['order'] if k in rows]
+    if meta.get('container') is None:
+        return values
+    data = dict(meta.get('extra') or {})
+    data[meta['container']] = values
+    return data
+
+
+class SqliteBackend:
+    """
+    JsonDocumentStore 的 SQLite 后端（WAL 模式，单连接 + 互斥锁）
+    文档名为相对 root_dir 的路径，例如 dog/assets/face_info.json
+    """
+    name = 'sqlite'
+
+    def __init__(self, db_path, root_dir):
+        self.db_path = db_path
+        self.root_dir = root_dir
+        self._lock = Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+        self._data_version = None
+        self._known = set()
+        self._rows = {}  # name -> {key: data_json}，用于保存时比较差异
+        self._refresh()
+
+    def _name(self, path):
+        return os.path.relpath(path, self.root_dir).replace(os.sep, '/')
+
+    def _refresh(self):
+        """其他连接修改过数据库时丢弃内存中的行缓存"""
+        version = self._conn.execute('PRAGMA data_version').fetchone()[0]
+        if version != self._data_version:
+            self._data_version = version
+            self._known = {row[0] for row in self._conn.execute('SELECT name FROM documents')}
+            self._rows = {}
+
+    def migrate(self, paths):
+        """一次性把尚未入库的 JSON 文件导入数据库"""
+        for path in paths:
+            with self._lock:
+                if self._name(path) not in self._known and os.path.exists(path):
+                    self._import_file(path)
+
+    def _import_file(self, path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception as e:
+            logger.error(f"迁移 {path} 到 SQLite 失败: {e}")
+            return False
+        self._write_locked(path, data)
+        logger.info(f"已迁移 {self._name(path)} 到 SQLite")
+        return True
+
+    def signature(self, path):
+        with self._lock:
+            self._refresh()
+            name = self._name(path)
+            if name not in self._known:
+                # 未迁移的 JSON 文件在第一次访问时导入
+                if not os.path.exists(path) or not self._import_file(path):
+                    return None
+            return ('sqlite', self._data_version)
+
+    def read(self, path):
+        name = self._name(path)
+        with self._lock:
+            row = self._conn.execute('SELECT shape, meta FROM documents WHERE name = ?', (name,)).fetchone()
+            if row is None:
+                raise FileNotFoundError(name)
+            rows = dict(self._conn.execute('SELECT key, data FROM records WHERE collection = ?', (name,)))
+            self._rows[name] = rows
+        return compose(row[0], json.loads(row[1]), rows)
+
+    def write(self, path, data, indent=None):
+        with self._lock:
+            self._write_locked(path, data)
+
+    def _write_locked(self, path, data):
+        name = self._name(path)
+        shape, meta, rows = decompose(data, COLLECTION_SPECS.get(os.path.basename(path)))
+        old = self._rows.get(name)
+        if old is None:
+            old = dict(self._conn.execute('SELECT key, data FROM records WHERE collection = ?', (name,)))
+        changed = [(name, k, ts, text) for k, (ts, text) in rows.items() if old.get(k) != text]
+        removed = [(name, k) for k in old if k not in rows]
+        conn = self._conn
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany(
+                'INSERT INTO records (collection, key, ts, data) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (collection, key) DO UPDATE SET ts = excluded.ts, data = excluded.data',
+                changed,
+            )
+            conn.executemany('DELETE FROM records WHERE collection = ? AND key = ?', removed)
+            conn.execute(
+                'INSERT INTO documents (name, shape, meta, updated_at) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (name) DO UPDATE SET shape = excluded.shape, meta = excluded.meta, updated_at = excluded.updated_at',
+                (name, shape, _dumps(meta), time.time()),
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            self._rows.pop(name, None)
+            raise
+        self._rows[name] = {k: text for k, (_, text) in rows.items()}
+        self._known.add(name)
+
+    # ---------- 时间序列 ----------
+    def events_append(self, log, records, timestamp_key):
+        rows = [(log, _record_ts(r, timestamp_key), _dumps(r)) for r in records]
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._conn.executemany('INSERT INTO events (log, ts, data) VALUES (?, ?, ?)', rows)
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+
+    def events_tail(self, log, n):
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT data FROM events WHERE log = ? ORDER BY ts DESC, rowid DESC LIMIT ?', (log, n)
+            ).fetchall()
+        return [json.loads(r[0]) for r in reversed(rows)]
+
+    def events_page(self, log, before_rowid, limit):
+        """从新到旧分页，返回 [(rowid, record)]"""
+        with self._lock:
+            if before_rowid is None:
+                rows = self._conn.execute(
+                    'SELECT rowid, data FROM events WHERE log = ? ORDER BY rowid DESC LIMIT ?', (log, limit)
+                ).fetchall()
+            else:
+                rows = self._conn.execute(
+                    'SELECT rowid, data FROM events WHERE log = ? AND rowid < ? ORDER BY rowid DESC LIMIT ?',
+                    (log, before_rowid, limit),
+                ).fetchall()
+        return [(r[0], json.loads(r[1])) for r in rows]
+
+    def events_all(self, log):
+        with self._lock:
+            rows = self._conn.execute('SELECT data FROM events WHERE log = ? ORDER BY rowid', (log,)).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def events_count(self, log):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM events WHERE log = ?', (log,)).fetchone()[0]
+
+    def events_compact(self, log, cutoff, max_records):
+        with self._lock:
+            cur = self._conn.execute('DELETE FROM events WHERE log = ? AND ts < ?', (log, cutoff))
+            dropped = cur.rowcount
+            cur = self._conn.execute(
+                'DELETE FROM events WHERE log = ? AND rowid <= '
+                '(SELECT rowid FROM events WHERE log = ? ORDER BY rowid DESC LIMIT 1 OFFSET ?)',
+                (log, log, max_records),
+            )
+            return dropped + cur.rowcount
+
+    def events_reorder(self, log):
+        """把日志的行按 (ts, rowid) 重新插入，使 rowid 顺序与时间顺序一致；已有序时返回 False"""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT rowid, ts, data FROM events WHERE log = ? ORDER BY rowid', (log,)
+            ).fetchall()
+            keys = [(r[1] if r[1] is not None else float('-inf')) for r in rows]
+            if all(a <= b for a, b in zip(keys, keys[1:])):
+                return False
+            ordered = sorted(zip(keys, rows), key=lambda item: item[0])
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._conn.execute('DELETE FROM events WHERE log = ?', (log,))
+                self._conn.executemany(
+                    'INSERT INTO events (log, ts, data) VALUES (?, ?, ?)',
+                    [(log, r[1], r[2]) for _, r in ordered],
+                )
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+            return True
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class SqliteAppendLog:
+    """
+    与 storage.AppendLog 接口一致的时间序列日志，数据存放在 SQLite events 表
+    首次使用时从 JSONL（或更早的 JSON 数组）文件导入
+    """
+    def __init__(self, backend, name, locks, timestamp_key='timestamp', retention_days=30,
+                 max_records=200000, compact_every=1000, legacy_paths=()):
+        self.backend = backend
+        self.path = name
+        self.locks = locks
+        self.timestamp_key = timestamp_key
+        self.retention_days = retention_days
+        self.max_records = max_records
+        self.compact_every = compact_every
+        self._appended = 0
+        with self.locks.write(self.path):
+            if self.backend.events_count(name) == 0:
+                self._migrate(legacy_paths)
+        self.compact()
+
+    def _migrate(self, legacy_paths):
+        for path in legacy_paths:
+            if not os.path.exists(path):
+                continue
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    if path.endswith('.jsonl'):
+                        records = []
+                        for line in f:
+                            try:
+                                records.append(json.loads(line))
+                            except ValueError:
+                                continue
+                    else:
+                        records = json.load(f)
+            except Exception as e:
+                logger.error(f"迁移 {path} 到 SQLite 失败: {e}")
+                continue
+            if isinstance(records, list):
+                self.backend.events_append(self.path, records, self.timestamp_key)
+                logger.info(f"已将 {path} 迁移到 SQLite（{len(records)} 条）")
+            return
+
+    def append(self, record):
+        self.append_many([record])
+
+    def append_many(self, records):
+        if not records:
+            return
+        with self.locks.write(self.path):
+            self.backend.events_append(self.path, records, self.timestamp_key)
+            self._appended += len(records)
+            need_compact = self._appended >= self.compact_every
+        if need_compact:
+            self.compact()
+
+    def tail(self, n):
+        if n <= 0:
+            return []
+        with self.locks.read(self.path):
+            return self.backend.events_tail(self.path, n)
+
+    def page_before(self, cursor, limit):
+        """与 AppendLog.page_before 相同的分页接口，游标为 rowid"""
+        before = cursor_offset(cursor, 'r') if cursor else None
+        with self.locks.read(self.path):
+            rows = self.backend.events_page(self.path, before, limit + 1)
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if not has_more or not rows:
+            return [r[1] for r in rows], None
+        return [r[1] for r in rows], {'r': rows[-1][0]}
+
+    def iter_records(self):
+        with self.locks.read(self.path):
+            return self.backend.events_all(self.path)
+
+    def compact(self):
+        cutoff = time.time() - self.retention_days * 86400
+        with self.locks.write(self.path):
+            self._appended = 0
+            dropped = self.backend.events_compact(self.path, cutoff, self.max_records)
+            # 离线补传的记录按 rowid 追加在末尾，压缩时按时间重排，分页（按 rowid）也按时间有序
+            self.backend.events_reorder(self.path)
+        if dropped:
+            logger.info(f"压缩 {self.path}: 丢弃 {dropped} 条")
+
+    def close(self):
+        pass
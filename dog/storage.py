@@ -0,0 +1,837 @@
+"""
+JSON 文档存储层
+为 DogServer 的 load/save 辅助方法提供内存缓存，避免每次读请求都重新读盘和解析 JSON；
+并按文件分配读写锁，不同集合的读写互不阻塞；写盘采用临时文件 + 原子替换，可选延迟合并写。
+GPS、活动记录等时间序列使用只追加的 JSONL 日志（AppendLog）
+"""
+import json
+import os
+import time
+import logging
+import threading
+import uuid
+from datetime import datetime
+from collections import deque
+from contextlib import contextmanager
+from threading import Lock, Condition
+
+logger = logging.getLogger(__name__)
+
+
+def clone_json(value):
+    """复制 JSON 结构（只复制 dict/list，标量本身不可变），比 copy.deepcopy 快得多"""
+    if isinstance(value, dict):
+        return {k: clone_json(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [clone_json(v) for v in value]
+    return value
+
+
+def file_signature(path):
+    """返回文件的 (inode, mtime_ns, size) 签名，文件不存在时返回 None"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+class CollectionSpec:
+    """
+    描述一个 JSON 文档如何拆分成记录
+    - shape='map': 文档本身是 {key: record}
+    - shape='list': 记录列表位于 container 字段（container 为空表示文档本身就是列表），
+      key 为记录中的主键字段（为空时按位置编号）
+    - time_field: 记录中的时间字段，写入 ts 列并建立索引
+    """
+    def __init__(self, shape, container=None, key=None, time_field=None):
+        self.shape = shape
+        self.container = container
+        self.key = key
+        self.time_field = time_field
+
+
+# 按文件名匹配；未列出的文件整体作为一条记录保存
+COLLECTION_SPECS = {
+    'users.json': CollectionSpec('list', container='users', key='phone', time_field='created_at'),
+    'face_info.json': CollectionSpec('map', time_field='update_time'),
+    'photo_info.json': CollectionSpec('map', time_field='update_time'),
+    'qr_code_info.json': CollectionSpec('map', time_field='update_time'),
+    'geofences.json': CollectionSpec('map', time_field='update_time'),
+    'reminders.json': CollectionSpec('list', container='reminders', key='id'),
+    'community.json': CollectionSpec('list', container='posts', key='id', time_field='timestamp'),
+    'family_info.json': CollectionSpec('list', container='questions', time_field='update_time'),
+    'uploads.json': CollectionSpec('list', key='filename', time_field='upload_time'),
+}
+
+def split_records(data, spec):
+    """
+    按 spec 把文档拆成 ({key: record}, extra)，extra 为列表容器之外的其他字段；
+    列表中缺少主键或主键重复的记录用 '#<位置>' 作为 key。文档结构与 spec 不符时返回 None
+    """
+    if spec is None:
+        return None
+    if spec.shape == 'map':
+        return (data, None) if isinstance(data, dict) else None
+    if spec.container is None and isinstance(data, list):
+        items, extra = data, None
+    elif spec.container is not None and isinstance(data, dict) and isinstance(data.get(spec.container), list):
+        items = data[spec.container]
+        extra = {k: v for k, v in data.items() if k != spec.container}
+    else:
+        return None
+    records = {}
+    for pos, item in enumerate(items):
+        key = item.get(spec.key) if spec.key and isinstance(item, dict) else None
+        if key is None or key in records:
+            key = f'#{pos}'
+        records[key] = item
+    return records, extra
+
+
+_MISSING = object()
+
+
+def diff_records(old, new, spec):
+    """比较两个版本的文档，返回 [(op, key, record)]，op 为 upsert/delete；extra 字段变化用 key '_meta' 表示"""
+    new_split = split_records(new, spec)
+    if new_split is None:
+        return []
+    old_split = split_records(old, spec) if old is not None else None
+    old_records, old_extra = old_split if old_split is not None else ({}, None)
+    new_records, new_extra = new_split
+    changes = [('upsert', k, v) for k, v in new_records.items() if old_records.get(k, _MISSING) != v]
+    changes.extend(('delete', k, None) for k in old_records if k not in new_records)
+    if new_extra != old_extra:
+        changes.append(('upsert', '_meta', new_extra))
+    return changes
+
+
+class ChangeLog:
+    """
+    记录文档中记录级别的增删改，用于增量同步
+    每条记录为 (seq, name, op, key, record)，seq 与 JsonDocumentStore 的版本号共用同一计数器
+    """
+    def __init__(self, maxlen=10000):
+        self._entries = deque()
+        self._maxlen = maxlen
+        self._lock = Lock()
+        self.floor = 0  # 已被淘汰的最大 seq，since 小于它时无法增量同步
+
+    def record(self, seq, name, changes):
+        with self._lock:
+            for op, key, value in changes:
+                self._entries.append((seq, name, op, key, value))
+            while len(self._entries) > self._maxlen:
+                self.floor = self._entries.popleft()[0]
+
+    def since(self, seq):
+        """返回 seq 之后的变化（同一条记录只保留最新一次），无法增量时返回 None"""
+        with self._lock:
+            if seq < self.floor:
+                return None
+            latest = {}
+            for entry in reversed(self._entries):
+                if entry[0] <= seq:
+                    break
+                latest.setdefault((entry[1], entry[3]), entry)
+        return sorted(latest.values(), key=lambda e: e[0])
+
+
+class ReadWriteLock:
+    """读写锁：读者共享、写者独占；有写者等待时新读者让行，避免写者饿死"""
+    def __init__(self):
+        self._cond = Condition(Lock())
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    def acquire_read(self):
+        with self._cond:
+            while self._writer or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if self._readers == 0:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        with self._cond:
+            self._waiting_writers += 1
+            try:
+                while self._writer or self._readers:
+                    self._cond.wait()
+            finally:
+                self._waiting_writers -= 1
+            self._writer = True
+
+    def release_write(self):
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+
+class _LockStats:
+    """单个锁的等待/持有耗时统计（秒）"""
+    def __init__(self):
+        self.counts = {'read': 0, 'write': 0}
+        self.wait_total = {'read': 0.0, 'write': 0.0}
+        self.wait_max = {'read': 0.0, 'write': 0.0}
+        self.hold_total = {'read': 0.0, 'write': 0.0}
+        self.hold_max = {'read': 0.0, 'write': 0.0}
+
+    def record(self, mode, waited, held):
+        self.counts[mode] += 1
+        self.wait_total[mode] += waited
+        self.hold_total[mode] += held
+        if waited > self.wait_max[mode]:
+            self.wait_max[mode] = waited
+        if held > self.hold_max[mode]:
+            self.hold_max[mode] = held
+
+    def to_dict(self):
+        result = {}
+        for mode in ('read', 'write'):
+            n = self.counts[mode]
+            result[mode] = {
+                'count': n,
+                'wait_avg_ms': round(self.wait_total[mode] / n * 1000, 3) if n else 0,
+                'wait_max_ms': round(self.wait_max[mode] * 1000, 3),
+                'hold_avg_ms': round(self.hold_total[mode] / n * 1000, 3) if n else 0,
+                'hold_max_ms': round(self.hold_max[mode] * 1000, 3),
+            }
+        return result
+
+
+class LockManager:
+    """
+    按文件（或任意 key）分配读写锁
+    不同集合互不阻塞，同一集合读者共享、写者独占，并记录等待与持有时间
+    """
+    def __init__(self):
+        self._locks = {}
+        self._stats = {}
+        self._guard = Lock()
+
+    def _get(self, key):
+        with self._guard:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = self._locks[key] = ReadWriteLock()
+                self._stats[key] = _LockStats()
+            return lock, self._stats[key]
+
+    @contextmanager
+    def read(self, key):
+        lock, stats = self._get(key)
+        start = time.perf_counter()
+        lock.acquire_read()
+        acquired = time.perf_counter()
+        try:
+            yield
+        finally:
+            lock.release_read()
+            released = time.perf_counter()
+            with self._guard:
+                stats.record('read', acquired - start, released - acquired)
+
+    @contextmanager
+    def write(self, key):
+        lock, stats = self._get(key)
+        start = time.perf_counter()
+        lock.acquire_write()
+        acquired = time.perf_counter()
+        try:
+            yield
+        finally:
+            lock.release_write()
+            released = time.perf_counter()
+            with self._guard:
+                stats.record('write', acquired - start, released - acquired)
+
+    def stats(self):
+        with self._guard:
+            return {key: stats.to_dict() for key, stats in self._stats.items()}
+
+
+class DocumentCache:
+    """
+    已解析 JSON 文档的内存缓存（按文件绝对路径索引）
+    通过文件签名判断缓存是否有效，手工修改磁盘文件后会自动失效
+    """
+    def __init__(self):
+        self._entries = {}  # path -> (signature, data)
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path, signature):
+        """签名一致时返回缓存的文档，否则返回 None"""
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == signature:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def peek(self, path):
+        """不校验签名，返回当前缓存的文档（可能已过期）"""
+        with self._lock:
+            entry = self._entries.get(path)
+            return entry[1] if entry is not None else None
+
+    def put(self, path, signature, data):
+        with self._lock:
+            self._entries[path] = (signature, data)
+
+    def invalidate(self, path=None):
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(path, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+def atomic_write_text(path, text):
+    """先写同目录临时文件并 fsync，再原子替换目标文件；崩溃时目标文件要么是旧内容要么是新内容"""
+    directory = os.path.dirname(path) or '.'
+    tmp_path = os.path.join(directory, f".{os.path.basename(path)}.{os.getpid()}.tmp")
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except Exception:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    # 同步目录项，保证 rename 本身落盘（Windows 不支持打开目录，忽略即可）
+    try:
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    except OSError:
+        pass
+
+
+class JsonFileBackend:
+    """默认存储后端：每个文档对应一个 JSON 文件"""
+    name = 'json'
+
+    def signature(self, path):
+        return file_signature(path)
+
+    def read(self, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def write(self, path, data, indent):
+        atomic_write_text(path, json.dumps(data, ensure_ascii=False, indent=indent))
+
+    def close(self):
+        pass
+
+
+class JsonDocumentStore:
+    """
+    带缓存的 JSON 文件读写
+    - load: 命中缓存时不读盘、不解析；默认返回副本，调用方可以随意修改
+    - save: 直接把 data 放入缓存（写穿），保存后调用方不应再修改 data
+    - 落盘：write_delay > 0 时延迟写（write-behind），窗口内对同一文件的多次保存合并为一次写盘；
+      每次写盘都是临时文件 + 原子替换。退出前需调用 close()/flush() 把未落盘的数据写完
+    - 版本：每个文档带一个单调递增的版本号，保存或检测到磁盘被外部修改时递增；
+      epoch 在每次启动时随机生成，与版本号一起组成 ETag，避免重启后版本号重复
+    - 变更日志：通过 track_changes 登记的文档，每次版本变化都把记录级别的增删改写入 changes
+    """
+    def __init__(self, locks=None, write_delay=0.0, backend=None):
+        self.locks = locks or LockManager()
+        self.backend = backend or JsonFileBackend()
+        self.cache = DocumentCache()
+        self.write_delay = write_delay
+        self._pending = {}  # path -> (data, indent, deadline)
+        self._pending_cond = Condition(Lock())
+        self._flush_lock = Lock()
+        self._flusher = None
+        self._closed = False
+        self.saves = 0
+        self.disk_writes = 0
+        self.epoch = uuid.uuid4().hex[:8]
+        self._seq = 0
+        self._versions = {}  # path -> version
+        self.changes = ChangeLog()
+        self._tracked = {}  # path -> 集合名
+
+    def track_changes(self, path, name):
+        """登记需要记录变更日志的文档"""
+        self._tracked[path] = name
+
+    @property
+    def version(self):
+        """当前最新的全局版本号"""
+        with self._pending_cond:
+            return self._seq
+
+    def _bump_version(self, path, old=None, new=None):
+        with self._pending_cond:
+            self._seq += 1
+            self._versions[path] = self._seq
+            seq = self._seq
+        name = self._tracked.get(path)
+        if name is not None and new is not None:
+            spec = COLLECTION_SPECS.get(os.path.basename(path))
+            self.changes.record(seq, name, diff_records(old, new, spec))
+        return seq
+
+    def _current(self, path):
+        """读取当前文档（共享对象）；调用方需已持有该文档的读锁或写锁"""
+        with self._pending_cond:
+            pending = self._pending.get(path)
+        if pending is not None:
+            # 尚未落盘的新数据优先于磁盘内容
+            return pending[0]
+        signature = self.backend.signature(path)
+        if signature is None:
+            return None
+        data = self.cache.get(path, signature)
+        if data is None:
+            # 首次加载或文件被外部修改
+            previous = self.cache.peek(path)
+            data = self.backend.read(path)
+            self.cache.put(path, signature, data)
+            self._bump_version(path, previous, data if previous is not None else None)
+        return data
+
+    def _load_shared(self, path):
+        """返回 (共享的文档对象, 版本号)，文档不存在时返回 (None, 0)"""
+        with self.locks.read(path):
+            data = self._current(path)
+            if data is None:
+                return None, 0
+            with self._pending_cond:
+                return data, self._versions.get(path, 0)
+
+    def load(self, path, copy=True):
+        """加载文档，文件不存在时返回 None；copy=False 返回只读的共享对象"""
+        data, _ = self._load_shared(path)
+        if data is None:
+            return None
+        return clone_json(data) if copy else data
+
+    def load_versioned(self, path):
+        """返回 (只读的共享文档对象, 版本号)"""
+        return self._load_shared(path)
+
+    def save(self, path, data, indent=4):
+        """保存文档；延迟写模式下只登记待写，实际写盘由后台线程完成"""
+        with self.locks.write(path):
+            self._save_locked(path, data, indent)
+
+    def _save_locked(self, path, data, indent):
+        """调用方已持有 path 的写锁"""
+        old = self._current(path) if path in self._tracked else None
+        if self.write_delay <= 0 or self._closed:
+            self.saves += 1
+            self._write(path, data, indent)
+            self._bump_version(path, old, data)
+            return
+
+        self._bump_version(path, old, data)
+        with self._pending_cond:
+            self.saves += 1
+            previous = self._pending.get(path)
+            # 截止时间以本轮第一次修改为准，连续修改不会无限推迟落盘
+            deadline = previous[2] if previous else time.monotonic() + self.write_delay
+            self._pending[path] = (data, indent, deadline)
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name='json-store-flusher', daemon=True)
+                self._flusher.start()
+            self._pending_cond.notify()
+
+    @contextmanager
+    def transaction(self, paths):
+        """
+        对多个文档做一次性修改：按固定顺序一次拿齐所有写锁，
+        块内通过 txn.load/txn.save 读写，正常退出时每个被修改的文档只保存一次；
+        块内抛出异常则什么都不保存
+        """
+        paths = sorted(set(paths))
+        acquired = []
+        try:
+            for path in paths:
+                cm = self.locks.write(path)
+                cm.__enter__()
+                acquired.append(cm)
+            txn = _Transaction(self, paths)
+            yield txn
+            for path, (data, indent) in txn.dirty.items():
+                self._save_locked(path, data, indent)
+        finally:
+            for cm in reversed(acquired):
+                cm.__exit__(None, None, None)
+
+    def _write(self, path, data, indent):
+        try:
+            self.backend.write(path, data, indent)
+        except Exception:
+            self.cache.invalidate(path)
+            raise
+        self.disk_writes += 1
+        self.cache.put(path, self.backend.signature(path), data)
+
+    def flush(self, path=None):
+        """立即把待写数据落盘（path 为空时全部落盘），返回是否全部成功"""
+        with self._pending_cond:
+            paths = [path] if path is not None else list(self._pending)
+        ok = True
+        for p in paths:
+            ok = self._flush_one(p) and ok
+        return ok
+
+    def _flush_one(self, path):
+        with self._flush_lock:
+            with self.locks.write(path):
+                with self._pending_cond:
+                    item = self._pending.get(path)
+                if item is None:
+                    return True
+                data, indent, _ = item
+                try:
+                    self._write(path, data, indent)
+                except Exception as e:
+                    logger.error(f"写入 {path} 失败，稍后重试: {e}")
+                    with self._pending_cond:
+                        if self._pending.get(path) is item:
+                            self._pending[path] = (data, indent, time.monotonic() + max(self.write_delay, 1.0))
+                    return False
+                with self._pending_cond:
+                    if self._pending.get(path) is item:
+                        del self._pending[path]
+                return True
+
+    def _flush_loop(self):
+        while True:
+            with self._pending_cond:
+                while not self._closed:
+                    now = time.monotonic()
+                    due = [p for p, item in self._pending.items() if item[2] <= now]
+                    if due:
+                        break
+                    timeout = min((item[2] for item in self._pending.values()), default=None)
+                    self._pending_cond.wait(None if timeout is None else timeout - now)
+                if self._closed:
+                    return
+            for p in due:
+                self._flush_one(p)
+
+    def close(self):
+        """停止后台写线程并把剩余数据全部落盘"""
+        with self._pending_cond:
+            self._closed = True
+            self._pending_cond.notify_all()
+        if self._flusher is not None:
+            self._flusher.join(timeout=5)
+        ok = self.flush()
+        self.backend.close()
+        return ok
+
+    def stats(self):
+        with self._pending_cond:
+            pending = len(self._pending)
+        return {
+            'cache': self.cache.stats(),
+            'saves': self.saves,
+            'disk_writes': self.disk_writes,
+            'pending_writes': pending,
+            'write_delay': self.write_delay,
+            'backend': self.backend.name,
+        }
+
+
+class _Transaction:
+    """JsonDocumentStore.transaction 块内使用的读写句柄"""
+    def __init__(self, store, paths):
+        self._store = store
+        self._paths = set(paths)
+        self._docs = {}
+        self.dirty = {}  # path -> (data, indent)
+
+    def load(self, path):
+        """返回可修改的副本（同一事务内多次 load 得到同一对象），文档不存在时返回 None"""
+        if path not in self._paths:
+            raise KeyError(f"{path} 不在本次事务范围内")
+        if path not in self._docs:
+            data = self._store._current(path)
+            self._docs[path] = clone_json(data) if data is not None else None
+        return self._docs[path]
+
+    def save(self, path, data, indent=4):
+        if path not in self._paths:
+            raise KeyError(f"{path} 不在本次事务范围内")
+        self._docs[path] = data
+        self.dirty[path] = (data, indent)
+
+
+def cursor_offset(cursor, key):
+    """游标中的偏移 / 行号，必须是非负整数，否则抛出 ValueError"""
+    value = cursor.get(key)
+    if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+        raise ValueError('无效的 cursor')
+    return value
+
+
+def parse_timestamp(value):
+    """ISO8601 字符串转为 epoch 秒（无时区按本地时间），无法解析时返回 None"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+class AppendLog:
+    """
+    只追加的 JSONL 时间序列日志（每行一条记录）
+    - append: O(1)，只在文件末尾追加一行，不重写整个文件
+    - tail: 从文件末尾倒着读取最近 n 条，不解析更早的记录；返回前按时间字段排序
+    - compact: 每追加 compact_every 条做一次压缩，按 retention_days 丢弃过期记录，
+      晚到（早于之前记录）的行按时间字段重排（稳定排序），有变化时原子替换
+    首次打开时若 jsonl 不存在而旧的 JSON 数组文件存在，会自动迁移
+    """
+    def __init__(self, path, locks, timestamp_key='timestamp', retention_days=30,
+                 max_records=200000, compact_every=1000, legacy_path=None):
+        self.path = path
+        self.locks = locks
+        self.timestamp_key = timestamp_key
+        self.retention_days = retention_days
+        self.max_records = max_records
+        self.compact_every = compact_every
+        self._file = None
+        self._appended = 0
+        with self.locks.write(self.path):
+            if not os.path.exists(self.path) and legacy_path and os.path.exists(legacy_path):
+                self._migrate(legacy_path)
+            self._repair_tail()
+        self.compact()
+
+    def _migrate(self, legacy_path):
+        try:
+            with open(legacy_path, 'r', encoding='utf-8') as f:
+                records = json.load(f)
+        except Exception as e:
+            logger.error(f"迁移 {legacy_path} 失败: {e}")
+            return
+        if not isinstance(records, list):
+            return
+        atomic_write_text(self.path, ''.join(self._dumps(r) for r in records))
+        logger.info(f"已将 {legacy_path} 迁移为 {self.path}（{len(records)} 条）")
+
+    def _repair_tail(self):
+        """崩溃可能留下半行，截断到最后一个换行符"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb+') as f:
+            size = f.seek(0, os.SEEK_END)
+            if size == 0:
+                return
+            f.seek(size - 1)
+            if f.read(1) == b'\n':
+                return
+            pos = size
+            while pos > 0:
+                step = min(4096, pos)
+                pos -= step
+                f.seek(pos)
+                idx = f.read(step).rfind(b'\n')
+                if idx >= 0:
+                    f.truncate(pos + idx + 1)
+                    return
+            f.truncate(0)
+
+    @staticmethod
+    def _dumps(record):
+        return json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n'
+
+    def _handle(self):
+        if self._file is None:
+            self._file = open(self.path, 'a', encoding='utf-8')
+        return self._file
+
+    def append(self, record):
+        self.append_many([record])
+
+    def append_many(self, records):
+        """追加多条记录，只做一次写入"""
+        if not records:
+            return
+        text = ''.join(self._dumps(r) for r in records)
+        with self.locks.write(self.path):
+            f = self._handle()
+            f.write(text)
+            f.flush()
+            self._appended += len(records)
+            need_compact = self._appended >= self.compact_every
+        if need_compact:
+            self.compact()
+
+    def _read_lines_reversed(self, end=None):
+        """从 end 偏移（默认文件末尾）往前按行倒序读取，产出 (行起始偏移, bytes)"""
+        with open(self.path, 'rb') as f:
+            size = f.seek(0, os.SEEK_END)
+            pos = size if end is None else min(end, size)
+            rest = b''
+            while pos > 0:
+                step = min(65536, pos)
+                pos -= step
+                f.seek(pos)
+                parts = (f.read(step) + rest).split(b'\n')
+                offsets = [pos]
+                for part in parts[:-1]:
+                    offsets.append(offsets[-1] + len(part) + 1)
+                rest = parts[0]
+                for i in range(len(parts) - 1, 0, -1):
+                    if parts[i]:
+                        yield offsets[i], parts[i]
+            if rest:
+                yield 0, rest
+
+    def tail(self, n):
+        """返回最近 n 条记录（按时间先后顺序）"""
+        if n <= 0:
+            return []
+        result = []
+        with self.locks.read(self.path):
+            if not os.path.exists(self.path):
+                return []
+            for _, line in self._read_lines_reversed():
+                try:
+                    result.append(json.loads(line))
+                except ValueError:
+                    continue
+                if len(result) >= n:
+                    break
+        result.reverse()
+        # 离线补传的记录追加在末尾，按时间排序后返回（同一时间保持写入顺序）
+        result.sort(key=self._sort_key)
+        return result
+
+    def _sort_key(self, record):
+        ts = parse_timestamp(record.get(self.timestamp_key)) if isinstance(record, dict) else None
+        return ts if ts is not None else float('-inf')
+
+    def page_before(self, cursor, limit):
+        """
+        从新到旧分页读取：cursor 为上一页返回的游标状态（None 表示从最新开始），
+        返回 (记录列表（新->旧）, 下一页游标状态或 None)。
+        游标记录文件 inode 与字节偏移；压缩后 inode 变化，退回按时间戳跳过已读记录
+        """
+        result = []
+        with self.locks.read(self.path):
+            if not os.path.exists(self.path):
+                return [], None
+            generation = os.stat(self.path).st_ino
+            end = None
+            skip_from = None
+            if cursor:
+                if cursor.get('g') == generation:
+                    end = cursor_offset(cursor, 'o')
+                else:
+                    skip_from = parse_timestamp(cursor.get('t'))
+            last_offset = None
+            has_more = False
+            for offset, line in self._read_lines_reversed(end):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if skip_from is not None:
+                    ts = parse_timestamp(record.get(self.timestamp_key)) if isinstance(record, dict) else None
+                    if ts is None or ts >= skip_from:
+                        continue
+                if len(result) >= limit:
+                    has_more = True
+                    break
+                result.append(record)
+                last_offset = offset
+        if not has_more or not result:
+            return result, None
+        last = result[-1]
+        return result, {
+            'g': generation,
+            'o': last_offset,
+            't': last.get(self.timestamp_key) if isinstance(last, dict) else None,
+        }
+
+    def iter_records(self):
+        """按写入顺序逐行解析全部记录（持有读锁期间一次读完，避免长时间占用锁）"""
+        with self.locks.read(self.path):
+            if not os.path.exists(self.path):
+                return []
+            records = []
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        continue
+            return records
+
+    def compact(self):
+        """丢弃超过保留期的记录，限制总条数，并把晚到的记录按时间重排"""
+        cutoff = time.time() - self.retention_days * 86400
+        with self.locks.write(self.path):
+            self._appended = 0
+            if not os.path.exists(self.path):
+                return
+            kept = []
+            dropped = 0
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        dropped += 1
+                        continue
+                    ts = parse_timestamp(record.get(self.timestamp_key)) if isinstance(record, dict) else None
+                    if ts is not None and ts < cutoff:
+                        dropped += 1
+                        continue
+                    kept.append((ts if ts is not None else float('-inf'), line if line.endswith('\n') else line + '\n'))
+            ordered = all(a[0] <= b[0] for a, b in zip(kept, kept[1:]))
+            if not ordered:
+                kept.sort(key=lambda entry: entry[0])
+            if len(kept) > self.max_records:
+                dropped += len(kept) - self.max_records
+                kept = kept[-self.max_records:]
+            if not dropped and ordered:
+                return
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            atomic_write_text(self.path, ''.join(line for _, line in kept))
+            logger.info(f"压缩 {os.path.basename(self.path)}: 丢弃 {dropped} 条，保留 {len(kept)} 条")
+
+    def close(self):
+        with self.locks.write(self.path):
+            if self._file is not None:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._file.close()
+                self._file = None
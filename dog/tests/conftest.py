@@ -0,0 +1,15 @@
+import pytest
+
+from dog_server import DogServer
+
+
+@pytest.fixture
+def server(tmp_path):
+    dog_server = DogServer(root_dir=str(tmp_path))
+    yield dog_server
+    dog_server.shutdown()
+
+
+@pytest.fixture
+def client(server):
+    return server.app.test_client()
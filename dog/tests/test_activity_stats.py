@@ -0,0 +1,57 @@
+import time
+from datetime import datetime
+
+from activity_stats import ActivityAggregator
+
+
+def _iso(ts):
+    return datetime.fromtimestamp(ts).isoformat()
+
+
+def test_windows_count_and_expire():
+    now = time.time()
+    stats = ActivityAggregator()
+    stats.add({'activity_type': 'meal', 'timestamp': _iso(now - 60)}, now)
+    stats.add({'activity_type': 'rest', 'timestamp': _iso(now - 7200)}, now)
+    stats.add({'activity_type': 'rest', 'timestamp': _iso(now - 3 * 86400)}, now)
+
+    snapshot = stats.snapshot()
+    assert snapshot['hour'] == {'count': 1, 'by_type': {'meal': 1}}
+    assert snapshot['day']['by_type'] == {'meal': 1, 'rest': 1}
+    assert sum(snapshot['day']['hourly']) == 2
+    assert snapshot['week']['count'] == 3
+
+
+def test_load_skips_malformed_rows():
+    now = time.time()
+    stats = ActivityAggregator()
+    stats.load([
+        {'activity_type': ['x'], 'timestamp': _iso(now)},
+        {'activity_type': None, 'timestamp': _iso(now)},
+        {'activity_type': 'meal', 'timestamp': _iso(now)},
+        {'activity_type': 'meal', 'timestamp': 'not a time'},
+        {'activity_type': 'meal', 'timestamp': 1e20},
+        'not a dict',
+    ])
+
+    day = stats.snapshot()['day']
+    assert day['count'] == 1
+    assert day['by_type'] == {'meal': 1}
+
+
+def test_upload_rejects_non_string_type_before_saving(server, client):
+    response = client.post('/upload_activity', json={'activity_type': ['x']})
+
+    assert response.status_code == 400
+    assert server.activity_log.tail(10) == []
+    assert client.get('/get_activity_stats').get_json()['day'] == {
+        'count': 0, 'by_type': {}, 'hourly': [0] * 24,
+    }
+
+
+def test_upload_counts_activity(client):
+    assert client.post('/upload_activity', json={'activity_type': 'meal'}).status_code == 200
+    assert client.post('/upload_activity', json={'activity_type': None}).status_code == 200
+
+    day = client.get('/get_activity_stats').get_json()['day']
+    assert day['by_type'] == {'meal': 1, 'other': 1}
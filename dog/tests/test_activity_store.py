@@ -0,0 +1,76 @@
+import threading
+
+from activity_store import ActivityStore, _Interner
+
+BASE = 1_700_000_000.0
+
+
+def _activity(offset, atype='meal', description=''):
+    return {'timestamp': BASE + offset, 'activity_type': atype, 'description': description}
+
+
+def test_out_of_order_rows_are_inserted_in_time_order():
+    store = ActivityStore(capacity=2)
+    store.extend([_activity(10), _activity(30)])
+    store.add(_activity(20, 'rest'))
+    store.add(_activity(40))
+
+    ts, codes, _ = store._slice(BASE, BASE + 100)
+    assert list(ts - BASE) == [10, 20, 30, 40]
+    assert [store.type_names.values[c] for c in codes] == ['meal', 'rest', 'meal', 'meal']
+
+
+def test_histogram_buckets_and_type_filter():
+    store = ActivityStore()
+    store.extend([_activity(0), _activity(5, 'rest'), _activity(65), _activity(130, 'rest')])
+
+    result = store.histogram(BASE, BASE + 180, bucket=60.0)
+    assert result['total'] == 4
+    assert result['by_type'] == {'meal': 2, 'rest': 2}
+    assert [b['count'] for b in result['buckets']] == [2, 1, 1]
+
+    rest = store.histogram(BASE, BASE + 180, bucket=60.0, types=['rest'])
+    assert [b['count'] for b in rest['buckets']] == [1, 0, 1]
+
+
+def test_malformed_rows_are_skipped():
+    store = ActivityStore()
+    store.extend([
+        _activity(0, ['x']),
+        _activity(1, None),
+        _activity(2, description=['not', 'a', 'string']),
+        {'timestamp': 'garbage', 'activity_type': 'meal'},
+    ])
+
+    assert len(store) == 1
+    assert store.histogram(BASE, BASE + 10, bucket=10.0)['by_type'] == {'meal': 1}
+
+
+def test_activity_range_route(client):
+    for atype in ('meal', 'meal', 'rest'):
+        client.post('/upload_activity', json={'activity_type': atype, 'description': ['x']})
+
+    result = client.get('/get_activity_range?bucket=hour').get_json()
+    assert result['tier'] == 'raw'
+    assert result['by_type'] == {'meal': 2, 'rest': 1}
+    assert client.get('/get_activity_range?bucket=-1').status_code == 400
+
+
+def test_interner_codes_are_unique_across_threads():
+    interner = _Interner()
+    barrier = threading.Barrier(8)
+    results = []
+
+    def worker(n):
+        barrier.wait()
+        results.append([(value, interner.code(value)) for value in (f't{i}' for i in range(n, 2000, 3))])
+
+    threads = [threading.Thread(target=worker, args=(i % 3,)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(interner.values) == len(set(interner.values)) == 2000
+    for pairs in results:
+        assert all(interner.values[code] == value for value, code in pairs)
@@ -0,0 +1,50 @@
+import threading
+
+
+def test_atomic_batch_rolls_back_on_failure(client):
+    response = client.post('/batch', json={'ops': [
+        {'op': 'update_photo_info', 'data': {'photo_id': 'photo_1'}},
+        {'op': 'delete_face_info', 'data': {'face_id': 'face_missing'}},
+    ]})
+
+    assert response.status_code == 400
+    assert response.get_json()['applied'] is False
+    assert client.get('/get_photo_info').get_json() == {}
+
+
+def test_non_atomic_batch_keeps_successful_ops(client):
+    response = client.post('/batch', json={'atomic': False, 'ops': [
+        {'op': 'update_photo_info', 'data': {'photo_id': 'photo_1'}},
+        {'op': 'delete_face_info', 'data': {'face_id': 'face_missing'}},
+    ]})
+
+    body = response.get_json()
+    assert body['applied'] is True
+    assert [r['status'] for r in body['results']] == [200, 404]
+    assert 'photo_1' in client.get('/get_photo_info').get_json()
+
+
+def test_unknown_op_is_rejected(client):
+    assert client.post('/batch', json={'ops': [{'op': 'drop_everything'}]}).status_code == 400
+
+
+def test_concurrent_likes_and_comments_are_not_lost(server):
+    client = server.app.test_client()
+    post_id = client.post('/community/create_post', json={'title': 't'}).get_json()['post_id']
+
+    def worker(i):
+        c = server.app.test_client()
+        for _ in range(10):
+            assert c.post('/community/like_post', json={'post_id': post_id}).status_code == 200
+            assert c.post('/community/comment_post', json={'post_id': post_id, 'text': str(i)}).status_code == 200
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    post = client.get('/community/get_posts').get_json()[0]
+    assert post['likes'] == 80
+    assert len(post['comments']) == 80
+    assert len({c['id'] for c in post['comments']}) == 80
@@ -0,0 +1,116 @@
+import threading
+
+from delivery import DeliveryTracker
+
+NOW = 1_700_000_000.0
+
+
+def test_states_only_move_forward():
+    tracker = DeliveryTracker()
+    tracker.track({'id': 1, 'type': 'chat', 'from': 'alice'}, online=['bob'], offline=['carol'], now=NOW)
+
+    assert tracker.mark(1, 'bob', 'acked', now=NOW + 2)
+    assert not tracker.mark(1, 'bob', 'sent', now=NOW + 3)
+    assert tracker.mark(1, 'carol', 'sent', now=NOW + 1)
+    assert not tracker.mark(1, 'alice', 'sent')  # 发送方不计入接收方
+    assert not tracker.mark(99, 'bob', 'acked')
+
+    status = tracker.status(1)
+    assert status['counts'] == {'pending': 0, 'enqueued': 0, 'superseded': 0, 'sent': 1, 'acked': 1}
+    assert status['acked'] and not status['critical']
+    assert set(status['recipients']) == {'bob', 'carol'}
+    assert set(status['recipients']['bob']) == {'state', 'enqueued_at', 'acked_at'}
+    assert tracker.sender(1) == 'alice'
+    assert tracker.status(2) is None
+
+
+def test_critical_events_are_redelivered_until_acked():
+    tracker = DeliveryTracker(redeliver_interval=30, max_attempts=2)
+    tracker.track({'id': 1, 'type': 'sos'}, online=['bob', 'carol'], now=NOW)
+    tracker.track({'id': 2, 'type': 'chat'}, online=['bob'], now=NOW)
+
+    assert tracker.due(now=NOW + 10) == []
+    assert [(e['id'], sorted(p)) for e, p in tracker.due(now=NOW + 30)] == [(1, ['bob', 'carol'])]
+    tracker.mark(1, 'bob', 'acked')
+    assert [(e['id'], p) for e, p in tracker.due(now=NOW + 60)] == [(1, ['carol'])]
+    assert tracker.due(now=NOW + 90) == []  # 达到 max_attempts
+    assert tracker.status(1)['redelivery_attempts'] == 2
+
+
+def test_critical_event_without_recipients_waits():
+    tracker = DeliveryTracker(redeliver_interval=30)
+    tracker.track({'id': 1, 'type': 'sos'}, online=[], now=NOW)
+
+    assert tracker.due(now=NOW + 30) == []
+    tracker.mark(1, 'bob', 'sent')
+    assert [p for _, p in tracker.due(now=NOW + 60)] == [['bob']]
+
+
+def test_oldest_entries_are_evicted():
+    tracker = DeliveryTracker(max_entries=2)
+    for i in range(1, 4):
+        tracker.track({'id': i, 'type': 'sos'}, online=['bob'], now=NOW)
+
+    assert tracker.status(1) is None
+    assert [e['id'] for e, _ in tracker.due(now=NOW + 60)] == [2, 3]
+
+
+def test_publish_ack_and_status_routes(server, client):
+    token = server.add_subscriber('bob')
+    body = client.post('/notifications/publish', json={
+        'type': 'sos', 'from': 'alice', 'to': {'any_of': ['bob', 'carol']}, 'require_delivery': True,
+    }).get_json()
+    assert body['online_subscribers'] == 1
+
+    status = client.get(f"/notifications/status/{body['id']}").get_json()
+    assert status['critical']
+    assert {cid: r['state'] for cid, r in status['recipients'].items()} == {'bob': 'enqueued', 'carol': 'pending'}
+
+    assert client.post('/notifications/ack', json={'id': body['id'], 'client_id': 'bob'}).get_json()['tracked']
+    assert not client.post('/notifications/ack', json={'id': body['id'], 'client_id': 'bob'}).get_json()['tracked']
+    assert client.get(f"/notifications/status/{body['id']}").get_json()['recipients']['bob']['state'] == 'acked'
+    assert client.get('/notifications/status/999').status_code == 404
+
+    # 回执只推送给发送方一次，不记入历史
+    alice, _, _ = server.notifications.read(0, 'alice', timeout=0)
+    assert [e['payload'] for e in alice if e['type'] == 'ack'] == [{'id': body['id'], 'client_id': 'bob'}]
+    assert all(e['type'] != 'ack' for e in server.notifications.history(50))
+    server.remove_subscriber('bob', token)
+
+
+def test_plain_broadcast_registers_recipients_when_sent(server, client):
+    server.add_subscriber('bob')
+    server.add_subscriber('carol')
+
+    body = client.post('/notifications/publish', json={'type': 'chat', 'from': 'alice'}).get_json()
+    assert server.delivery.status(body['id'])['recipients'] == {}
+    server.mark_sent('bob', {'id': body['id']})
+    assert server.delivery.status(body['id'])['counts']['sent'] == 1
+
+    counted = client.post('/notifications/publish', json={
+        'type': 'chat', 'from': 'bob', 'require_delivery': True,
+    }).get_json()
+    assert counted['online_subscribers'] == 1
+
+    sos = client.post('/notifications/publish', json={'type': 'sos', 'from': 'alice'}).get_json()
+    assert sorted(server.delivery.status(sos['id'])['recipients']) == ['bob', 'carol']
+
+
+def test_coalesced_stream_marks_superseded_and_keeps_critical(server, client):
+    def publish():
+        for notif in ({'type': 'dog_location', 'to': 'bob'}, {'type': 'sos', 'to': 'bob', 'collapse_key': 'alert'},
+                      {'type': 'dog_location', 'to': 'bob'}, {'type': 'sos', 'to': 'bob', 'collapse_key': 'alert'}):
+            client.post('/notifications/publish', json=notif)
+
+    response = client.get('/notifications/subscribe?client_id=bob&coalesce=300', buffered=False)
+    frames = iter(response.response)
+    assert next(frames).startswith(b'retry')
+    timer = threading.Timer(0.1, publish)
+    timer.start()
+    body = next(frames).decode()
+    timer.join()
+    response.close()
+
+    assert [int(line[4:]) for line in body.splitlines() if line.startswith('id: ')] == [2, 3, 4]
+    states = {i: server.delivery.status(i)['recipients']['bob']['state'] for i in range(1, 5)}
+    assert states == {1: 'superseded', 2: 'enqueued', 3: 'enqueued', 4: 'enqueued'}  # 写出后才记为 sent
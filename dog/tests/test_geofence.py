@@ -0,0 +1,60 @@
+from geofence import M_PER_DEG, GeofenceEngine, validate_fence
+
+LAT, LON = 30.0, 120.0
+
+
+def _north(meters):
+    return LAT + meters / M_PER_DEG
+
+
+def _engine(**fences):
+    engine = GeofenceEngine()
+    engine.load(fences, version=1)
+    return engine
+
+
+def test_enter_exit_with_hysteresis():
+    engine = _engine(home={'type': 'circle', 'center': [LAT, LON], 'radius_m': 100, 'name': 'home'})
+
+    assert engine.update(_north(200), LON) == []  # 初始状态，不产生事件
+    assert engine.update(_north(95), LON) == []  # 在边界内但未超过迟滞
+    assert engine.update(_north(80), LON) == [('home', 'home', 'enter')]
+    assert engine.update(_north(110), LON) == []
+    assert engine.update(_north(120), LON) == [('home', 'home', 'exit')]
+    assert engine.inside() == []
+
+
+def test_small_circle_can_fire_enter():
+    engine = _engine(door={'type': 'circle', 'center': [LAT, LON], 'radius_m': 10})
+
+    engine.update(_north(50), LON)
+    assert engine.update(LAT, LON) == [('door', 'door', 'enter')]
+    assert engine.update(_north(50), LON) == [('door', 'door', 'exit')]
+
+
+def test_small_polygon_can_fire_enter():
+    d = 8 / M_PER_DEG  # 16 m 见方，内切圆半径 8 m，小于默认迟滞 15 m
+    square = [[LAT - d, LON - d], [LAT - d, LON + d], [LAT + d, LON + d], [LAT + d, LON - d]]
+    engine = _engine(room={'type': 'polygon', 'points': square, 'notify': ['enter']})
+
+    engine.update(_north(100), LON)
+    assert engine.update(LAT, LON) == [('room', 'room', 'enter')]
+    assert engine.update(_north(100), LON) == []  # 只通知进入
+
+
+def test_validate_fence_errors():
+    assert validate_fence({'type': 'circle', 'center': [LAT, LON], 'radius_m': 0})[1] == 'radius_m 必须大于 0'
+    assert validate_fence({'type': 'polygon', 'points': [[0, 0], [1, 1]]})[1] == '多边形至少需要 3 个顶点'
+    assert validate_fence({'type': 'circle', 'center': [95, LON], 'radius_m': 5})[1] == '经纬度超出范围'
+
+
+def test_location_update_broadcasts_geofence_event(server, client):
+    client.post('/geofences/update', json={
+        'fence_id': 'park', 'name': 'park', 'type': 'circle', 'center': [LAT, LON], 'radius_m': 12,
+    })
+    client.post('/update_dog_location', json={'lat': _north(100), 'lon': LON})
+    client.post('/update_dog_location', json={'lat': LAT, 'lon': LON})
+
+    events = [e for e in server.notifications.history(50) if e.get('type') == 'geofence']
+    assert [e['payload']['event'] for e in events] == ['enter']
+    assert client.get('/geofences').get_json()['inside'] == ['park']
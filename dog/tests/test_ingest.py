@@ -0,0 +1,99 @@
+import gzip
+import json
+import time
+from datetime import datetime
+
+import pytest
+
+from dog_server import DogServer
+from ingest import decode_body, validate_batch
+from storage import parse_timestamp
+
+NOW = 1_700_000_000.0
+
+
+def _validate(records, retention=None):
+    return validate_batch([(i, r, None) for i, r in enumerate(records)], NOW, retention or {'gps': 7, 'activity': 90})
+
+
+def test_decode_formats():
+    ndjson = b'{"lat": 1, "lon": 2}\nnot json\n\n{"activity_type": "meal"}\n'
+    items = decode_body(ndjson, None, 'application/x-ndjson')
+    assert [(i, e) for i, _, e in items] == [(0, None), (1, '不是有效的 JSON'), (2, None)]
+
+    body = gzip.compress(json.dumps({'gps': [{'lat': 1, 'lon': 2}], 'activity': [{}]}).encode())
+    items = decode_body(body, 'gzip', 'application/json')
+    assert [r['kind'] for _, r, _ in items] == ['gps', 'activity']
+
+
+def test_gps_keeps_own_timestamp_and_sorts():
+    accepted, rejected, _ = _validate([
+        {'lat': 30, 'lon': 120, 'timestamp': NOW - 60},
+        {'lat': 30, 'lon': 120, 'timestamp': datetime.fromtimestamp(NOW - 120).isoformat()},
+        {'lat': 30, 'lon': 120},
+    ])
+
+    assert rejected == 0
+    times = [parse_timestamp(f['server_received_time']) for f in accepted['gps']]
+    assert times == [NOW - 120, NOW - 60, NOW]
+    assert parse_timestamp(accepted['gps'][0]['ingested_at']) == NOW
+
+
+def test_bad_timestamps_are_rejected_per_record():
+    _, rejected, errors = _validate([
+        {'lat': 30, 'lon': 120, 'timestamp': NOW + 3600},
+        {'lat': 30, 'lon': 120, 'timestamp': NOW - 8 * 86400},
+        {'lat': 30, 'lon': 120, 'timestamp': 'yesterday'},
+        {'activity_type': 'meal', 'timestamp': NOW + 3600},
+        {'lat': 95, 'lon': 120},
+    ])
+
+    assert rejected == 5
+    assert [e['error'] for e in errors] == [
+        '时间戳晚于服务器时间', '时间戳早于保留期', '时间戳格式无效', '时间戳晚于服务器时间', '经纬度超出范围',
+    ]
+
+
+def test_activity_type_must_be_string():
+    accepted, rejected, errors = _validate([
+        {'activity_type': ['x']},
+        {'activity_type': {'a': 1}},
+        {'kind': 'activity', 'activity_type': None},
+    ])
+
+    assert rejected == 2
+    assert {e['index'] for e in errors} == {0, 1}
+    assert [a['activity_type'] for a in accepted['activity']] == ['other']
+
+
+@pytest.mark.parametrize('backend', ['json', 'sqlite'])
+def test_offline_batch_keeps_history_in_time_order(tmp_path, monkeypatch, backend):
+    monkeypatch.setenv('DOG_STORAGE_BACKEND', backend)
+    server = DogServer(root_dir=str(tmp_path))
+    try:
+        _check_offline_batch(server, server.app.test_client())
+    finally:
+        server.shutdown()
+
+
+def _check_offline_batch(server, client):
+    now = time.time()
+    client.post('/upload_gps', json={'lat': 30.0, 'lon': 120.0})
+    batch = [{'lat': 30.0 + i * 1e-4, 'lon': 120.0, 'timestamp': now - 600 + i * 30} for i in range(10)]
+    batch.append({'activity_type': ['x']})
+
+    before = server.gps_log.iter_records()
+    body = client.post('/ingest', json=batch).get_json()
+    assert body['accepted'] == {'gps': 10, 'activity': 0}
+    assert body['rejected'] == 1
+
+    history = client.get('/get_gps_history?limit=20').get_json()
+    times = [parse_timestamp(f['server_received_time']) for f in history]
+    assert len(times) == 11 and times == sorted(times)
+    assert server.trajectory.query(now - 700, now + 10)['segments'][0]['points'] == 11
+    assert server.activity_log.tail(10) == []
+    # 晚到的定位直接追加在末尾，压缩时才按时间重排
+    assert server.gps_log.iter_records()[0] == before[0]
+    server.gps_log.compact()
+    stored = [parse_timestamp(f['server_received_time']) for f in server.gps_log.iter_records()]
+    assert stored == sorted(stored)
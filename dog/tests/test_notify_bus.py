@@ -0,0 +1,217 @@
+import threading
+import time
+
+from notify_bus import (
+    NotificationRing, SubscriptionIndex, TopicFilter, coalesce, coalesce_window, compile_target, sse_frame,
+)
+
+
+class _SlowLog:
+    """append 阻塞到 release 被设置，用于检查发布时读取方是否被 I/O 阻塞"""
+    def __init__(self):
+        self.next_id = 1
+        self.entered = threading.Event()
+        self.release = threading.Event()
+
+    def query(self, **kwargs):
+        return []
+
+    def append(self, event):
+        self.entered.set()
+        self.release.wait(5)
+        event['id'] = self.next_id
+        self.next_id += 1
+        return event['id']
+
+
+def test_targeted_and_broadcast_reads():
+    ring = NotificationRing(capacity=8)
+    ring.publish({'type': 'a'})
+    ring.publish({'type': 'b', 'to': 'alice'})
+    ring.publish({'type': 'c', 'to': {'any_of': ['bob', 'carol']}})
+
+    alice, _, _ = ring.read(0, 'alice', timeout=0)
+    bob, cursor, _ = ring.read(0, 'bob', timeout=0)
+    assert [e['type'] for e in alice] == ['a', 'b']
+    assert [e['type'] for e in bob] == ['a', 'c']
+    assert [e['id'] for e in ring.history(10)] == [1, 2, 3]
+    assert ring.read(cursor, 'bob', timeout=0) == ([], cursor, 0)
+
+
+def test_slow_reader_reports_dropped():
+    ring = NotificationRing(capacity=4)
+    for i in range(10):
+        ring.publish({'n': i}, history=False)
+
+    items, cursor, dropped = ring.read(0, 'x', timeout=0)
+    assert dropped == 6
+    assert [e['n'] for e in items] == [6, 7, 8, 9]
+    assert cursor == 10
+
+
+def test_read_waits_for_publish():
+    ring = NotificationRing()
+    threading.Timer(0.05, ring.publish, args=({'type': 'sos'},)).start()
+    items, _, _ = ring.read(ring.next_seq, 'x', timeout=2)
+    assert [e['type'] for e in items] == ['sos']
+
+
+def test_readers_do_not_wait_for_log_io():
+    log = _SlowLog()
+    ring = NotificationRing(log=log)
+    ring.publish({'type': 'first'}, history=False)
+    publisher = threading.Thread(target=ring.publish, args=({'type': 'logged'},))
+    publisher.start()
+    assert log.entered.wait(2)
+
+    start = time.monotonic()
+    items, cursor, _ = ring.read(0, 'x', timeout=0)
+    ring.history(10)
+    ring.resume(0, 'x')
+    assert time.monotonic() - start < 0.5
+    assert [e['type'] for e in items] == ['first']
+
+    log.release.set()
+    publisher.join()
+    assert ring.read(cursor, 'x', timeout=0)[0][0]['id'] == 1
+
+
+def test_concurrent_publishers_keep_id_order():
+    ring = NotificationRing(capacity=4096, history_size=4096)
+
+    def worker():
+        for _ in range(200):
+            ring.publish({'type': 't'})
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    items, _, _ = ring.read(0, 'x', timeout=0, max_items=1000)
+    assert [e['id'] for e in items] == list(range(1, 801))
+    assert [e['id'] for e in ring.history(1000)] == list(range(1, 801))
+
+
+def test_resume_replays_missed_events_without_duplicates():
+    ring = NotificationRing()
+    for i in range(5):
+        ring.publish({'type': 't', 'to': 'alice' if i == 3 else 'bob'})
+
+    items, cursor, complete = ring.resume(2, 'alice')
+    assert [e['id'] for e in items] == [4]
+    assert complete
+    ring.publish({'type': 't'})
+    assert [e['id'] for e in ring.read(cursor, 'alice', timeout=0)[0]] == [6]
+
+
+def test_resume_after_restart_replays_everything():
+    ring = NotificationRing()
+    ring.publish({'type': 't'})
+    items, _, complete = ring.resume(99, 'alice')
+    assert [e['id'] for e in items] == [1]
+    assert complete
+
+
+def test_attach_log_keeps_events_published_before_it(tmp_path):
+    from notify_log import NotificationLog
+
+    log = NotificationLog(str(tmp_path))
+    for _ in range(3):
+        log.append({'type': 'old'})
+    ring = NotificationRing(history_size=10)
+    early = {'type': 'early'}
+    log.append(early)  # 总线模式下集线器已写入日志并转发
+    ring.publish(early)
+    ring.attach_log(log)
+    ring.publish({'type': 'new'})
+
+    assert [(e['id'], e['type']) for e in ring.history(10)] == [(1, 'old'), (2, 'old'), (3, 'old'), (4, 'early'), (5, 'new')]
+
+    # 查询日志期间转发到达、日志查询结果里还没有的通知保留在历史末尾
+    late = NotificationRing(history_size=10)
+    late.publish({'type': 'late', 'id': 9})
+    late.attach_log(log)
+    assert [e['id'] for e in late.history(10)] == [1, 2, 3, 4, 5, 9]
+
+
+def test_topic_filter_patterns():
+    topic = TopicFilter(types='sched*, sos, !schedule_test', senders='!robot')
+    assert topic.matches(None, {'type': 'sos', 'from': 'alice'})
+    assert topic.matches(None, {'type': 'schedule', 'from': 'alice'})
+    assert not topic.matches(None, {'type': 'schedule_test'})
+    assert not topic.matches(None, {'type': 'sos', 'from': 'robot'})
+    assert not topic.matches(None, {'type': 'chat'})
+
+    direct = TopicFilter(recipients='all')
+    assert direct.matches(None, {'type': 'chat'})
+    assert not direct.matches(compile_target('bob'), {'type': 'chat'})
+    assert TopicFilter.from_args({}) is None
+    assert TopicFilter.from_args(topic.to_args()).matches(None, {'type': 'scheduled', 'from': 'x'})
+
+
+def test_read_applies_topic_filter():
+    ring = NotificationRing()
+    for event_type in ('sos', 'chat', 'schedule'):
+        ring.publish({'type': event_type})
+
+    items, _, _ = ring.read(0, 'alice', timeout=0, topic=TopicFilter(types='sos,sched*'))
+    assert [e['type'] for e in items] == ['sos', 'schedule']
+
+
+def test_subscription_index_candidates():
+    index = SubscriptionIndex()
+    index.add('a', TopicFilter(types='sos'), 'A')
+    index.add('b', TopicFilter(types='sched*'), 'B')
+    index.add('c', None, 'C')
+
+    assert sorted(index.candidates('sos')) == ['A', 'B', 'C']
+    assert sorted(index.candidates('chat')) == ['B', 'C']
+    index.add('a', TopicFilter(types='chat'), 'A')
+    assert sorted(index.candidates('sos')) == ['B', 'C']
+    index.remove('a')
+    index.remove('missing')
+    assert sorted(index.candidates('chat')) == ['B', 'C']
+
+
+def test_coalesce_keeps_latest_per_collapse_key():
+    events = [
+        {'type': 'dog_location', 'n': 1},
+        {'type': 'sos', 'n': 2},
+        {'type': 'chat', 'collapse_key': 'typing', 'n': 3},
+        {'type': 'dog_location', 'n': 4},
+        {'type': 'chat', 'collapse_key': 'typing', 'n': 5},
+        {'type': 'sos', 'n': 6},
+    ]
+    kept, superseded = coalesce(events)
+    assert [e['n'] for e in kept] == [2, 4, 5, 6]
+    assert [e['n'] for e in superseded] == [1, 3]
+    distinct = events[:3]
+    assert coalesce(distinct) == (distinct, [])
+    assert coalesce(distinct)[0] is distinct
+
+
+def test_coalesce_never_collapses_kept_types():
+    events = [
+        {'type': 'sos', 'collapse_key': 'alert', 'n': 1},
+        {'type': 'chat', 'collapse_key': 'alert', 'n': 2},
+        {'type': 'sos', 'collapse_key': 'alert', 'n': 3},
+        {'type': 'chat', 'collapse_key': 'alert', 'n': 4},
+    ]
+    kept, superseded = coalesce(events, keep_types={'sos'})
+    assert [e['n'] for e in kept] == [1, 3, 4]
+    assert [e['n'] for e in superseded] == [2]
+
+
+def test_coalesce_window_is_clamped():
+    assert coalesce_window({}) == 0.0
+    assert coalesce_window({'coalesce': 'abc'}) == 0.0
+    assert coalesce_window({'coalesce': '-5'}) == 0.0
+    assert coalesce_window({'coalesce': '250'}) == 0.25
+    assert coalesce_window({'coalesce': '999999'}) == 5.0
+
+
+def test_sse_frame_includes_id_only_for_logged_events():
+    assert sse_frame({'id': 7, 'type': 'sos'}).startswith('id: 7\ndata: ')
+    assert sse_frame({'type': 'dog_location'}).startswith('data: ')
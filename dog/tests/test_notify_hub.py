@@ -0,0 +1,195 @@
+import json
+import socket
+import threading
+import time
+
+import pytest
+
+from dog_server import DogServer
+from notify_bus import TopicFilter
+from notify_hub import NotificationBus
+from notify_log import NotificationLog
+
+
+def _wait(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return predicate()
+
+
+class _Worker:
+    def __init__(self, path, log_dir):
+        self.events = []
+        self.marks = []
+        self.bus = NotificationBus(
+            path, lambda: NotificationLog(log_dir),
+            on_event=lambda event, history: self.events.append(event),
+            on_mark=lambda *mark: self.marks.append(mark),
+        )
+
+
+@pytest.fixture
+def workers(tmp_path):
+    path = str(tmp_path / 'bus.sock')
+    log_dir = str(tmp_path / 'notifications')
+    started = []
+
+    def start():
+        worker = _Worker(path, log_dir)
+        started.append(worker)
+        return worker
+
+    yield start
+    for worker in started:
+        worker.bus.close()
+
+
+def test_publish_is_forwarded_to_every_worker(workers):
+    hub, other = workers(), workers()
+    assert hub.bus.hub is not None and other.bus.hub is None
+
+    event = {'type': 'sos', 'to': 'bob'}
+    other.bus.publish(event)
+    assert event['id'] == 1
+    assert _wait(lambda: len(hub.events) == 1)
+    assert [e['id'] for e in other.events] == [1]
+    assert [e['id'] for e in hub.bus.query(recipient='bob')] == [1]
+
+    other.bus.mark(1, 'bob', 'sent')
+    assert _wait(lambda: hub.marks == [(1, 'bob', 'sent')])
+    assert other.marks == []
+
+
+def test_replies_and_broadcasts_do_not_interleave(workers):
+    hub, other = workers(), workers()
+    payload = 'x' * 200_000
+    for _ in range(5):
+        hub.bus.publish({'type': 'big', 'payload': payload})
+    assert _wait(lambda: len(other.events) == 5)
+    errors = []
+
+    def query():
+        for _ in range(20):
+            items = other.bus.query(limit=5)
+            if [e['payload'] for e in items] != [payload] * 5:
+                errors.append('query')
+
+    threads = [threading.Thread(target=query) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for _ in range(20):
+        hub.bus.publish({'type': 'big', 'payload': payload}, history=False)
+    for t in threads:
+        t.join()
+
+    assert errors == []
+    assert _wait(lambda: len(other.events) == 25)
+    assert all(e['payload'] == payload for e in other.events)
+
+
+def test_stalled_worker_does_not_block_publishing(workers):
+    hub, other = workers(), workers()
+    hub.bus.hub.max_queue = 20
+    stalled = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stalled.connect(hub.bus.path)
+    stalled.sendall(json.dumps({'op': 'hello'}).encode() + b'\n')  # 之后不再读取
+    payload = 'x' * 100_000
+
+    start = time.monotonic()
+    for _ in range(100):
+        hub.bus.publish({'type': 'big', 'payload': payload}, history=False)
+    assert time.monotonic() - start < 3
+    assert _wait(lambda: len(other.events) == 100)
+    assert _wait(lambda: len(hub.bus.hub._conns) == 2)  # 积压过多的连接被断开
+    stalled.close()
+
+
+def test_presence_is_shared_and_cleared_when_a_worker_leaves(workers):
+    hub, first, second = workers(), workers(), workers()
+    first.bus.presence('bob', TopicFilter(types='sos'))
+    first.bus.presence('carol')
+
+    assert _wait(lambda: set(second.bus.remote_subscribers()) == {'bob', 'carol'})
+    topic = second.bus.remote_subscribers()['bob']
+    assert topic.matches(None, {'type': 'sos'}) and not topic.matches(None, {'type': 'chat'})
+    assert first.bus.remote_subscribers() == {}
+
+    first.bus.presence('carol', online=False)
+    assert _wait(lambda: set(hub.bus.remote_subscribers()) == {'bob'})
+    first.bus.close()
+    assert _wait(lambda: hub.bus.remote_subscribers() == {} and second.bus.remote_subscribers() == {})
+
+    late = workers()
+    second.bus.presence('dave')
+    assert _wait(lambda: set(late.bus.remote_subscribers()) == {'dave'})
+
+
+def test_failover_keeps_ids_increasing(workers):
+    hub, other = workers(), workers()
+    for _ in range(3):
+        hub.bus.publish({'type': 't'})
+    assert _wait(lambda: len(other.events) == 3)
+
+    hub.bus.close()
+    event = {'type': 't'}
+    other.bus.publish(event)
+    assert other.bus.hub is not None
+    assert event['id'] == 4
+    assert [e['id'] for e in other.bus.query(since_id=0)] == [1, 2, 3, 4]
+
+
+def test_delivery_status_spans_workers(tmp_path, monkeypatch):
+    monkeypatch.setenv('DOG_NOTIFY_BUS', str(tmp_path / 'bus.sock'))
+    first = DogServer(root_dir=str(tmp_path))
+    second = DogServer(root_dir=str(tmp_path))
+    try:
+        first.add_subscriber('bob')
+        assert _wait(lambda: 'bob' in second.notify_bus.remote_subscribers())
+
+        body = second.app.test_client().post('/notifications/publish', json={
+            'type': 'sos', 'from': 'alice', 'to': {'any_of': ['bob', 'carol']}, 'require_delivery': True,
+        }).get_json()
+        assert body['online_subscribers'] == 1
+
+        def states(server):
+            status = server.delivery.status(body['id'])
+            return status and {cid: r['state'] for cid, r in status['recipients'].items()}
+
+        assert _wait(lambda: states(first) == {'bob': 'enqueued', 'carol': 'pending'})
+        assert states(second) == {'bob': 'enqueued', 'carol': 'pending'}
+
+        first.mark_sent('bob', {'id': body['id']})
+        assert _wait(lambda: states(second)['bob'] == 'sent')
+        second.app.test_client().post('/notifications/ack', json={'id': body['id'], 'client_id': 'bob'})
+        assert _wait(lambda: states(first)['bob'] == 'acked')
+    finally:
+        second.shutdown()
+        first.shutdown()
+
+
+def test_critical_publish_is_queued_while_bus_is_down(tmp_path, monkeypatch):
+    monkeypatch.setenv('DOG_NOTIFY_BUS', str(tmp_path / 'bus.sock'))
+    server = DogServer(root_dir=str(tmp_path))
+    try:
+        publish = server.notify_bus.publish
+
+        def down(event, history=True):
+            raise ConnectionError('通知总线不可用')
+
+        monkeypatch.setattr(server.notify_bus, 'publish', down)
+        client = server.app.test_client()
+        response = client.post('/notifications/publish', json={'type': 'sos', 'message': 'help'})
+        assert response.status_code == 503 and response.get_json()['queued']
+        assert client.post('/notifications/publish', json={'type': 'chat'}).get_json()['queued'] is False
+        server._publish_unpublished()
+        assert len(server.unpublished) == 1
+
+        monkeypatch.setattr(server.notify_bus, 'publish', publish)
+        server._publish_unpublished()
+        assert not server.unpublished
+        assert [e['message'] for e in server.notifications.history(10)] == ['help']
+    finally:
+        server.shutdown()
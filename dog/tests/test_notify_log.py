@@ -0,0 +1,117 @@
+import builtins
+import os
+import random
+import threading
+import time
+
+import notify_log
+from notify_bus import NotificationRing
+from notify_log import NotificationLog, recipients_of
+
+
+def _fill(log, count, seed=3):
+    rng = random.Random(seed)
+    events = []
+    for _ in range(count):
+        to = rng.choice([None, 'alice', 'bob', {'any_of': ['alice', 'carol']}])
+        event = {'type': rng.choice(['sos', 'geofence', 'chat']), 'to': to}
+        log.append(event)
+        events.append(event)
+    return events
+
+
+def _expected(events, since_id=None, types=None, recipient=None, limit=50):
+    ids = [e['id'] for e in events
+           if (not types or e['type'] in types)
+           and (recipient is None or {'all', recipient} & set(recipients_of(e)))]
+    if since_id is None:
+        return ids[-limit:] if limit else []
+    return [i for i in ids if i > since_id][:limit]
+
+
+def test_append_and_reload_keep_ids(tmp_path):
+    log = NotificationLog(str(tmp_path), segment_size=4)
+    _fill(log, 10)
+    log.close()
+    assert len(os.listdir(tmp_path)) == 3
+
+    with open(tmp_path / '000000000009.jsonl', 'ab') as f:
+        f.write(b'{"id": 11, "type":')  # 崩溃时写了一半的行
+    reloaded = NotificationLog(str(tmp_path), segment_size=4)
+    assert reloaded.next_id == 11
+    assert reloaded.append({'type': 'sos'}) == 11
+    assert [e['id'] for e in reloaded.query(since_id=8)] == [9, 10, 11]
+
+
+def test_query_matches_full_scan(tmp_path):
+    log = NotificationLog(str(tmp_path), segment_size=16, cache_size=8)
+    events = _fill(log, 200)
+
+    cases = [
+        {}, {'limit': 0}, {'since_id': 0, 'limit': 7}, {'since_id': 150}, {'since_id': 200},
+        {'types': ['sos']}, {'types': ['sos', 'chat'], 'since_id': 40, 'limit': 10},
+        {'recipient': 'alice'}, {'recipient': 'carol', 'since_id': 20, 'limit': 5}, {'recipient': 'dave'},
+        {'types': ['geofence'], 'recipient': 'bob', 'limit': 12},
+        {'types': ['chat', 'missing'], 'recipient': 'alice', 'since_id': 100},
+    ]
+    for args in cases:
+        assert [e['id'] for e in log.query(**args)] == _expected(events, **args), args
+
+
+def test_any_of_with_repeated_recipient_is_returned_once(tmp_path):
+    log = NotificationLog(str(tmp_path))
+    log.append({'type': 'chat', 'to': {'any_of': ['alice', 'alice']}})
+    assert [e['id'] for e in log.query(recipient='alice')] == [1]
+    assert [e['id'] for e in log.query(since_id=0, recipient='alice')] == [1]
+
+
+def test_prune_drops_old_segments(tmp_path):
+    log = NotificationLog(str(tmp_path), retention_days=1, segment_size=5)
+    _fill(log, 12)
+    old = os.path.join(tmp_path, '000000000001.jsonl')
+    os.utime(old, (0, 0))
+
+    assert log.prune() == 5
+    assert not os.path.exists(old)
+    assert [e['id'] for e in log.query(since_id=0, limit=100)] == list(range(6, 13))
+    assert all(e['id'] > 5 for e in log.query(recipient='alice'))
+
+
+def test_resume_past_history_reads_the_log(tmp_path):
+    ring = NotificationRing(history_size=3, log=NotificationLog(str(tmp_path)))
+    for i in range(10):
+        ring.publish({'type': 't', 'to': 'bob' if i % 2 else None})
+
+    items, _, complete = ring.resume(2, 'alice')
+    assert [e['id'] for e in items] == [3, 5, 7, 9]
+    assert complete
+
+    small = NotificationRing(capacity=2, history_size=3, log=NotificationLog(str(tmp_path)))
+    items, _, complete = small.resume(0, 'bob')
+    assert not complete
+
+
+def test_query_reads_segments_without_blocking_append(tmp_path, monkeypatch):
+    log = NotificationLog(str(tmp_path), cache_size=1)
+    _fill(log, 20)
+    reading = threading.Event()
+    release = threading.Event()
+
+    def slow_open(path, mode='r', *args, **kwargs):
+        if mode == 'rb':
+            reading.set()
+            release.wait(5)
+        return builtins.open(path, mode, *args, **kwargs)
+
+    monkeypatch.setattr(notify_log, 'open', slow_open, raising=False)
+    result = []
+    reader = threading.Thread(target=lambda: result.extend(log.query(since_id=0, limit=10)))
+    reader.start()
+    assert reading.wait(2)
+
+    start = time.monotonic()
+    assert log.append({'type': 'sos'}) == 21
+    assert time.monotonic() - start < 0.5
+    release.set()
+    reader.join()
+    assert [e['id'] for e in result] == list(range(1, 11))
@@ -0,0 +1,71 @@
+import os
+
+import pytest
+
+from paging import SortedPageIndex, decode_cursor, encode_cursor, project
+from storage import AppendLog, LockManager
+
+
+def test_cursor_round_trip_and_bad_cursor():
+    state = {'k': [-3, 0]}
+    assert decode_cursor(encode_cursor(state)) == state
+    assert decode_cursor('') is None
+    with pytest.raises(ValueError):
+        decode_cursor('not-a-cursor')
+
+
+def test_page_index_continues_after_deleted_key():
+    index = SortedPageIndex([(k, {'k': k}) for k in (5, 1, 3, 4, 2)])
+    items, last = index.page(None, 2)
+    assert [i['k'] for i in items] == [1, 2] and last == 2
+
+    rebuilt = SortedPageIndex([(k, {'k': k}) for k in (1, 3, 4, 5)])
+    items, last = rebuilt.page(last, 10)
+    assert [i['k'] for i in items] == [3, 4, 5] and last is None
+
+
+def test_project_with_virtual_field():
+    post = {'id': 1, 'title': 't', 'comments': [{}, {}]}
+    assert project(post, ['id', 'comment_count'], {'comment_count': lambda p: len(p['comments'])}) == {
+        'id': 1, 'comment_count': 2,
+    }
+
+
+def test_append_log_pages_newest_first(tmp_path):
+    log = AppendLog(str(tmp_path / 'gps.jsonl'), LockManager(), timestamp_key='t')
+    for i in range(25):
+        log.append({'t': 1000 + i, 'i': i})
+
+    seen, cursor = [], None
+    while True:
+        items, cursor = log.page_before(cursor, 10)
+        seen.extend(item['i'] for item in items)
+        if cursor is None:
+            break
+    log.close()
+
+    assert seen == list(range(24, -1, -1))
+
+
+def test_community_posts_cursor(client):
+    for i in range(5):
+        client.post('/community/create_post', json={'title': f'p{i}'})
+
+    first = client.get('/community/get_posts?cursor=&limit=2&fields=id,comment_count').get_json()
+    assert [p['id'] for p in first['items']] == [5, 4]
+    assert first['items'][0] == {'id': 5, 'comment_count': 0}
+
+    rest = client.get(f"/community/get_posts?cursor={first['next_cursor']}&limit=10").get_json()
+    assert [p['id'] for p in rest['items']] == [3, 2, 1]
+    assert rest['next_cursor'] is None
+
+
+def test_malformed_gps_cursor_is_rejected(server, client):
+    client.post('/upload_gps', json={'lat': 30.0, 'lon': 120.0})
+    generation = os.stat(server.gps_log.path).st_ino
+
+    for state in ({'g': generation, 'o': 'x'}, {'g': generation, 'o': -1}, {'g': generation, 'o': True}):
+        with pytest.raises(ValueError):
+            server.gps_log.page_before(state, 10)
+        response = client.get(f'/get_gps_history?cursor={encode_cursor(state)}')
+        assert response.status_code == 400
@@ -0,0 +1,72 @@
+import json
+import os
+from datetime import datetime
+
+from dog_server import DogServer
+from rollups import ActivityRollupKind, GpsRollupKind, Rollup
+
+BASE = 1_700_000_000 - 1_700_000_000 % 3600
+
+
+class _MemoryLog:
+    def __init__(self):
+        self.rows = []
+
+    def iter_records(self):
+        return list(self.rows)
+
+    def append_many(self, rows):
+        self.rows.extend(rows)
+
+
+def _rollup(kind):
+    logs = {'minute': _MemoryLog(), 'hour': _MemoryLog()}
+    return Rollup(kind, logs, {'minute': 30, 'hour': 730}), logs
+
+
+def test_activity_minutes_roll_into_hours():
+    rollup, logs = _rollup(ActivityRollupKind())
+    rollup.add([
+        {'timestamp': BASE + 5, 'activity_type': 'meal'},
+        {'timestamp': BASE + 30, 'activity_type': 'rest'},
+        {'timestamp': BASE + 70, 'activity_type': 'meal'},
+        {'timestamp': BASE + 10, 'activity_type': 'meal'},  # 晚到，写部分汇总
+        {'timestamp': BASE + 80, 'activity_type': ['x']},
+    ])
+    rollup.flush(BASE + 7200)
+
+    minutes = rollup.query('minute', BASE, BASE + 3600)
+    assert [(row['count'], row['by_type']) for row in minutes] == [
+        (3, {'meal': 2, 'rest': 1}),
+        (1, {'meal': 1}),
+    ]
+    assert rollup.query('hour', BASE, BASE + 3600)[0]['by_type'] == {'meal': 3, 'rest': 1}
+    assert len(logs['hour'].rows) == 1
+
+
+def test_gps_rollup_tracks_distance():
+    rollup, _ = _rollup(GpsRollupKind())
+    rollup.add([
+        {'server_received_time': BASE + 1, 'lat': 30.0, 'lon': 120.0},
+        {'server_received_time': BASE + 2, 'lat': 30.001, 'lon': 120.0},
+        {'server_received_time': BASE + 3, 'lat': 'bad', 'lon': 120.0},
+    ])
+    row = rollup.query('minute', BASE, BASE + 60)[0]
+    assert row['count'] == 2
+    assert 100 < row['distance_m'] < 120
+
+
+def test_server_starts_with_malformed_activity_history(tmp_path):
+    uploads = tmp_path / 'uploads'
+    os.makedirs(uploads)
+    now = datetime.now().isoformat()
+    with open(uploads / 'activity_records.jsonl', 'w', encoding='utf-8') as f:
+        for atype in (['x'], None, 'meal'):
+            f.write(json.dumps({'activity_type': atype, 'description': '', 'timestamp': now}) + '\n')
+
+    server = DogServer(root_dir=str(tmp_path))
+    try:
+        day = server.app.test_client().get('/get_activity_stats').get_json()['day']
+        assert day['by_type'] == {'meal': 1}
+    finally:
+        server.shutdown()
@@ -0,0 +1,99 @@
+import os
+import threading
+import time
+
+from storage import AppendLog, JsonDocumentStore, LockManager
+
+
+def test_load_hits_cache_and_returns_copies(tmp_path):
+    store = JsonDocumentStore()
+    path = str(tmp_path / 'doc.json')
+    store.save(path, {'a': [1, 2]})
+
+    first = store.load(path)
+    first['a'].append(3)
+    second = store.load(path)
+
+    assert second == {'a': [1, 2]}
+    assert store.cache.stats()['hits'] >= 1
+
+
+def test_external_edit_invalidates_cache(tmp_path):
+    store = JsonDocumentStore()
+    path = str(tmp_path / 'doc.json')
+    store.save(path, {'v': 1})
+    assert store.load(path) == {'v': 1}
+
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('{"v": 2, "pad": "changes the size"}')
+
+    assert store.load(path)['v'] == 2
+
+
+def test_write_behind_coalesces_saves(tmp_path):
+    store = JsonDocumentStore(write_delay=0.2)
+    path = str(tmp_path / 'doc.json')
+    for i in range(10):
+        store.save(path, {'v': i})
+
+    assert store.load(path) == {'v': 9}
+    assert store.close()
+    assert store.disk_writes == 1
+    assert JsonDocumentStore().load(path) == {'v': 9}
+
+
+def test_transaction_rolls_back_on_error(tmp_path):
+    store = JsonDocumentStore()
+    a, b = str(tmp_path / 'a.json'), str(tmp_path / 'b.json')
+    store.save(a, {'v': 1})
+    store.save(b, {'v': 1})
+
+    try:
+        with store.transaction([a, b]) as txn:
+            txn.save(a, {'v': 2})
+            raise ValueError
+    except ValueError:
+        pass
+
+    assert store.load(a) == {'v': 1}
+    assert not [n for n in os.listdir(tmp_path) if n.endswith('.tmp')]
+
+
+def test_writer_excludes_readers_on_same_key_only():
+    locks = LockManager()
+    events = []
+    in_write = threading.Event()
+
+    def writer():
+        with locks.write('a'):
+            in_write.set()
+            time.sleep(0.1)
+            events.append('write-done')
+
+    t = threading.Thread(target=writer)
+    t.start()
+    in_write.wait()
+    with locks.read('b'):
+        events.append('other-key')
+    with locks.read('a'):
+        events.append('read-a')
+    t.join()
+
+    assert events == ['other-key', 'write-done', 'read-a']
+    assert locks.stats()['a']['write']['count'] == 1
+
+
+def test_late_records_are_appended_and_reordered_on_compact(tmp_path):
+    now = time.time()
+    log = AppendLog(str(tmp_path / 'gps.jsonl'), LockManager(), timestamp_key='t')
+    log.append_many([{'t': now - 10, 'i': 2}, {'t': now, 'i': 3}])
+    inode = os.stat(log.path).st_ino
+    log.append_many([{'t': now - 30, 'i': 0}, {'t': now - 20, 'i': 1}])
+
+    assert os.stat(log.path).st_ino == inode  # 晚到的记录直接追加，不改写文件
+    assert [r['i'] for r in log.tail(10)] == [0, 1, 2, 3]
+    assert [r['i'] for r in log.iter_records()] == [2, 3, 0, 1]
+
+    log.compact()
+    assert [r['i'] for r in log.iter_records()] == [0, 1, 2, 3]
+    log.close()
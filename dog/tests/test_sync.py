@@ -0,0 +1,46 @@
+def _sync(client, **params):
+    response = client.get('/sync', query_string=params)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_first_sync_is_full_then_delta(client):
+    client.post('/update_face_info', json={'face_id': 'face_1', 'name': 'A'})
+    first = _sync(client)
+    assert first['reset'] is True
+    assert 'face_1' in first['collections']['face_info']
+
+    client.post('/update_photo_info', json={'photo_id': 'photo_1', 'title': 'park'})
+    delta = _sync(client, since=first['version'], epoch=first['epoch'])
+
+    assert delta['reset'] is False
+    assert [(c['collection'], c['op'], c['key']) for c in delta['changes']] == [
+        ('photo_info', 'upsert', 'photo_1'),
+    ]
+    assert delta['changes'][0]['record']['title'] == 'park'
+
+
+def test_delete_is_reported(client):
+    client.post('/update_photo_info', json={'photo_id': 'photo_1'})
+    base = _sync(client)
+    client.post('/delete_photo_info', json={'photo_id': 'photo_1'})
+
+    delta = _sync(client, since=base['version'], epoch=base['epoch'])
+    assert [(c['op'], c['key']) for c in delta['changes']] == [('delete', 'photo_1')]
+
+
+def test_other_epoch_forces_reset(client):
+    base = _sync(client)
+    assert _sync(client, since=base['version'], epoch='stale')['reset'] is True
+
+
+def test_missing_epoch_forces_reset(client):
+    client.post('/update_face_info', json={'face_id': 'face_1', 'name': 'A'})
+    base = _sync(client)
+    assert base['version'] > 0
+    client.post('/update_photo_info', json={'photo_id': 'photo_1'})
+    assert _sync(client, since=base['version'])['reset'] is True
+
+
+def test_bad_since_is_rejected(client):
+    assert client.get('/sync?since=abc').status_code == 400
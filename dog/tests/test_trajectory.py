@@ -0,0 +1,64 @@
+import random
+
+from trajectory import TrajectoryIndex, simplify
+
+BASE = 1_700_000_000.0
+
+
+def _fix(offset, lat, lon=120.0):
+    return {'server_received_time': BASE + offset, 'lat': lat, 'lon': lon}
+
+
+def _walk():
+    """两段轨迹：先在原地停留 10 分钟，再向北走；中间断开 20 分钟"""
+    fixes = [_fix(t, 30.0) for t in range(0, 600, 30)]
+    fixes += [_fix(600 + t, 30.0 + t * 1e-5) for t in range(0, 600, 30)]
+    fixes += [_fix(2400 + t, 30.1 + t * 1e-5) for t in range(0, 300, 30)]
+    return fixes
+
+
+def test_segments_distance_and_dwell():
+    index = TrajectoryIndex()
+    index.add_many(_walk())
+
+    result = index.query(BASE, BASE + 4000, tolerance=0)
+    assert result['count'] == 50
+    first, second = result['segments']
+    assert first['points'] == 40 and second['points'] == 10
+    assert 600 < first['distance_m'] < 700
+    assert first['dwells'] and first['dwells'][0]['duration_s'] >= 300
+
+
+def test_late_points_give_same_index_as_in_order():
+    fixes = _walk()
+    expected = TrajectoryIndex()
+    expected.add_many(fixes)
+
+    shuffled = list(fixes)
+    random.Random(7).shuffle(shuffled)
+    index = TrajectoryIndex()
+    for i in range(0, len(shuffled), 7):
+        index.add_many(shuffled[i:i + 7])
+
+    assert index._ts == sorted(index._ts)
+    for bbox in (None, (29.99, 119.99, 30.003, 120.01)):
+        assert index.query(BASE, BASE + 4000, bbox=bbox) == expected.query(BASE, BASE + 4000, bbox=bbox)
+    assert index.query(BASE + 600, BASE + 900)['count'] == 10
+
+
+def test_late_point_after_prune():
+    index = TrajectoryIndex()
+    index.add_many(_walk())
+    index.prune(BASE + 300)
+    index.add(_fix(450, 30.0))
+
+    result = index.query(BASE, BASE + 4000)
+    assert result['count'] == 41
+    assert index._ts == sorted(index._ts)
+
+
+def test_simplify_keeps_corner():
+    line = [(30.0, 120.0 + i * 1e-4, i) for i in range(10)] + [(30.0 + i * 1e-4, 120.0009, 10 + i) for i in range(1, 10)]
+    kept = simplify(line, 1.0)
+    assert kept[0] == line[0] and kept[-1] == line[-1]
+    assert line[9] in kept and len(kept) == 3
@@ -0,0 +1,325 @@
+"""
+GPS 轨迹索引
+- 点按 server_received_time 有序保存，时间范围查询为二分查找；
+  晚到的点（早于已有的最后一点）插入到正确位置，并从其所在的段起重放，重建之后的分段和网格
+- 网格空间索引：经纬度按 cell_deg 划分网格，每个网格保存落在其中的点序号，bbox 查询只看相交的网格
+- 轨迹分段：相邻两点间隔超过 gap 秒时开始新的一段；每段增量维护移动距离、持续时间和停留（驻留点）
+- 查询返回的路径在服务端用 Douglas–Peucker 算法按 tolerance（米）简化
+"""
+import math
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from heapq import merge
+from threading import Lock
+
+from rollups import EARTH_RADIUS_M, haversine_m
+from storage import parse_timestamp
+
+
+def _iso(ts):
+    return datetime.fromtimestamp(ts).isoformat()
+
+
+def simplify(points, tolerance):
+    """
+    Douglas–Peucker 折线简化，points 为 [(lat, lon, ts)]，tolerance 为米
+    以首点纬度做等距投影后计算点到线段的距离，返回保留下来的点
+    """
+    n = len(points)
+    if n <= 2 or tolerance <= 0:
+        return list(points)
+    k = math.radians(1) * EARTH_RADIUS_M
+    kx = k * math.cos(math.radians(points[0][0]))
+    xy = [(p[1] * kx, p[0] * k) for p in points]
+    keep = [False] * n
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        ax, ay = xy[first]
+        bx, by = xy[last]
+        dx, dy = bx - ax, by - ay
+        seg2 = dx * dx + dy * dy
+        max_d, index = -1.0, first
+        for i in range(first + 1, last):
+            px, py = xy[i]
+            if seg2 == 0:
+                d = math.hypot(px - ax, py - ay)
+            else:
+                t = max(0.0, min(1.0, ((px - ax) * dx + (py - ay) * dy) / seg2))
+                d = math.hypot(px - ax - t * dx, py - ay - t * dy)
+            if d > max_d:
+                max_d, index = d, i
+        if max_d > tolerance:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [p for p, k in zip(points, keep) if k]
+
+
+class _Segment:
+    """一段连续轨迹的预计算汇总"""
+    __slots__ = ('id', 'first', 'last', 'distance', 'dwells', 'anchor')
+
+    def __init__(self, seg_id, index):
+        self.id = seg_id
+        self.first = index
+        self.last = index
+        self.distance = 0.0
+        self.dwells = []  # [(起始序号, 结束序号)]
+        self.anchor = index  # 当前候选停留的第一个点
+
+
+class TrajectoryIndex:
+    """
+    GPS 轨迹的内存索引，点序号为全局递增的整数（裁剪旧数据后不变）
+    cell_deg: 网格大小（度）；gap: 分段的最大时间间隔（秒）
+    dwell_radius / dwell_seconds: 在 dwell_radius 米内停留超过 dwell_seconds 秒视为一次停留
+    """
+    def __init__(self, cell_deg=0.01, gap=600, dwell_radius=50, dwell_seconds=300):
+        self.cell_deg = cell_deg
+        self.gap = gap
+        self.dwell_radius = dwell_radius
+        self.dwell_seconds = dwell_seconds
+        self._lock = Lock()
+        self._base = 0  # 第一个保留点的全局序号
+        self._ts = []
+        self._lat = []
+        self._lon = []
+        self._seg = []  # 每个点所属段的 id
+        self._cells = {}  # (行, 列) -> [全局序号]（有序）
+        self._segments = []  # _Segment，按 id 递增
+        self._next_segment = 0
+
+    def __len__(self):
+        return len(self._ts)
+
+    @property
+    def latest(self):
+        """最后一个点的时间（epoch 秒），没有点时为 None"""
+        with self._lock:
+            return self._ts[-1] if self._ts else None
+
+    def _cell(self, lat, lon):
+        return (math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg))
+
+    def add(self, record):
+        self.add_many([record])
+
+    def add_many(self, records):
+        points = []
+        for record in records:
+            if not isinstance(record, dict):
+                continue
+            ts = parse_timestamp(record.get('server_received_time'))
+            try:
+                lat = float(record['lat'])
+                lon = float(record['lon'])
+            except (KeyError, TypeError, ValueError):
+                continue
+            if ts is not None:
+                points.append((ts, lat, lon))
+        if not points:
+            return
+        points.sort(key=lambda p: p[0])
+        with self._lock:
+            if self._ts and points[0][0] < self._ts[-1]:
+                # 整批只重放一次
+                points = list(merge(self._rewind(points[0][0]), points, key=lambda p: p[0]))
+            for ts, lat, lon in points:
+                self._add_point(ts, lat, lon)
+
+    def _rewind(self, ts):
+        """
+        为插入时间 ts 的点做准备：从 ts 之前最后一个点所在段的起点截断，
+        撤销该段及之后的分段和网格，返回被截下的点 [(ts, lat, lon)]（有序），由调用方与新点合并后重放
+        """
+        pos = bisect_right(self._ts, ts)
+        if pos == len(self._ts):
+            return []
+        segment = self._find_segment(self._seg[max(pos - 1, 0)])
+        cut = max(segment.first - self._base, 0)
+        tail = list(zip(self._ts[cut:], self._lat[cut:], self._lon[cut:]))
+        del self._ts[cut:]
+        del self._lat[cut:]
+        del self._lon[cut:]
+        del self._seg[cut:]
+        first = self._base + cut
+        for cell in list(self._cells):
+            members = self._cells[cell]
+            del members[bisect_left(members, first):]
+            if not members:
+                del self._cells[cell]
+        self._segments = [s for s in self._segments if s.id < segment.id]
+        self._next_segment = segment.id
+        return tail
+
+    def _add_point(self, ts, lat, lon):
+        index = self._base + len(self._ts)
+        segment = self._segments[-1] if self._segments else None
+        if segment is None or ts - self._ts[-1] > self.gap or ts < self._ts[-1]:
+            if segment is not None:
+                self._close_dwell(segment)
+                segment.anchor = segment.last + 1  # 段已结束，没有未结算的停留
+            segment = _Segment(self._next_segment, index)
+            self._next_segment += 1
+            self._segments.append(segment)
+        else:
+            segment.distance += haversine_m(self._lat[-1], self._lon[-1], lat, lon)
+            segment.last = index
+        self._ts.append(ts)
+        self._lat.append(lat)
+        self._lon.append(lon)
+        self._seg.append(segment.id)
+        self._cells.setdefault(self._cell(lat, lon), []).append(index)
+        # 停留检测：离开候选停留点 dwell_radius 米时结算上一次停留
+        a = segment.anchor - self._base
+        if haversine_m(self._lat[a], self._lon[a], lat, lon) > self.dwell_radius:
+            self._close_dwell(segment, index - 1)
+            segment.anchor = index
+
+    def _close_dwell(self, segment, end=None):
+        end = segment.last if end is None else end
+        start = segment.anchor
+        if end > start and self._ts[end - self._base] - self._ts[start - self._base] >= self.dwell_seconds:
+            segment.dwells.append((start, end))
+
+    def _point(self, index):
+        i = index - self._base
+        return self._lat[i], self._lon[i], self._ts[i]
+
+    def _dwell_summary(self, segment):
+        """段内的停留列表；当前未结束的停留达到时长后也会计入"""
+        dwells = list(segment.dwells)
+        start, end = segment.anchor, segment.last
+        if end > start and self._ts[end - self._base] - self._ts[start - self._base] >= self.dwell_seconds:
+            dwells.append((start, end))
+        result = []
+        for first, last in dwells:
+            if first < self._base:
+                continue
+            lats = self._lat[first - self._base:last - self._base + 1]
+            lons = self._lon[first - self._base:last - self._base + 1]
+            result.append({
+                'lat': round(sum(lats) / len(lats), 7),
+                'lon': round(sum(lons) / len(lons), 7),
+                'start': _iso(self._ts[first - self._base]),
+                'end': _iso(self._ts[last - self._base]),
+                'duration_s': round(self._ts[last - self._base] - self._ts[first - self._base], 1),
+            })
+        return result
+
+    def _segment_summary(self, segment):
+        first = max(segment.first, self._base)
+        dwells = self._dwell_summary(segment)
+        start_ts = self._ts[first - self._base]
+        end_ts = self._ts[segment.last - self._base]
+        return {
+            'id': segment.id,
+            'start': _iso(start_ts),
+            'end': _iso(end_ts),
+            'points': segment.last - first + 1,
+            'distance_m': round(segment.distance, 1),
+            'duration_s': round(end_ts - start_ts, 1),
+            'dwell_s': round(sum(d['duration_s'] for d in dwells), 1),
+            'dwells': dwells,
+        }
+
+    def _find_segment(self, seg_id):
+        ids = [s.id for s in self._segments]
+        i = bisect_left(ids, seg_id)
+        return self._segments[i] if i < len(ids) and ids[i] == seg_id else None
+
+    def query(self, start, end, bbox=None, tolerance=10.0):
+        """
+        查询 [start, end) 内（且落在 bbox 内）的轨迹
+        bbox 为 (min_lat, min_lon, max_lat, max_lon)；返回 {'count', 'vertices', 'paths', 'segments'}
+        paths 中每条为连续的一段点（不跨段、不跨越 bbox 外的点），已按 tolerance 米简化
+        """
+        with self._lock:
+            lo = self._base + bisect_left(self._ts, start)
+            hi = self._base + bisect_left(self._ts, end)
+            if bbox is None:
+                indices = range(lo, hi)
+            else:
+                indices = self._bbox_indices(bbox, lo, hi)
+            runs = []
+            run = []
+            for index in indices:
+                if run and (index != run[-1] + 1 or self._seg[index - self._base] != self._seg[run[-1] - self._base]):
+                    runs.append(run)
+                    run = []
+                run.append(index)
+            if run:
+                runs.append(run)
+            paths = []
+            seg_ids = []
+            for run in runs:
+                seg_id = self._seg[run[0] - self._base]
+                points = [self._point(i) for i in run]
+                simplified = simplify(points, tolerance)
+                paths.append({
+                    'segment': seg_id,
+                    'start': _iso(points[0][2]),
+                    'end': _iso(points[-1][2]),
+                    'distance_m': round(sum(
+                        haversine_m(a[0], a[1], b[0], b[1]) for a, b in zip(points, points[1:])
+                    ), 1),
+                    'points': [[p[0], p[1], _iso(p[2])] for p in simplified],
+                })
+                if not seg_ids or seg_ids[-1] != seg_id:
+                    seg_ids.append(seg_id)
+            segments = []
+            for seg_id in seg_ids:
+                segment = self._find_segment(seg_id)
+                if segment is not None:
+                    segments.append(self._segment_summary(segment))
+        return {
+            'count': sum(len(r) for r in runs),
+            'vertices': sum(len(p['points']) for p in paths),
+            'paths': paths,
+            'segments': segments,
+        }
+
+    def _bbox_indices(self, bbox, lo, hi):
+        min_lat, min_lon, max_lat, max_lon = bbox
+        r0, c0 = self._cell(min_lat, min_lon)
+        r1, c1 = self._cell(max_lat, max_lon)
+        if (r1 - r0 + 1) * (c1 - c0 + 1) <= len(self._cells):
+            cells = ((r, c) for r in range(r0, r1 + 1) for c in range(c0, c1 + 1))
+        else:
+            # bbox 很大时直接遍历已有的网格
+            cells = (cell for cell in self._cells if r0 <= cell[0] <= r1 and c0 <= cell[1] <= c1)
+        result = []
+        for cell in cells:
+            members = self._cells.get(cell)
+            if not members:
+                continue
+            for index in members[bisect_left(members, lo):bisect_left(members, hi)]:
+                i = index - self._base
+                if min_lat <= self._lat[i] <= max_lat and min_lon <= self._lon[i] <= max_lon:
+                    result.append(index)
+        result.sort()
+        return result
+
+    def prune(self, cutoff):
+        """丢弃早于 cutoff 的点；结束于 cutoff 之前的段一并删除"""
+        with self._lock:
+            drop = bisect_left(self._ts, cutoff)
+            if not drop:
+                return 0
+            self._base += drop
+            del self._ts[:drop]
+            del self._lat[:drop]
+            del self._lon[:drop]
+            del self._seg[:drop]
+            for cell in list(self._cells):
+                members = self._cells[cell]
+                del members[:bisect_left(members, self._base)]
+                if not members:
+                    del self._cells[cell]
+            self._segments = [s for s in self._segments if s.last >= self._base]
+            for segment in self._segments:
+                segment.dwells = [d for d in segment.dwells if d[0] >= self._base]
+                segment.anchor = max(segment.anchor, self._base)
+            return drop